@@ -0,0 +1,3 @@
+from flkl.cli import main
+
+main()
@@ -0,0 +1,143 @@
+from collections import defaultdict
+from math import sqrt
+from statistics import NormalDist
+from typing import NamedTuple, Optional
+
+from amas.agent import Agent, NotWorkingError
+
+ANALYZER = "ANALYZER"
+
+_normal = NormalDist()
+
+
+# Sent by the controller once per trial. `nlick` is None for trials without
+# a response window; `latency` is the first lick after stimulus onset (sec).
+class Outcome(NamedTuple):
+    trial: int
+    modality: int
+    vhz: float
+    ahz: float
+    go: bool
+    nlick: Optional[int]
+    latency: Optional[float]
+
+
+class RunningStats:
+    __slots__ = ("trials", "go", "hits", "nogo", "false_alarms", "responses", "mean", "m2")
+
+    def __init__(self):
+        self.trials = 0
+        self.go = 0
+        self.hits = 0
+        self.nogo = 0
+        self.false_alarms = 0
+        self.responses = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, go: bool, responded: Optional[bool], latency: Optional[float]):
+        self.trials += 1
+        if responded is None:
+            return
+        if go:
+            self.go += 1
+            self.hits += responded
+        else:
+            self.nogo += 1
+            self.false_alarms += responded
+        if latency is not None:
+            # Welford's update of the latency mean and variance
+            self.responses += 1
+            delta = latency - self.mean
+            self.mean += delta / self.responses
+            self.m2 += delta * (latency - self.mean)
+
+    def hit_rate(self) -> Optional[float]:
+        return self.hits / self.go if self.go else None
+
+    def fa_rate(self) -> Optional[float]:
+        return self.false_alarms / self.nogo if self.nogo else None
+
+    def dprime(self) -> Optional[float]:
+        if not self.go or not self.nogo:
+            return None
+        # log-linear correction keeps rates of 0 and 1 finite
+        hit = (self.hits + 0.5) / (self.go + 1)
+        fa = (self.false_alarms + 0.5) / (self.nogo + 1)
+        return _normal.inv_cdf(hit) - _normal.inv_cdf(fa)
+
+    def summary(self) -> dict:
+        sd = sqrt(self.m2 / (self.responses - 1)) if self.responses > 1 else None
+        return {
+            "trials": self.trials,
+            "hit_rate": self.hit_rate(),
+            "fa_rate": self.fa_rate(),
+            "dprime": self.dprime(),
+            "latency_mean": self.mean if self.responses else None,
+            "latency_sd": sd,
+        }
+
+
+def stimulus_frequency(outcome: Outcome) -> float:
+    return outcome.vhz if outcome.vhz else outcome.ahz
+
+
+# A trial counts as responded to by the task's own reward rule, `nlick >=
+# required-lick`; with `required-lick: 0` every trial with a window does.
+class Analytics:
+    def __init__(self, required_lick: int = 1):
+        self.required_lick = required_lick
+        self.overall = RunningStats()
+        self.by_modality: defaultdict[int, RunningStats] = defaultdict(RunningStats)
+        self.by_frequency: defaultdict[float, RunningStats] = defaultdict(RunningStats)
+        self.last: Optional[Outcome] = None
+
+    def add(self, outcome: Outcome):
+        responded = None if outcome.nlick is None else outcome.nlick >= self.required_lick
+        for stats in (
+            self.overall,
+            self.by_modality[outcome.modality],
+            self.by_frequency[stimulus_frequency(outcome)],
+        ):
+            stats.add(outcome.go, responded, outcome.latency)
+        self.last = outcome
+
+    def snapshot(self) -> dict:
+        return {
+            "overall": self.overall.summary(),
+            "modality": {k: v.summary() for k, v in sorted(self.by_modality.items())},
+            "frequency": {k: v.summary() for k, v in sorted(self.by_frequency.items())},
+        }
+
+    def summary_line(self) -> str:
+        s = self.overall.summary()
+        fields = [f"Trials: {s['trials']}"]
+        for name, key in (("Hit", "hit_rate"), ("FA", "fa_rate"), ("d'", "dprime"), ("Latency", "latency_mean")):
+            if s[key] is not None:
+                fields.append(f"{name}: {s[key]:.3f}")
+        return "    ".join(fields)
+
+    def dump(self, path: str):
+        import json
+
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+async def analyze(agent: Agent, analytics: Analytics, interval: float = 30.0):
+    from time import perf_counter
+
+    next_summary = perf_counter() + interval
+    try:
+        while agent.working():
+            mail = await agent.try_recv(max(0.0, next_summary - perf_counter()))
+            if mail is not None:
+                _, mess = mail
+                if isinstance(mess, Outcome):
+                    analytics.add(mess)
+            if perf_counter() >= next_summary:
+                print(analytics.summary_line())
+                next_summary += interval
+    except NotWorkingError:
+        pass
+    print(analytics.summary_line())
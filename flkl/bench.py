@@ -0,0 +1,397 @@
+from collections import deque
+from typing import Callable, NamedTuple, Optional
+
+# Micro-benchmarks of the host-side hot paths. The reader benchmarks drain a
+# pre-filled `SimulatedBoard`, and the agent-driven ones run the real tasks
+# against `BenchAgent`, so the numbers exclude amas scheduling and only move
+# when the parsing, dispatch or recording code itself changes.
+#
+# Every result has a `value` (lower is better) used for regression checks
+# against a previous JSON report, and absolute `BUDGETS` for the paths that
+# bound the reward latency of a session.
+
+DEFAULT_TOLERANCE = 0.25
+
+# Upper limits of `value`, whatever the baseline says.
+BUDGETS = {
+    "as_eventtime": 2_000.0,  # ns per line
+    "read/ascii": 50_000.0,  # ns per event
+    "read/binary-batch": 20_000.0,
+    "window/wakeup": 2_000.0,  # us, p99 from mail to the contingency
+    "deadline/overshoot": 5_000.0,  # us, p99 past a 5 ms window
+}
+
+
+class Benchmark(NamedTuple):
+    name: str
+    run: Callable[[int], dict]
+    number: int
+    unit: str
+
+
+# Stand-in for `amas.agent.Agent` serving mail from a local queue. It stops
+# working once the queue and the board it reads from are both drained.
+class BenchAgent:
+    def __init__(self, mails=(), board=None, forever: bool = False):
+        self.mailbox: deque = deque(("BENCH", mail) for mail in mails)
+        self.board = board
+        self.forever = forever
+        self.sent = 0
+        self._waiter = None
+
+    def working(self) -> bool:
+        if self.forever:
+            return True
+        return bool(self.mailbox) or (self.board is not None and self.board.in_waiting > 0)
+
+    def send_to(self, to: str, message):
+        self.sent += 1
+
+    def put(self, message):
+        self.mailbox.append(("BENCH", message))
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def call_async(self, f, *args):
+        return f(*args)
+
+    async def try_recv(self, timeout: float):
+        import asyncio
+
+        if not self.mailbox:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.mailbox.popleft()
+
+
+# A connection that accepts and forgets every write.
+class NullConnection:
+    in_waiting = 0
+
+    def write(self, data) -> int:
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def per_op(elapsed_ns: int, number: int) -> dict:
+    return {"value": elapsed_ns / number, "ns_per_op": elapsed_ns / number}
+
+
+def micros_percentiles(samples_ns: list[int]) -> dict:
+    from flkl.sim import percentiles
+
+    summary = percentiles([ns / 1000 for ns in samples_ns])
+    return {**summary, "value": summary.get("p99", 0.0)}
+
+
+def ascii_stream(number: int, pin: int = 6) -> bytes:
+    return b"".join(f"{pin}{1000 * i}\r\n".encode() for i in range(number))
+
+
+def binary_stream(number: int, pin: int = 6) -> bytes:
+    from struct import pack
+
+    from flkl.share import EVENT_FRAME_OFFSET, EVENT_FRAME_SYNC
+
+    return b"".join(
+        pack("<BIB", pin | (EVENT_FRAME_OFFSET if i % 2 else 0), 1000 * i, EVENT_FRAME_SYNC)
+        for i in range(number)
+    )
+
+
+def bench_as_eventtime(number: int) -> dict:
+    from time import perf_counter_ns
+
+    from flkl.share import as_eventtime
+
+    lines = [f"{6 + i % 2}{1000 * i}" for i in range(number)]
+    start = perf_counter_ns()
+    for line in lines:
+        as_eventtime(line)
+    return per_op(perf_counter_ns() - start, number)
+
+
+def bench_decode(decode: str) -> Callable[[int], dict]:
+    def run(number: int) -> dict:
+        from time import perf_counter_ns
+
+        from flkl import share
+
+        buffer = binary_stream(number) if decode == "frames" else ascii_stream(number)
+        start = perf_counter_ns()
+        getattr(share, f"decode_{decode}")(buffer)
+        return per_op(perf_counter_ns() - start, number)
+
+    return run
+
+
+# The whole `read` task over a board holding `number` pending events.
+def bench_read(protocol: str, batch: bool) -> Callable[[int], dict]:
+    def run(number: int) -> dict:
+        import asyncio
+        from time import perf_counter_ns
+
+        from pyno.ino import ArduinoLineReader
+
+        from flkl.share import read
+        from flkl.sim import SimulatedBoard
+
+        board = SimulatedBoard(protocol=protocol, timeout=0.0)
+        board._push(binary_stream(number) if protocol == "binary" else ascii_stream(number))
+        agent = BenchAgent(board=board)
+        expvars = {"response-pin": [6, 7]}
+        start = perf_counter_ns()
+        asyncio.run(read(agent, ArduinoLineReader(board), expvars, protocol=protocol, batch=batch))
+        return per_op(perf_counter_ns() - start, number)
+
+    return run
+
+
+def bench_encode(command: str) -> Callable[[int], dict]:
+    args = {
+        "flick_for": (12, 12.5, 2000, 6, 100, 20),
+        "start_flicker": (0, 12, 12.5, 2.0, 6, 0.1),
+        "enqueue_trial": (12, 13, 12.5, 12.5, 2000, 6, 100, 15000, 20),
+    }[command]
+
+    def run(number: int) -> dict:
+        from time import perf_counter_ns
+
+        from flkl.share import Flkl
+
+        ino = Flkl(NullConnection(), handshake=False)
+        send = getattr(ino, command)
+        start = perf_counter_ns()
+        for _ in range(number):
+            send(*args)
+        return per_op(perf_counter_ns() - start, number)
+
+    return run
+
+
+# Per-event cost of `count_lick` with every mail already delivered.
+def bench_count_lick(number: int) -> dict:
+    import asyncio
+    from time import perf_counter_ns
+
+    from flkl.share import count_lick
+
+    agent = BenchAgent([6 + i % 2 for i in range(number)])
+    start = perf_counter_ns()
+    asyncio.run(count_lick(agent, 3600.0, 6))
+    return per_op(perf_counter_ns() - start, number)
+
+
+# Time from a mail arriving to the contingency seeing it, with the window
+# asleep in `try_recv` in between.
+def bench_wakeup(number: int) -> dict:
+    import asyncio
+    from time import perf_counter_ns
+
+    from flkl.share import Deadline, window
+
+    agent = BenchAgent(forever=True)
+    delays: list[int] = []
+
+    async def produce():
+        for _ in range(number):
+            await asyncio.sleep(0.001)
+            agent.put(perf_counter_ns())
+
+    async def consume():
+        async for sent in window(agent, Deadline(3600.0)):
+            delays.append(perf_counter_ns() - sent)
+            if len(delays) == number:
+                return
+
+    async def main():
+        await asyncio.gather(produce(), consume())
+
+    asyncio.run(main())
+    return micros_percentiles(delays)
+
+
+# How late `flush_message_for` returns from a quiet 5 ms window.
+def bench_overshoot(number: int) -> dict:
+    import asyncio
+    from time import perf_counter_ns
+
+    from flkl.share import flush_message_for
+
+    agent = BenchAgent(forever=True)
+    late: list[int] = []
+
+    async def main():
+        for _ in range(number):
+            start = perf_counter_ns()
+            await flush_message_for(agent, 0.005)
+            late.append(max(0, perf_counter_ns() - start - 5_000_000))
+
+    asyncio.run(main())
+    return micros_percentiles(late)
+
+
+def event_rows(number: int, size: int = 64) -> list[list[tuple[int, int]]]:
+    rows = [(1000 * i, 6 + i % 2) for i in range(number)]
+    return [rows[i : i + size] for i in range(0, number, size)]
+
+
+def bench_record(sink: Optional[str]) -> Callable[[int], dict]:
+    def run(number: int) -> dict:
+        import asyncio
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        from time import perf_counter_ns
+
+        from flkl.recorder import record_columns
+        from flkl.share import record
+
+        agent = BenchAgent(event_rows(number))
+        with TemporaryDirectory() as directory:
+            filename = join(directory, "bench")
+            task = record(agent, filename) if sink is None else record_columns(agent, filename, sink)
+            start = perf_counter_ns()
+            asyncio.run(task)
+            elapsed = perf_counter_ns() - start
+        return {**per_op(elapsed, number), "rows_per_sec": number / elapsed * 1e9}
+
+    return run
+
+
+# Per-event cost of publishing decoded chunks on the event bus, read back
+# by a reader in the same process after every chunk.
+def bench_bus(number: int) -> dict:
+    from os import getpid
+    from time import perf_counter_ns
+
+    from flkl.bus import EventBus, EventBusReader
+
+    chunks = [(list(events), list(micros)) for events, micros in
+              (zip(*[(event, time) for time, event in rows]) for rows in event_rows(number))]
+    bus = EventBus(f"flkl-bench-{getpid()}", 4096)
+    reader = EventBusReader(bus.name)
+    try:
+        received = 0
+        start = perf_counter_ns()
+        for events, micros in chunks:
+            bus.publish_events(events, micros)
+            received += len(reader.poll())
+        elapsed = perf_counter_ns() - start
+    finally:
+        reader.close()
+        bus.close()
+    if received != number:
+        raise RuntimeError(f"The bus delivered {received} of {number} events.")
+    return per_op(elapsed, number)
+
+
+def bench_schedule(number: int) -> dict:
+    from time import perf_counter_ns
+
+    from flkl.schedule import compile_schedule
+
+    expvars = {"trials-per-stimulus": 20}
+    start = perf_counter_ns()
+    for seed in range(number):
+        compile_schedule(expvars, "gng", seed)
+    return per_op(perf_counter_ns() - start, number)
+
+
+BENCHMARKS = [
+    Benchmark("as_eventtime", bench_as_eventtime, 100_000, "ns"),
+    Benchmark("decode/lines", bench_decode("lines"), 100_000, "ns"),
+    Benchmark("decode/frames", bench_decode("frames"), 100_000, "ns"),
+    Benchmark("read/ascii", bench_read("ascii", False), 20_000, "ns"),
+    Benchmark("read/ascii-batch", bench_read("ascii", True), 20_000, "ns"),
+    Benchmark("read/binary", bench_read("binary", False), 20_000, "ns"),
+    Benchmark("read/binary-batch", bench_read("binary", True), 20_000, "ns"),
+    Benchmark("encode/flick_for", bench_encode("flick_for"), 100_000, "ns"),
+    Benchmark("encode/start_flicker", bench_encode("start_flicker"), 100_000, "ns"),
+    Benchmark("encode/enqueue_trial", bench_encode("enqueue_trial"), 100_000, "ns"),
+    Benchmark("count_lick", bench_count_lick, 50_000, "ns"),
+    Benchmark("window/wakeup", bench_wakeup, 500, "us"),
+    Benchmark("deadline/overshoot", bench_overshoot, 200, "us"),
+    Benchmark("record/text", bench_record(None), 100_000, "ns"),
+    Benchmark("record/tdms", bench_record("tdms"), 100_000, "ns"),
+    Benchmark("bus/publish", bench_bus, 100_000, "ns"),
+    Benchmark("schedule/gng", bench_schedule, 200, "ns"),
+]
+
+
+# Best of `repeat` runs, so one-off interference from the OS does not count.
+def run_benchmarks(only: Optional[list[str]] = None, repeat: int = 5, scale: float = 1.0) -> dict:
+    import platform
+    from datetime import datetime
+
+    results = {}
+    for bench in BENCHMARKS:
+        if only and not any(bench.name.startswith(prefix) for prefix in only):
+            continue
+        number = max(1, int(bench.number * scale))
+        runs = [bench.run(number) for _ in range(repeat)]
+        best = min(runs, key=lambda r: r["value"])
+        results[bench.name] = {**best, "unit": bench.unit, "number": number, "repeat": repeat}
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "node": platform.node(),
+        },
+        "results": results,
+    }
+
+
+def regressions(report: dict, baseline: Optional[dict] = None,
+                tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    found = []
+    for name, result in report["results"].items():
+        budget = BUDGETS.get(name)
+        if budget is not None and result["value"] > budget:
+            found.append(f"{name}: {result['value']:.1f} {result['unit']} over the budget of {budget:.1f}")
+        if baseline is None or name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["value"]
+        if result["value"] > before * (1.0 + tolerance):
+            found.append(
+                f"{name}: {result['value']:.1f} {result['unit']} vs {before:.1f} "
+                f"(+{(result['value'] / before - 1.0) * 100:.0f}%)"
+            )
+    return found
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description="Benchmark the host-side hot paths.")
+    parser.add_argument("only", nargs="*", help="Run only benchmarks whose names start with these")
+    parser.add_argument("--output", "-o", default=None, help="Path of the JSON report")
+    parser.add_argument("--baseline", "-b", default=None, help="JSON report to check for regressions")
+    parser.add_argument("--tolerance", "-t", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--repeat", "-r", type=int, default=5, help="Runs per benchmark")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier of the operations per run")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.only, args.repeat, args.scale)
+    for name, result in report["results"].items():
+        print(f"{name:24s} {result['value']:12.1f} {result['unit']}")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    found = regressions(report, baseline, args.tolerance)
+    for line in found:
+        print(f"Regression: {line}")
+    sys.exit(1 if found else 0)
@@ -0,0 +1,146 @@
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Optional
+
+from flkl.bridged import DATA, FRAME, PING, PONG, frames, no_delay, parse_address
+
+# The client end of the bridge daemon in `flkl.bridged`: `RemoteConnection`
+# stands in for the pyserial connection of `Flkl` and `ArduinoLineReader`
+# when their board is attached to another host.
+
+
+class RemoteConnection:
+    def __init__(self, address: str, timeout: Optional[float] = 1.0, ping_interval: Optional[float] = None):
+        from socket import create_connection
+
+        self.port = address
+        self.timeout = timeout
+        self.rtts: deque = deque(maxlen=4096)
+        self._sock = create_connection(parse_address(address))
+        no_delay(self._sock)
+        self._rx = bytearray()
+        self._cond = Condition()
+        # the pinger and the writer share the socket; a frame is never split
+        self._send = Lock()
+        self._running = True
+        self._receiver = Thread(target=self._receive, daemon=True)
+        self._receiver.start()
+        self._pinger: Optional[Thread] = None
+        if ping_interval is not None:
+            self._pinger = Thread(target=self._ping_every, args=(ping_interval,), daemon=True)
+            self._pinger.start()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._rx)
+
+    # Buffered bytes are still handed out once the bridge is gone; after that
+    # reads raise, as `SerialTransport` does for an unplugged port, instead of
+    # returning b"" at once and spinning the reader.
+    def read(self, size: int = 1) -> bytes:
+        with self._cond:
+            self._cond.wait_for(lambda: self._rx or not self._running, self.timeout)
+            if not self._rx and not self._running:
+                raise ConnectionError(f"Bridge {self.port} closed the connection.")
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+        return data
+
+    def readline(self) -> bytes:
+        with self._cond:
+            self._cond.wait_for(lambda: b"\n" in self._rx or not self._running, self.timeout)
+            end = self._rx.find(b"\n") + 1
+            if end == 0 and not self._running:
+                raise ConnectionError(f"Bridge {self.port} closed the connection.")
+            data = bytes(self._rx[:end])
+            del self._rx[:end]
+        return data
+
+    def write(self, data) -> int:
+        message = frames(DATA, bytes(data))
+        with self._send:
+            self._sock.sendall(message)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def ping(self):
+        from time import perf_counter_ns
+
+        with self._send:
+            self._sock.sendall(frames(PING, perf_counter_ns().to_bytes(8, "little")))
+
+    def _ping_every(self, interval: float):
+        from time import sleep
+
+        while self._running:
+            try:
+                self.ping()
+            except OSError:
+                break
+            sleep(interval)
+
+    def _receive_exactly(self, size: int) -> Optional[bytes]:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return bytes(data)
+
+    def _receive(self):
+        from time import perf_counter_ns
+
+        try:
+            while self._running:
+                header = self._receive_exactly(FRAME.size)
+                if header is None:
+                    break
+                kind, size = FRAME.unpack(header)
+                payload = self._receive_exactly(size)
+                if payload is None:
+                    break
+                if kind == DATA:
+                    with self._cond:
+                        self._rx += payload
+                        self._cond.notify_all()
+                elif kind == PONG:
+                    self.rtts.append(perf_counter_ns() - int.from_bytes(payload, "little"))
+        except OSError:
+            pass
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+
+    def summary(self) -> dict:
+        from flkl.sim import percentiles
+
+        return {"address": self.port, "rtt_ms": percentiles([ns / 1e6 for ns in self.rtts])}
+
+    def close(self):
+        from socket import SHUT_RDWR
+
+        self._running = False
+        try:
+            self._sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._receiver.join()
+
+
+def probe(address: str, n: int = 1000, interval: float = 0.001) -> dict:
+    from time import sleep
+
+    remote = RemoteConnection(address)
+    try:
+        for _ in range(n):
+            remote.ping()
+            sleep(interval)
+        sleep(0.1)
+        return remote.summary()
+    finally:
+        remote.close()
@@ -0,0 +1,137 @@
+from struct import Struct
+
+# The bridge daemon (`python -m flkl.bridged`), which exposes the serial ports
+# of a box over TCP so task logic can run on another host than the boards.
+# It serves one serial port per TCP port; `flkl.bridge.RemoteConnection` is
+# the client end. Only the standard library, pyserial and `flkl.transport`
+# are imported here, so the box needs neither amas nor pyno.
+#
+# Both directions carry frames of kind (u8), payload length (u16 LE) and
+# payload. The bridge sends everything the port has buffered per wake-up as
+# one DATA frame, and answers PING with a PONG echoing the payload, which the
+# client uses to measure round trips. Nagle's algorithm is off on both ends.
+FRAME = Struct("<BH")
+DATA = 0
+PING = 1
+PONG = 2
+MAX_PAYLOAD = 0xFFFF
+
+
+def frames(kind: int, payload: bytes) -> bytes:
+    view = memoryview(payload)
+    return b"".join(
+        FRAME.pack(kind, len(view[i : i + MAX_PAYLOAD])) + view[i : i + MAX_PAYLOAD]
+        for i in range(0, max(1, len(view)), MAX_PAYLOAD)
+    )
+
+
+def parse_address(address: str, default_host: str = "127.0.0.1") -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or default_host, int(port)
+
+
+def no_delay(sock):
+    from socket import IPPROTO_TCP, TCP_NODELAY
+
+    sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+
+# `flkl.share.read_available`, without importing pyno through `flkl.share`
+def read_available(connection) -> bytes:
+    return connection.read(max(1, connection.in_waiting))
+
+
+# Serves `connection` (a pyserial port or a `SimulatedBoard`) to one client
+# at a time; a new client replaces the previous one.
+async def serve_port(connection, address: str):
+    import asyncio
+
+    from flkl.transport import open_transport
+
+    transport = open_transport(connection)
+    loop = asyncio.get_running_loop()
+    current: list = [None]
+
+    async def pump(writer):
+        while True:
+            if transport is not None:
+                data = await transport.read(1.0)
+            else:
+                data = await loop.run_in_executor(None, read_available, connection)
+            if data:
+                writer.write(frames(DATA, data))
+                await writer.drain()
+
+    async def handle(reader, writer):
+        no_delay(writer.get_extra_info("socket"))
+        if current[0] is not None:
+            current[0].cancel()
+        task = current[0] = asyncio.create_task(pump(writer))
+        peer = writer.get_extra_info("peername")
+        print(f"Bridge {address}: client {peer} connected")
+        try:
+            while True:
+                kind, size = FRAME.unpack(await reader.readexactly(FRAME.size))
+                payload = await reader.readexactly(size)
+                if kind == DATA:
+                    (connection if transport is None else transport).write(payload)
+                elif kind == PING:
+                    writer.write(frames(PONG, payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            task.cancel()
+            writer.close()
+            print(f"Bridge {address}: client {peer} disconnected")
+
+    host, port = parse_address(address, "0.0.0.0")
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Bridge {address}: serving {getattr(connection, 'port', 'simulated board')}")
+    async with server:
+        await server.serve_forever()
+
+
+async def serve(ports: list[tuple]):
+    import asyncio
+
+    await asyncio.gather(*(serve_port(connection, address) for connection, address in ports))
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Expose serial ports over TCP, or probe a bridge.")
+    parser.add_argument("--serial", "-s", action="append", default=[], metavar="DEVICE[@BAUD]=[HOST:]PORT",
+                        help="Serve a serial port, e.g. /dev/ttyACM0@115200=5000")
+    parser.add_argument("--simulate", action="append", default=[], metavar="[HOST:]PORT",
+                        help="Serve a simulated board licking on pin 6")
+    parser.add_argument("--rate", type=float, default=5.0, help="Licks per second of simulated boards")
+    parser.add_argument("--protocol", default="binary", help="Event format of simulated boards")
+    parser.add_argument("--probe", "-p", default=None, metavar="HOST:PORT",
+                        help="Measure the round trip to a running bridge")
+    args = parser.parse_args()
+
+    if args.probe is not None:
+        from flkl.bridge import probe
+
+        print(probe(args.probe))
+    else:
+        from serial import Serial
+
+        ports = []
+        for spec in args.serial:
+            device, address = spec.rsplit("=", 1)
+            device, _, baudrate = device.partition("@")
+            ports.append((Serial(device, int(baudrate or 115200), timeout=1.0), address))
+        if args.simulate:
+            # the simulator needs amas; serving real ports does not
+            from flkl.sim import SimulatedBoard
+        for address in args.simulate:
+            ports.append((SimulatedBoard({6: args.rate}, args.protocol).start(), address))
+        if not ports:
+            parser.error("nothing to serve")
+        try:
+            asyncio.run(serve(ports))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,266 @@
+from struct import Struct
+from threading import Lock
+from time import perf_counter_ns
+from typing import Optional
+
+# Events and stimulus commands of a session published to other processes on
+# the same host (video, photometry, ephys acquisition) through a ring buffer
+# of fixed-size records in shared memory. There is one writer, the session,
+# and any number of readers, each with its own cursor; neither side locks or
+# waits for the other, and a reader that falls a full ring behind loses the
+# oldest records instead of slowing the session down.
+#
+# Layout: a 64-byte header (magic, version, record size, capacity, records
+# written so far, pid of the writer) followed by `capacity` 64-byte records:
+#
+#   seq      u64  1 + index of the record; 0 while the writer fills the slot
+#   host_ns  i64  `perf_counter_ns()` of the host, i.e. CLOCK_MONOTONIC
+#   micros   i64  board time of events, HOST_MICROS for commands
+#   event    i32  event code as recorded, or the command opcode
+#   kind     u16  EVENT or COMMAND
+#   size     u16  bytes used in payload
+#   payload  32s  encoded arguments of a command
+#
+# A record is complete once its `seq` is written, and the header count is
+# advanced only after that, so readers check `seq` before and after copying
+# a slot to tell a record the writer lapped during the copy.
+HEADER = Struct("<4sHHQQQ")
+HEADER_SIZE = 64
+COUNT = Struct("<Q")
+COUNT_OFFSET = 16
+RECORD = Struct("<QqqiHH32s")
+MAGIC = b"FLKB"
+VERSION = 1
+DEFAULT_CAPACITY = 1 << 16
+
+EVENT = 0
+COMMAND = 1
+# `micros` of records without board time, as `flkl.share.HOST_MICROS`; the
+# bus does not import share so readers load neither amas nor pyno.
+HOST_MICROS = -1
+
+# Names of the buses created by this process.
+_created: set[str] = set()
+
+
+def record_dtype():
+    import numpy as np
+
+    return np.dtype([
+        ("seq", "<u8"), ("host_ns", "<i8"), ("micros", "<i8"), ("event", "<i4"),
+        ("kind", "<u2"), ("size", "<u2"), ("payload", "V32"),
+    ])
+
+
+# The encoded arguments of a command record. Payloads are raw bytes that may
+# end in NULs (e.g. a zero duration), so they are cut by `size`, never by the
+# first NUL as a numpy string field would.
+def payload(record) -> bytes:
+    return bytes(record["payload"])[: record["size"]]
+
+
+def bus_size(capacity: int) -> int:
+    return HEADER_SIZE + capacity * RECORD.size
+
+
+# The process publishing on the bus in `shm`, or None when it is not an flkl
+# event bus or predates the pid in its header.
+def writer_pid(shm) -> Optional[int]:
+    if len(shm.buf) < HEADER.size:
+        return None
+    magic, _, _, _, _, pid = HEADER.unpack_from(shm.buf, 0)
+    if magic != MAGIC or pid == 0:
+        return None
+    return pid
+
+
+def process_alive(pid: int) -> bool:
+    import os
+    import sys
+
+    if sys.platform == "win32":
+        # os.kill would signal the process; a segment there also goes away
+        # with its last handle, so one that exists is in use
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class EventBus:
+    def __init__(self, name: str, capacity: int = DEFAULT_CAPACITY):
+        from multiprocessing.shared_memory import SharedMemory
+        from os import getpid
+
+        if capacity < 1:
+            raise ValueError("The event bus needs room for at least one record.")
+        try:
+            self.shm = SharedMemory(name, create=True, size=bus_size(capacity))
+        except FileExistsError:
+            existing = attach(name)
+            try:
+                writer = writer_pid(existing)
+            finally:
+                existing.close()
+            if writer is not None and process_alive(writer):
+                raise RuntimeError(f"Event bus `{name}` is in use by process {writer}; "
+                                   "give this session another `event-bus` name.")
+            # left over by a session that did not shut down
+            print(f"Event bus: replacing the stale shared memory `{name}`")
+            stale = SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = SharedMemory(name, create=True, size=bus_size(capacity))
+        _created.add(name)
+        self.name = name
+        self.capacity = capacity
+        self.count = 0
+        self._buf = self.shm.buf
+        self._lock = Lock()
+        HEADER.pack_into(self._buf, 0, MAGIC, VERSION, RECORD.size, capacity, 0, getpid())
+
+    def _put(self, host_ns: int, micros: int, event: int, kind: int, payload: bytes):
+        n = self.count
+        offset = HEADER_SIZE + (n % self.capacity) * RECORD.size
+        RECORD.pack_into(self._buf, offset, 0, host_ns, micros, event, kind, len(payload), payload)
+        COUNT.pack_into(self._buf, offset, n + 1)
+        self.count = n + 1
+
+    # The reader and `Flkl` share the bus, so writes are serialized in this
+    # process; readers in other processes never take the lock.
+    def publish(self, event: int, micros: int, kind: int = EVENT, payload: bytes = b"",
+                host_ns: Optional[int] = None):
+        with self._lock:
+            self._put(perf_counter_ns() if host_ns is None else host_ns, micros, event, kind, payload)
+            COUNT.pack_into(self._buf, COUNT_OFFSET, self.count)
+
+    def publish_events(self, events: list[int], micros: list[int], host_ns: Optional[int] = None):
+        if host_ns is None:
+            host_ns = perf_counter_ns()
+        pack_record, pack_count = RECORD.pack_into, COUNT.pack_into
+        buf, capacity = self._buf, self.capacity
+        with self._lock:
+            n = self.count
+            for event, time in zip(events, micros):
+                offset = HEADER_SIZE + (n % capacity) * RECORD.size
+                pack_record(buf, offset, 0, host_ns, time, event, EVENT, 0, b"")
+                n += 1
+                pack_count(buf, offset, n)
+            self.count = n
+            pack_count(buf, COUNT_OFFSET, n)
+
+    def publish_command(self, opcode: int, payload, host_ns: Optional[int] = None):
+        self.publish(opcode, HOST_MICROS, COMMAND, bytes(payload), host_ns)
+
+    def close(self):
+        self._buf = None
+        self.shm.close()
+        self.shm.unlink()
+        _created.discard(self.name)
+
+
+class EventBusReader:
+    def __init__(self, name: str, from_start: bool = False):
+        import numpy as np
+
+        self.shm = attach(name)
+        magic, version, record_size, capacity, count, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.shm.close()
+            raise RuntimeError(f"`{name}` is not an flkl event bus of version {VERSION}.")
+        self.name = name
+        self.capacity = capacity
+        self.records = np.ndarray((capacity,), record_dtype(), self.shm.buf, HEADER_SIZE)
+        self.cursor = max(0, count - capacity) if from_start else count
+        self.lost = 0
+
+    def written(self) -> int:
+        return COUNT.unpack_from(self.shm.buf, COUNT_OFFSET)[0]
+
+    # Records published since the last call, oldest first, as a structured
+    # array copied out of the ring. Records the writer overwrote before they
+    # were read are counted in `lost`.
+    def poll(self, limit: Optional[int] = None):
+        import numpy as np
+
+        head = self.written()
+        if head - self.cursor > self.capacity:
+            self.lost += head - self.capacity - self.cursor
+            self.cursor = head - self.capacity
+        if limit is not None:
+            head = min(head, self.cursor + limit)
+        expected = np.arange(self.cursor + 1, head + 1, dtype=np.uint64)
+        slots = (expected - 1) % self.capacity
+        batch = self.records.take(slots)
+        valid = (batch["seq"] == expected) & (self.records["seq"].take(slots) == expected)
+        self.lost += len(batch) - int(valid.sum())
+        self.cursor = head
+        return batch if valid.all() else batch[valid]
+
+    # Spins on the header until something is published; `interval` > 0
+    # sleeps between checks instead, trading latency for CPU.
+    def wait(self, timeout: Optional[float] = None, interval: float = 0.0):
+        from time import perf_counter, sleep
+
+        deadline = None if timeout is None else perf_counter() + timeout
+        while self.written() == self.cursor:
+            if deadline is not None and perf_counter() >= deadline:
+                break
+            if interval > 0.0:
+                sleep(interval)
+        return self.poll()
+
+    def close(self):
+        self.records = None
+        self.shm.close()
+
+
+# Readers must not unlink the segment when they exit, which the resource
+# tracker of Python < 3.13 does for every segment a process opened. The
+# writer's own registration is left alone when both live in one process.
+def attach(name: str):
+    from multiprocessing.shared_memory import SharedMemory
+
+    try:
+        return SharedMemory(name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+
+        shm = SharedMemory(name)
+        if name not in _created:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def describe(record) -> str:
+    from flkl.command import COMMANDS
+
+    if record["kind"] == COMMAND:
+        names = {c.opcode: c.name for c in COMMANDS}
+        name = names.get(int(record["event"]), hex(int(record["event"])))
+        return f"{record['host_ns'] / 1e9:.6f} command {name} {payload(record).hex()}"
+    return f"{record['host_ns'] / 1e9:.6f} event {record['event']} at {record['micros']} us"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the records published on an event bus.")
+    parser.add_argument("name", help="Name of the bus, the `event-bus` of the session config")
+    parser.add_argument("--from-start", action="store_true", help="Print the records still in the ring first")
+    args = parser.parse_args()
+
+    reader = EventBusReader(args.name, args.from_start)
+    try:
+        while True:
+            for record in reader.wait(1.0, 0.001):
+                print(describe(record))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{reader.lost} records lost")
+        reader.close()
@@ -0,0 +1,117 @@
+import sys
+
+# Entry point of the `flkl` command. Task scripts are run as `__main__` only
+# once their subcommand is chosen, so `flkl list-boards` never imports amas,
+# utex, pyno, numpy or pandas. `flkl --import-time <command> ...` runs the
+# command under `-X importtime` and reports where the start-up time went.
+
+# Subcommand -> module run with the remaining arguments.
+SCRIPTS = {
+    "train": "flkl.training",
+    "test": "flkl.test2",
+    # the earlier go/no-go test, with its trials drawn by utex's scheduler
+    "test1": "flkl.test",
+    "calibrate": "flkl.calibrate",
+    "rig": "flkl.rig",
+    "sim": "flkl.sim",
+    "replay": "flkl.replay",
+    "cohort": "flkl.cohort",
+    "bench": "flkl.bench",
+    "bridge": "flkl.bridged",
+    "bus": "flkl.bus",
+    "sync": "flkl.sync",
+}
+
+# USB vendor ids of Arduino boards and of the USB-serial bridges on clones.
+ARDUINO_VIDS = {0x2341, 0x2A03, 0x1A86, 0x0403, 0x10C4}
+
+
+def list_boards(all_ports: bool = False, detail: bool = False):
+    if detail:
+        # pyno asks arduino-cli for the board names, which takes seconds
+        from pyno.com import check_connected_board_info
+
+        for board in check_connected_board_info():
+            print(f"{board.board} (serial number: {board.serial_number}) at {board.port}")
+        return
+
+    from serial.tools.list_ports import comports
+
+    for port in sorted(comports(), key=lambda p: p.device):
+        if not all_ports and port.vid not in ARDUINO_VIDS:
+            continue
+        print(f"{port.product or port.description} (serial number: {port.serial_number}) at {port.device}")
+
+
+# `alter_sys` makes the script `sys.modules["__main__"]` while it runs, so its
+# functions still pickle for the process pools of rig, replay and cohort.
+def run_script(command: str, args: list[str]):
+    from runpy import run_module
+
+    sys.argv[1:] = args
+    run_module(SCRIPTS[command], run_name="__main__", alter_sys=True)
+
+
+# Cumulative import time (ms) of each top-level package imported by the
+# command, from the `-X importtime` lines of a child interpreter.
+def import_times(args: list[str]) -> tuple[dict[str, float], int]:
+    import subprocess
+
+    child = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "flkl", *args],
+        stderr=subprocess.PIPE, text=True,
+    )
+    totals: dict[str, float] = {}
+    for line in child.stderr.splitlines():
+        if not line.startswith("import time:"):
+            print(line, file=sys.stderr)
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        if name.startswith(" "):
+            continue
+        package = name.split(".")[0]
+        totals[package] = totals.get(package, 0.0) + int(fields[1]) / 1000
+    return totals, child.returncode
+
+
+def show_import_times(totals: dict[str, float], top: int = 15):
+    ordered = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+    print(f"\n{'package':24s} {'ms':>8s}", file=sys.stderr)
+    for package, ms in ordered[:top]:
+        print(f"{package:24s} {ms:8.1f}", file=sys.stderr)
+    print(f"{'total':24s} {sum(totals.values()):8.1f}", file=sys.stderr)
+
+
+def main(argv: list[str] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="flkl", description="Run flkl tasks and tools.",
+        epilog=f"Commands: list-boards, {', '.join(SCRIPTS)}. "
+               "Arguments after the command are passed to it; `flkl <command> -h` shows them.",
+    )
+    parser.add_argument("--import-time", action="store_true", help="Report the import time of the command")
+    parser.add_argument("command", choices=["list-boards", *SCRIPTS], metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    if args.import_time:
+        totals, code = import_times([args.command, *args.args])
+        show_import_times(totals)
+        sys.exit(code)
+
+    if args.command == "list-boards":
+        boards = argparse.ArgumentParser(prog="flkl list-boards", description="List connected Arduino boards.")
+        boards.add_argument("--all", "-a", action="store_true", help="Include serial ports of other devices")
+        boards.add_argument("--detail", "-d", action="store_true", help="Ask arduino-cli for the board names (slow)")
+        options = boards.parse_args(args.args)
+        list_boards(options.all, options.detail)
+    else:
+        run_script(args.command, args.args)
+
+
+if __name__ == "__main__":
+    main()
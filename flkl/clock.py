@@ -0,0 +1,137 @@
+from collections import deque
+from typing import Optional
+
+from amas.agent import Agent, NotWorkingError
+
+from flkl.share import CLOCK_EVENT, decode_frames
+
+MICROS_RANGE = 1 << 32
+
+
+class Unwrapper:
+    def __init__(self):
+        self.epoch = 0
+        self.last: Optional[int] = None
+
+    def __call__(self, micros: int) -> int:
+        if self.last is not None and micros < self.last - MICROS_RANGE // 2:
+            self.epoch += MICROS_RANGE
+        self.last = micros
+        return micros + self.epoch
+
+
+def unwrap_micros(micros):
+    from numpy import asarray, concatenate, cumsum, diff, int64
+
+    micros = asarray(micros, dtype=int64)
+    wraps = concatenate([[0], cumsum(diff(micros) < -MICROS_RANGE // 2)])
+    return micros + wraps * MICROS_RANGE
+
+
+# Online model of host time (perf_counter seconds) as a linear function of
+# the unwrapped board micros, fitted on the ping replies with the smallest
+# round trips in a sliding window.
+class ClockSync:
+    def __init__(self, window: int = 64):
+        self.unwrap = Unwrapper()
+        self.samples: deque[tuple[int, float, float]] = deque(maxlen=window)
+        self.origin: Optional[int] = None
+        self.offset = 0.0
+        self.drift = 1e-6
+        self._sent: Optional[float] = None
+
+    def ping_sent(self, host: float):
+        self._sent = host
+
+    def pong(self, micros: int, host: float):
+        if self._sent is None or host < self._sent:
+            return
+        rtt = host - self._sent
+        self._sent = None
+        self.samples.append((micros, host - rtt / 2, rtt))
+        self.fit()
+
+    def fit(self):
+        best = min(rtt for _, _, rtt in self.samples)
+        points = [(us, host) for us, host, rtt in self.samples if rtt <= 2 * best]
+        if self.origin is None:
+            self.origin = points[0][0]
+        xs = [(us - self.origin) * 1e-6 for us, _ in points]
+        ys = [host for _, host in points]
+        n = len(points)
+        mx, my = sum(xs) / n, sum(ys) / n
+        sxx = sum((x - mx) ** 2 for x in xs)
+        if n >= 2 and sxx > 0.0:
+            scale = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+            self.drift = scale * 1e-6
+        else:
+            self.drift = 1e-6
+        self.offset = my - mx * self.drift * 1e6
+
+    def correct(self, events: list[int], micros: list[int], received: float):
+        kept_events: list[int] = []
+        kept_micros: list[int] = []
+        hosts: list[float] = []
+        for event, time in zip(events, micros):
+            unwrapped = self.unwrap(time)
+            if event == CLOCK_EVENT:
+                self.pong(unwrapped, received)
+                continue
+            kept_events.append(event)
+            kept_micros.append(time)
+            hosts.append(self.to_host(unwrapped))
+        return kept_events, kept_micros, hosts
+
+    def synchronized(self) -> bool:
+        return self.origin is not None
+
+    def to_host(self, micros: int) -> float:
+        if self.origin is None:
+            return float("nan")
+        return self.offset + (micros - self.origin) * self.drift
+
+    def summary(self) -> dict:
+        return {
+            "origin_micros": self.origin,
+            "offset": self.offset,
+            "drift": self.drift,
+            "samples": [list(sample) for sample in self.samples],
+        }
+
+    def dump(self, path: str):
+        import json
+
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def ping(connection):
+    connection.write(b"\x31\x00")
+
+
+def query_clock(connection) -> Optional[int]:
+    ping(connection)
+    events, micros, _ = decode_frames(bytearray(connection.read(6)))
+    for event, time in zip(events, micros):
+        if event == CLOCK_EVENT:
+            return time
+    return None
+
+
+async def synchronize(agent: Agent, connection, clock: ClockSync, interval: float = 1.0, listen: bool = False):
+    from time import perf_counter
+
+    try:
+        while agent.working():
+            if listen:
+                sent = perf_counter()
+                micros = await agent.call_async(query_clock, connection)
+                if micros is not None:
+                    clock.ping_sent(sent)
+                    clock.pong(clock.unwrap(micros), perf_counter())
+            else:
+                clock.ping_sent(perf_counter())
+                ping(connection)
+            await agent.sleep(interval)
+    except NotWorkingError:
+        pass
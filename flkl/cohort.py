@@ -0,0 +1,315 @@
+from typing import NamedTuple, Optional
+
+# Offline analysis over every session in a data directory. Sessions are
+# indexed once into a small sqlite catalog, and per-session trial tables are
+# cached by path and modification time, so re-running a cohort analysis only
+# parses sessions that are new or changed since the last run.
+CATALOG = "./cache/catalog.sqlite"
+TRIAL_CACHE = "./cache/trials"
+
+# Files written next to a data file, which are not sessions themselves.
+SIDECARS = (".npz", ".json", ".yaml", ".yml", ".sync.csv")
+# Suffixes of text recordings; other files are not sessions.
+TEXT_SUFFIXES = (".csv", ".txt")
+
+
+class SessionInfo(NamedTuple):
+    path: str
+    format: str
+    mtime: float
+    size: int
+    subject: str
+    condition: str
+    date: str
+    config_hash: str
+
+
+def session_format(path: str) -> Optional[str]:
+    from os.path import isdir, isfile
+
+    if path.endswith(".tdms") and isfile(path):
+        return "tdms"
+    if path.endswith(".parquet") and isdir(path):
+        return "parquet"
+    if isfile(path) and path.endswith(TEXT_SUFFIXES) and not path.endswith(SIDECARS) and is_text_session(path):
+        return "text"
+    return None
+
+
+# Whether the first row reads as a recorded event, so a stray CSV next to the
+# sessions is not cataloged as one.
+def is_text_session(path: str) -> bool:
+    with open(path, "rb") as f:
+        line = f.readline(256).translate(None, b"()").strip()
+    if not line:
+        return True
+    fields = line.split(b",")
+    if len(fields) not in (3, 4):
+        return False
+    try:
+        [float(field) for field in fields]
+    except ValueError:
+        return False
+    return True
+
+
+def session_base(path: str, fmt: str) -> str:
+    if fmt in ("tdms", "parquet"):
+        return path[: path.rindex(".")]
+    return path
+
+
+def session_config(path: str, fmt: str) -> dict:
+    from glob import glob
+    from os.path import exists, join
+
+    import yaml
+
+    text = None
+    if fmt == "tdms":
+        from nptdms import TdmsFile
+
+        with TdmsFile.open(path) as f:
+            text = f.properties.get("config")
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        parts = sorted(glob(join(path, "*.parquet")))
+        if parts:
+            metadata = pq.read_schema(parts[0]).metadata or {}
+            text = metadata.get(b"config", b"").decode() or None
+    sidecar = f"{session_base(path, fmt)}.yaml"
+    if text is None and exists(sidecar):
+        with open(sidecar, "r") as f:
+            text = f.read()
+    return (yaml.safe_load(text) if text else None) or {}
+
+
+def config_hash(config: dict) -> str:
+    import json
+    from hashlib import sha256
+
+    key = json.dumps(config.get("Experimental", {}), sort_keys=True, default=str)
+    return sha256(key.encode()).hexdigest()[:16]
+
+
+def session_stat(path: str) -> tuple[float, int]:
+    from os import scandir, stat
+    from os.path import isdir
+
+    if isdir(path):
+        entries = list(scandir(path))
+        return max((e.stat().st_mtime for e in entries), default=0.0), sum(e.stat().st_size for e in entries)
+    st = stat(path)
+    return st.st_mtime, st.st_size
+
+
+def describe(path: str, fmt: str) -> SessionInfo:
+    from datetime import datetime
+
+    mtime, size = session_stat(path)
+    config = session_config(path, fmt)
+    metadata = config.get("Metadata", {})
+    date = metadata.get("date") or datetime.fromtimestamp(mtime).date().isoformat()
+    return SessionInfo(
+        path, fmt, mtime, size,
+        str(metadata.get("subject", "")), str(metadata.get("condition", "")), str(date),
+        config_hash(config),
+    )
+
+
+class Catalog:
+    def __init__(self, path: str = CATALOG):
+        import sqlite3
+        from os import makedirs
+        from os.path import dirname
+
+        makedirs(dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "path TEXT PRIMARY KEY, format TEXT, mtime REAL, size INTEGER, "
+            "subject TEXT, condition TEXT, date TEXT, config_hash TEXT)"
+        )
+
+    def update(self, data_dir: str) -> list[SessionInfo]:
+        from os import listdir
+        from os.path import join
+
+        known = {row[0]: (row[1], row[2]) for row in self.db.execute("SELECT path, mtime, size FROM sessions")}
+        changed = []
+        for name in sorted(listdir(data_dir)):
+            path = join(data_dir, name)
+            fmt = session_format(path)
+            if fmt is None:
+                continue
+            if known.pop(path, None) == session_stat(path):
+                continue
+            changed.append(describe(path, fmt))
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", changed)
+            # sessions removed from the data directory
+            self.db.executemany(
+                "DELETE FROM sessions WHERE path = ?",
+                [(path,) for path in known if path.startswith(join(data_dir, ""))],
+            )
+        return changed
+
+    def sessions(self, **filters) -> list[SessionInfo]:
+        query = "SELECT * FROM sessions"
+        if filters:
+            for key in filters:
+                if key not in SessionInfo._fields:
+                    raise ValueError(f"Unknown catalog column: {key}")
+            query += " WHERE " + " AND ".join(f"{key} = ?" for key in filters)
+        rows = self.db.execute(query + " ORDER BY date, path", tuple(filters.values()))
+        return [SessionInfo(*row) for row in rows]
+
+    def close(self):
+        self.db.close()
+
+
+def load_events(path: str, fmt: str, columns: tuple = ("host", "event")) -> dict:
+    from numpy import asarray
+
+    if fmt == "tdms":
+        from nptdms import TdmsFile
+
+        # streaming mode reads only the requested channels
+        with TdmsFile.open(path) as f:
+            group = f["events"]
+            return {name: group[name][:] for name in columns}
+    if fmt == "parquet":
+        import pandas as pd
+
+        table = pd.read_parquet(path, columns=list(columns), memory_map=True)
+        return {name: table[name].to_numpy() for name in columns}
+    return load_text_events(path, columns)
+
+
+TEXT_COLUMNS = ["host", "micros", "event", "board"]
+
+
+# Text recordings are "host, micros, event[, board]" lines, or "host, (micros,
+# event)" from utex's Recorder; both parse after dropping the parentheses.
+def load_text_events(path: str, columns: tuple = ("host", "event")) -> dict:
+    from io import BytesIO
+
+    import pandas as pd
+
+    with open(path, "rb") as f:
+        data = f.read().translate(None, b"()")
+    if not data.strip():
+        return {name: pd.Series(dtype=float).to_numpy() for name in columns}
+    # rows gain the board column once the clock is synchronized, so the
+    # column count cannot be taken from the first row
+    table = pd.read_csv(BytesIO(data), header=None, names=TEXT_COLUMNS, skipinitialspace=True)
+    return {name: table[name].to_numpy() for name in columns}
+
+
+def load_schedule(info: SessionInfo):
+    from os.path import exists
+
+    from numpy import load
+
+    path = f"{session_base(info.path, info.format)}.schedule.npz"
+    if not exists(path):
+        return None
+    with load(path) as f:
+        return f["schedule"]
+
+
+# One row per trial: the schedule joined with the onset markers recorded by the
+# controller, and the licks counted in the whole trial and in the decision
+# window at the end of the stimulus.
+def trial_table(info: SessionInfo):
+    import pandas as pd
+    from numpy import append, full, inf, nan, searchsorted
+
+    from flkl.share import TRIAL_EVENT
+
+    config = session_config(info.path, info.format)
+    expvars = config.get("Experimental", {})
+    response_pin = expvars.get("response-pin", [6])[0]
+    flickr_duration = expvars.get("flickr-duration", 2.0)
+    decision_duration = expvars.get("decision-duration", 1.0)
+
+    events = load_events(info.path, info.format)
+    host, event = events["host"], events["event"]
+    onsets = host[event == TRIAL_EVENT]
+    licks = host[event == response_pin]
+
+    schedule = load_schedule(info)
+    n = len(onsets) if schedule is None else min(len(onsets), len(schedule))
+    table = pd.DataFrame(schedule[:n]) if schedule is not None else pd.DataFrame({"trial": range(1, n + 1)})
+    onsets = onsets[:n]
+    ends = append(onsets[1:], inf)
+    window_start = onsets + flickr_duration - decision_duration
+    window_end = onsets + flickr_duration
+
+    first = searchsorted(licks, onsets)
+    table["onset"] = onsets - (onsets[0] if n else 0.0)
+    table["nlick"] = searchsorted(licks, ends) - first
+    table["nlick_window"] = searchsorted(licks, window_end) - searchsorted(licks, window_start)
+    latency = full(n, nan)
+    has_lick = (first < len(licks)) & (table["nlick"].to_numpy() > 0)
+    latency[has_lick] = licks[first[has_lick]] - onsets[has_lick]
+    table["latency"] = latency
+
+    for key in ("subject", "condition", "date", "config_hash", "path"):
+        table[key] = getattr(info, key)
+    return table
+
+
+def cached_trial_table(info: SessionInfo, cache_dir: str = TRIAL_CACHE):
+    from hashlib import sha256
+    from os import makedirs
+    from os.path import exists, join
+
+    import pandas as pd
+
+    key = sha256(f"{info.path}:{info.mtime}:{info.size}".encode()).hexdigest()[:16]
+    path = join(cache_dir, f"{key}.pkl")
+    if exists(path):
+        return pd.read_pickle(path)
+    table = trial_table(info)
+    makedirs(cache_dir, exist_ok=True)
+    table.to_pickle(path)
+    return table
+
+
+def cohort_table(data_dir: str, catalog: str = CATALOG, cache_dir: str = TRIAL_CACHE,
+                 processes: Optional[int] = None, **filters):
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+
+    import pandas as pd
+
+    index = Catalog(catalog)
+    try:
+        index.update(data_dir)
+        sessions = index.sessions(**filters)
+    finally:
+        index.close()
+    if not sessions:
+        return pd.DataFrame()
+    with ProcessPoolExecutor(processes) as pool:
+        tables = list(pool.map(partial(cached_trial_table, cache_dir=cache_dir), sessions))
+    return pd.concat(tables, ignore_index=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the trial table of every session in a data directory.")
+    parser.add_argument("data_dir", help="Directory of the recorded sessions")
+    parser.add_argument("--output", "-o", default="trials.csv", help="Path of the cohort trial table")
+    parser.add_argument("--subject", "-s", default=None, help="Only sessions of this subject")
+    parser.add_argument("--condition", "-c", default=None, help="Only sessions of this condition")
+    parser.add_argument("--processes", "-p", type=int, default=None, help="Worker processes")
+    args = parser.parse_args()
+
+    filters = {k: v for k, v in (("subject", args.subject), ("condition", args.condition)) if v is not None}
+    table = cohort_table(args.data_dir, processes=args.processes, **filters)
+    table.to_csv(args.output, index=False)
+    print(f"{len(table)} trials from {table['path'].nunique() if len(table) else 0} sessions -> {args.output}")
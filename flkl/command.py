@@ -0,0 +1,203 @@
+from struct import Struct, calcsize
+from typing import NamedTuple
+
+
+class Field(NamedTuple):
+    name: str
+    fmt: str
+    scale: float = 1.0
+
+
+class Command:
+    def __init__(self, name: str, opcode: int, fields: list[Field]):
+        self.name = name
+        self.opcode = opcode
+        self.fields = fields
+        self.layout = "<" + "".join(field.fmt for field in fields)
+        self.struct = Struct("<B" + self.layout[1:])
+        self.size = self.struct.size
+        self.limits = [(0, (1 << (8 * calcsize(field.fmt))) - 1) for field in fields]
+
+    def encode(self, values: tuple) -> list[int]:
+        encoded = []
+        for field, (lo, hi), value in zip(self.fields, self.limits, values):
+            v = round(value * field.scale) if field.scale != 1.0 else int(value)
+            if not lo <= v <= hi:
+                raise ValueError(
+                    f"{self.name}: {field.name}={value} is out of range "
+                    f"({lo / field.scale} - {hi / field.scale})"
+                )
+            encoded.append(v)
+        return encoded
+
+    # Whether `values` encode without rounding, e.g. whether a frequency fits
+    # the 0.1 Hz steps of the legacy one-byte rate fields.
+    def exact(self, values: tuple) -> bool:
+        for field, (lo, hi), value in zip(self.fields, self.limits, values):
+            scaled = value * field.scale
+            if not lo <= round(scaled) <= hi or abs(round(scaled) - scaled) > 1e-6:
+                return False
+        return True
+
+    def pack_into(self, buffer: bytearray, offset: int, *values) -> int:
+        self.struct.pack_into(buffer, offset, self.opcode, *self.encode(values))
+        return offset + self.size
+
+    def pack(self, *values) -> bytes:
+        return self.struct.pack(self.opcode, *self.encode(values))
+
+    def unpack(self, data: bytes) -> dict[str, float]:
+        _, *raw = self.struct.unpack(data)
+        return {field.name: v / field.scale for field, v in zip(self.fields, raw)}
+
+
+FLICK_FOR = Command("flick_for", 0x13, [
+    Field("pin", "B"),
+    Field("hz", "B", 10.0),
+    Field("flickr_duration", "H"),
+    Field("pulse_duration", "H"),
+    Field("rpin", "B"),
+    Field("millis", "H"),
+])
+
+FLICK_ON = Command("flick_on", 0x14, [
+    Field("pin", "B"),
+    Field("hz", "B", 10.0),
+    Field("flickr_duration", "H"),
+    Field("pulse_duration", "H"),
+])
+
+FLICK_FOR2 = Command("flick_for2", 0x15, [
+    Field("pin1", "B"),
+    Field("pin2", "B"),
+    Field("hz1", "B", 10.0),
+    Field("hz2", "B", 10.0),
+    Field("flickr_duration", "H"),
+    Field("pulse_duration", "H"),
+    Field("rpin", "B"),
+    Field("millis", "H"),
+])
+
+FLICK_ON2 = Command("flick_on2", 0x16, [
+    Field("pin1", "B"),
+    Field("pin2", "B"),
+    Field("hz1", "B", 10.0),
+    Field("hz2", "B", 10.0),
+    Field("flickr_duration", "H"),
+    Field("pulse_duration", "H"),
+])
+
+HIGH_FOR = Command("high_for", 0x17, [
+    Field("pin", "B"),
+    Field("millis", "H"),
+])
+
+ENQUEUE_TRIAL = Command("enqueue_trial", 0x40, [
+    Field("pin1", "B"),
+    Field("pin2", "B"),
+    Field("hz1", "B", 10.0),
+    Field("hz2", "B", 10.0),
+    Field("flickr_duration", "H"),
+    Field("pulse_duration", "H"),
+    Field("rpin", "B"),
+    Field("millis", "H"),
+    Field("iti", "I"),
+])
+
+# Extended trial: rate in millihertz, times in seconds sent as microseconds.
+ENQUEUE_FLICKER_TRIAL = Command("enqueue_flicker_trial", 0x43, [
+    Field("pin1", "B"),
+    Field("pin2", "B"),
+    Field("hz1", "I", 1000.0),
+    Field("hz2", "I", 1000.0),
+    Field("flickr_duration", "I", 1e6),
+    Field("pulse_duration", "I", 1e6),
+    Field("rpin", "B"),
+    Field("reward_duration", "I", 1e6),
+    Field("iti", "I", 1e6),
+])
+
+START_QUEUE = Command("start_queue", 0x41, [Field("unused", "B")])
+
+CLEAR_QUEUE = Command("clear_queue", 0x42, [Field("unused", "B")])
+
+HANDSHAKE = Command("handshake", 0x32, [Field("unused", "B")])
+
+# Flicker channels the controller sketch runs side by side (CHANNELS).
+# FLICK_* use channels 0 and 1, and HIGH_FOR the first idle one above them.
+CHANNELS = 6
+ALL_CHANNELS = 0xFF
+
+START_CHANNEL = Command("start_channel", 0x50, [
+    Field("channel", "B"),
+    Field("pin", "B"),
+    Field("hz", "B", 10.0),
+    Field("flickr_duration", "H"),
+    Field("pulse_duration", "H"),
+    Field("rpin", "B"),
+    Field("millis", "H"),
+])
+
+UPDATE_CHANNEL = Command("update_channel", 0x51, [
+    Field("channel", "B"),
+    Field("hz", "B", 10.0),
+    Field("pulse_duration", "H"),
+])
+
+ABORT_CHANNEL = Command("abort_channel", 0x52, [Field("channel", "B")])
+
+# Extended channels: rate in millihertz, times in seconds sent as microseconds,
+# which covers gamma-band flicker and stimuli of up to ~71 minutes.
+START_FLICKER = Command("start_flicker", 0x53, [
+    Field("channel", "B"),
+    Field("pin", "B"),
+    Field("hz", "I", 1000.0),
+    Field("duration", "I", 1e6),
+    Field("pulse_duration", "I", 1e6),
+    Field("rpin", "B"),
+    Field("reward_duration", "I", 1e6),
+])
+
+UPDATE_FLICKER = Command("update_flicker", 0x54, [
+    Field("channel", "B"),
+    Field("hz", "I", 1000.0),
+    Field("pulse_duration", "I", 1e6),
+])
+
+# Sync pulses timed by the controller: `pin` high for `pulse_duration` at
+# pseudo-random intervals in [min_interval, max_interval] drawn from `seed`;
+# times in seconds sent as milliseconds.
+START_SYNC = Command("start_sync", 0x60, [
+    Field("pin", "B"),
+    Field("pulse_duration", "H", 1000.0),
+    Field("min_interval", "H", 1000.0),
+    Field("max_interval", "H", 1000.0),
+    Field("seed", "I"),
+])
+
+STOP_SYNC = Command("stop_sync", 0x61, [Field("unused", "B")])
+
+COMMANDS = [
+    FLICK_FOR, FLICK_ON, FLICK_FOR2, FLICK_ON2, HIGH_FOR,
+    ENQUEUE_TRIAL, ENQUEUE_FLICKER_TRIAL, START_QUEUE, CLEAR_QUEUE, HANDSHAKE,
+    START_CHANNEL, UPDATE_CHANNEL, ABORT_CHANNEL, START_FLICKER, UPDATE_FLICKER,
+    START_SYNC, STOP_SYNC,
+]
+
+# Bytes following each opcode of `ino.ino`, as struct formats.
+LAYOUTS = {
+    0x00: "<B",
+    0x01: "<B",
+    0x02: "<B",
+    0x03: "<B",
+    0x04: "<B",
+    0x10: "<B",
+    0x11: "<B",
+    0x12: "<BB",
+    0x19: "<B",
+    **{command.opcode: command.layout for command in COMMANDS},
+    0x20: "<B",
+    0x21: "<B",
+    0x30: "<B",
+    0x31: "<B",
+}
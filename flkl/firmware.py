@@ -0,0 +1,128 @@
+from struct import unpack_from
+from typing import NamedTuple, Optional
+
+from flkl.command import HANDSHAKE, LAYOUTS
+
+# `\x32` is answered with a binary frame headed by HANDSHAKE_EVENT that carries
+# the build hash, followed by the protocol version (u8), the length of the
+# layout table (u16) and the table itself as "opcode:layout;..." in hex/ASCII.
+HANDSHAKE_EVENT = 0x7C
+HANDSHAKE_TIMEOUT = 2.0
+
+# Generated next to the sketch before upload; `ino.ino` reports it as its build.
+BUILD_HEADER = "build.h"
+
+
+class Firmware(NamedTuple):
+    build: int
+    protocol: int
+    layouts: dict[int, str]
+
+    def supports(self, opcode: int) -> bool:
+        return opcode in self.layouts
+
+    def mismatches(self, expected: dict[int, str] = LAYOUTS) -> list[int]:
+        return [
+            opcode for opcode, layout in self.layouts.items()
+            if opcode in expected and expected[opcode] != layout
+        ]
+
+
+def parse_layouts(table: str) -> dict[int, str]:
+    layouts = {}
+    for entry in filter(None, table.split(";")):
+        opcode, layout = entry.split(":")
+        layouts[int(opcode, 16)] = "<" + layout
+    return layouts
+
+
+def format_layouts(layouts: dict[int, str]) -> str:
+    return ";".join(f"{opcode:02x}:{layout.lstrip('<')}" for opcode, layout in sorted(layouts.items()))
+
+
+def read_exactly(connection, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = connection.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def query_firmware(connection, timeout: float = HANDSHAKE_TIMEOUT) -> Optional[Firmware]:
+    from flkl.share import EVENT_FRAME_SIZE, EVENT_FRAME_SYNC
+
+    previous = connection.timeout
+    connection.timeout = timeout
+    try:
+        connection.write(HANDSHAKE.pack(0))
+        connection.flush()
+        # skip anything the board sent before the reply, e.g. stray events
+        while True:
+            head = read_exactly(connection, 1)
+            if not head:
+                return None
+            if head[0] == HANDSHAKE_EVENT:
+                break
+        frame = head + read_exactly(connection, EVENT_FRAME_SIZE + 2)
+        if len(frame) < EVENT_FRAME_SIZE + 3 or frame[EVENT_FRAME_SIZE - 1] != EVENT_FRAME_SYNC:
+            return None
+        build, = unpack_from("<I", frame, 1)
+        protocol, size = unpack_from("<BH", frame, EVENT_FRAME_SIZE)
+        table = read_exactly(connection, size)
+        if len(table) < size:
+            return None
+        return Firmware(build, protocol, parse_layouts(table.decode("ascii")))
+    finally:
+        connection.timeout = previous
+
+
+def build_hash(sketch: str = "./ino") -> int:
+    from hashlib import sha256
+
+    from flkl.upload import sketch_files
+
+    h = sha256()
+    for path in sketch_files(sketch):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return int(h.hexdigest()[:8], 16)
+
+
+def write_build_header(sketch: str = "./ino") -> int:
+    from os.path import isdir, join
+
+    build = build_hash(sketch)
+    if not isdir(sketch):
+        return build
+    with open(join(sketch, BUILD_HEADER), "w") as f:
+        f.write(f"#define FIRMWARE_BUILD 0x{build:08X}UL\n")
+    return build
+
+
+def check_firmware(firmware: Optional[Firmware], build: Optional[int] = None):
+    if firmware is None:
+        return
+    mismatches = firmware.mismatches()
+    if mismatches:
+        opcodes = ", ".join(f"0x{opcode:02X}" for opcode in mismatches)
+        raise RuntimeError(f"Firmware command layouts differ from the host for {opcodes}; reflash the board.")
+    # builds flashed without a generated header report 0
+    if build is not None and firmware.build not in (0, build):
+        raise RuntimeError(
+            f"Firmware build 0x{firmware.build:08X} differs from the sketch (0x{build:08X}); reflash the board."
+        )
+
+
+# Protocol version from which the firmware buffers edges and can number them.
+SEQUENCED_PROTOCOL = 2
+
+
+# Picks the fastest event format the reader firmware speaks.
+def negotiate_protocol(connection) -> str:
+    firmware = query_firmware(connection)
+    check_firmware(firmware)
+    if firmware is None or not firmware.supports(0x30):
+        return "ascii"
+    return "sequenced" if firmware.protocol >= SEQUENCED_PROTOCOL else "binary"
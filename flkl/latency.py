@@ -0,0 +1,115 @@
+from collections import deque
+from threading import Lock, local
+from time import perf_counter_ns
+from typing import Optional
+
+# Number of mantissa bits kept per bucket, i.e. buckets are ~3% wide.
+HISTOGRAM_PRECISION = 5
+
+
+class Histogram:
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns: int):
+        shift = max(0, ns.bit_length() - HISTOGRAM_PRECISION)
+        bucket = (ns >> shift) << shift
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.n += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, q: float) -> int:
+        rank = q * self.n
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return bucket
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        if self.n == 0:
+            return {"n": 0}
+        return {
+            "n": self.n,
+            "mean_us": self.total / self.n / 1000,
+            "p50_us": self.percentile(0.5) / 1000,
+            "p99_us": self.percentile(0.99) / 1000,
+            "max_us": self.max / 1000,
+        }
+
+
+# Per-hop latency of the lick-to-reward path:
+#   board    - edge on the board (via `ClockSync`) -> serial read returned
+#   read     - serial read returned -> events dispatched by `read`
+#   deliver  - dispatched to CONTROLLER -> received by a contingency
+#   decide   - last event received -> contingency decided on it
+#   write    - `Flkl` command called -> `write` returned
+#   transmit - `write` returned -> output buffer drained, timed off the
+#              controller's thread
+class Tracker:
+    def __init__(self):
+        self.hops: dict[str, Histogram] = {}
+        self._inflight: deque[int] = deque()
+        self._last_delivery = 0
+        # `Flkl` records the transmit hop from its drain thread
+        self._lock = Lock()
+
+    def record(self, hop: str, start: int, end: Optional[int] = None):
+        if end is None:
+            end = perf_counter_ns()
+        with self._lock:
+            histogram = self.hops.get(hop)
+            if histogram is None:
+                histogram = self.hops[hop] = Histogram()
+            histogram.record(max(0, end - start))
+
+    def sent(self, n: int = 1):
+        now = perf_counter_ns()
+        self._inflight.extend([now] * n)
+
+    def delivered(self, n: int = 1):
+        now = perf_counter_ns()
+        for _ in range(min(n, len(self._inflight))):
+            self.record("deliver", self._inflight.popleft(), now)
+        self._last_delivery = now
+
+    def decided(self):
+        if self._last_delivery:
+            self.record("decide", self._last_delivery)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {hop: histogram.summary() for hop, histogram in self.hops.items()}
+
+    def dump(self, path: str):
+        import json
+
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+tracker: Optional[Tracker] = None
+_local = local()
+
+
+# The tracker of the calling thread: its own once `enable(per_thread=True)`
+# ran in it, as in each box of a rig, and the process-wide one otherwise.
+def current() -> Optional[Tracker]:
+    return getattr(_local, "tracker", tracker)
+
+
+def enable(per_thread: bool = False) -> Tracker:
+    global tracker
+    if per_thread:
+        if getattr(_local, "tracker", None) is None:
+            _local.tracker = Tracker()
+        return _local.tracker
+    if tracker is None:
+        tracker = Tracker()
+    return tracker
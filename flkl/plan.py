@@ -0,0 +1,83 @@
+from typing import Callable, NamedTuple, Optional
+
+from amas.agent import Agent, NotWorkingError
+
+from flkl.share import Flkl
+
+# Trials the controller sketch can hold in its queue (TRIAL_QUEUE_SIZE).
+QUEUE_DEPTH = 16
+
+
+class PlannedTrial(NamedTuple):
+    pin1: int
+    pin2: int
+    hz1: float
+    hz2: float
+    flickr_duration: int
+    rpin: int
+    millis: int
+    iti: int
+
+
+async def run_plan(
+    agent: Agent,
+    ino: Flkl,
+    trials: list[PlannedTrial],
+    depth: int = QUEUE_DEPTH,
+    on_start: Optional[Callable[[int, int], None]] = None,
+    recorder: Optional[str] = None,
+    on_frame: Optional[Callable[[int, int], None]] = None,
+):
+    from flkl.command import ABORT_CHANNEL
+    from flkl.share import TRIAL_EVENT, decode_frames, read_available
+
+    if ino.connection.timeout is None:
+        ino.connection.timeout = 1.0
+
+    queued = min(depth, len(trials))
+    with ino.batch():
+        ino.clear_queue()
+        for trial in trials[:queued]:
+            ino.enqueue_trial(*trial)
+        ino.start_queue()
+    await ino.drain()
+
+    started = 0
+    buffer = bytearray()
+
+    try:
+        while started < len(trials) and agent.working():
+            chunk: bytes = await agent.call_async(read_available, ino.connection)
+            if not chunk:
+                continue
+            buffer += chunk
+            events, micros, consumed = decode_frames(buffer)
+            del buffer[:consumed]
+            for event, time in zip(events, micros):
+                if event != TRIAL_EVENT:
+                    # e.g. sync pulses, which share the controller's port
+                    if on_frame is not None:
+                        on_frame(event, time)
+                    continue
+                if recorder is not None:
+                    agent.send_to(recorder, (time, event))
+                if on_start is not None:
+                    on_start(started, time)
+                started += 1
+                if queued < len(trials):
+                    ino.enqueue_trial(*trials[queued])
+                    queued += 1
+                    await ino.drain()
+    except NotWorkingError:
+        pass
+    finally:
+        # nothing queued outlives the plan; a plan cut short (stopped session,
+        # lost port, error in a callback) also stops the trial in progress,
+        # while a completed one leaves the last trial to play out; a lost port
+        # fails these too, which must not hide why the plan stopped
+        try:
+            ino.clear_queue()
+            if started < len(trials) and ino.supports(ABORT_CHANNEL):
+                ino.abort_channel()
+        except Exception as e:
+            print(f"Plan: could not stop the trial queue: {e!r}")
@@ -0,0 +1,181 @@
+from typing import Optional
+
+from amas.agent import Agent, NotWorkingError
+
+# Columns of a recorded event: host receive time, board micros, event id and
+# the clock-synchronized host time of the event (NaN without `ClockSync`).
+COLUMNS = [("host", "f8"), ("micros", "i8"), ("event", "i2"), ("board", "f8")]
+
+
+class ColumnBuffer:
+    def __init__(self, capacity: int = 65536):
+        from numpy import empty
+
+        self.capacity = capacity
+        self.columns = {name: empty(capacity, dtype=dtype) for name, dtype in COLUMNS}
+        self.n = 0
+
+    def __len__(self) -> int:
+        return self.n
+
+    def full(self) -> bool:
+        return self.n >= self.capacity
+
+    def append(self, host: float, row: tuple):
+        i = self.n
+        self.columns["host"][i] = host
+        self.columns["micros"][i] = row[0]
+        self.columns["event"][i] = row[1]
+        self.columns["board"][i] = row[2] if len(row) > 2 else float("nan")
+        self.n = i + 1
+
+    def take(self) -> dict:
+        block = {name: column[: self.n].copy() for name, column in self.columns.items()}
+        self.n = 0
+        return block
+
+
+# Parquet part files are closed and published this often (seconds).
+PARQUET_ROLL_INTERVAL = 600.0
+
+
+# Every segment is flushed to disk as it is written, so a crash loses at most
+# the rows buffered since the last flush.
+class TdmsSink:
+    def __init__(self, filename: str, metadata: str):
+        from nptdms import TdmsWriter
+
+        self.file = open(filename, "wb")
+        self.writer = TdmsWriter(self.file)
+        self.writer.open()
+        self.metadata = metadata
+
+    def write(self, block: dict):
+        from os import fsync
+
+        from nptdms import ChannelObject, GroupObject, RootObject
+
+        objects = [GroupObject("events")]
+        if self.metadata is not None:
+            objects.insert(0, RootObject(properties={"config": self.metadata}))
+            self.metadata = None
+        objects += [ChannelObject("events", name, data) for name, data in block.items()]
+        self.writer.write_segment(objects)
+        self.file.flush()
+        fsync(self.file.fileno())
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
+
+
+# Parquet footers are only written on close, so every flush is a row group of
+# an open part file, which is closed every `roll_interval` seconds. The open
+# part is hidden (".part-NNNNN.parquet") until then, so the dataset directory
+# that `pandas.read_parquet` reads whole only ever holds complete files, and a
+# crash loses at most the open part.
+class ParquetSink:
+    def __init__(self, filename: str, metadata: str, roll_interval: float = PARQUET_ROLL_INTERVAL):
+        from os import makedirs
+
+        makedirs(filename, exist_ok=True)
+        self.directory = filename
+        self.metadata = {b"config": metadata.encode()}
+        self.roll_interval = roll_interval
+        self.parts = 0
+        self.writer = None
+        self.opened = 0.0
+
+    def part_path(self, hidden: bool) -> str:
+        from os.path import join
+
+        return join(self.directory, f"{'.' if hidden else ''}part-{self.parts:05d}.parquet")
+
+    def write(self, block: dict):
+        from time import perf_counter
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table(block).replace_schema_metadata(self.metadata)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.part_path(True), table.schema)
+            self.opened = perf_counter()
+        self.writer.write_table(table)
+        if perf_counter() - self.opened >= self.roll_interval:
+            self.roll()
+
+    def roll(self):
+        from os import replace
+
+        self.writer.close()
+        self.writer = None
+        replace(self.part_path(True), self.part_path(False))
+        self.parts += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.roll()
+
+
+SINKS = {"tdms": (TdmsSink, ".tdms"), "parquet": (ParquetSink, ".parquet")}
+
+
+def as_yaml(config) -> str:
+    import json
+
+    import yaml
+
+    sections = {
+        "Comport": config.comport,
+        "Experimental": config.experimental,
+        "Metadata": config.metadata,
+    }
+    return yaml.safe_dump(json.loads(json.dumps(sections, default=str)))
+
+
+def open_sink(sink: str, filename: str, metadata: str):
+    if sink not in SINKS:
+        raise ValueError(f"Unknown recorder format: {sink}")
+    cls, extension = SINKS[sink]
+    return cls(filename + extension, metadata)
+
+
+async def record_columns(
+    agent: Agent,
+    filename: str,
+    sink: str = "tdms",
+    metadata: Optional[str] = None,
+    capacity: int = 65536,
+    flush_interval: float = 5.0,
+):
+    from time import perf_counter
+
+    from flkl.share import as_events
+
+    buffer = ColumnBuffer(capacity)
+    writer = open_sink(sink, filename, metadata or "")
+    flushed = perf_counter()
+
+    try:
+        while agent.working():
+            mail = await agent.try_recv(flush_interval)
+            now = perf_counter()
+            if mail is not None:
+                _, mess = mail
+                for row in as_events(mess):
+                    if not isinstance(row, tuple):
+                        continue
+                    buffer.append(now, row)
+                    if buffer.full():
+                        writer.write(buffer.take())
+                        flushed = now
+            if len(buffer) and now - flushed >= flush_interval:
+                writer.write(buffer.take())
+                flushed = now
+    except NotWorkingError:
+        pass
+    finally:
+        if len(buffer):
+            writer.write(buffer.take())
+        writer.close()
@@ -0,0 +1,201 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from heapq import heappop, heappush
+from itertools import count
+from typing import Optional
+
+from amas.agent import NotWorkingError
+
+# Replays recorded lick streams through the live task and contingency code on
+# a virtual clock. Every trial's events are re-based on the onset marker the
+# task sends to the recorder, so changing `decision-duration`, `required-lick`
+# and the like shows what the same animal behaviour would have produced.
+
+RECORDER = "RECORDER"
+READER = "READER"
+
+
+class VirtualClock:
+    def __init__(self, start: float = 0.0):
+        self.t = start
+
+    def __call__(self) -> float:
+        return self.t
+
+    def advance(self, duration: float):
+        if duration > 0.0:
+            self.t += duration
+
+
+# Stands in for `Flkl` and keeps every command with its virtual time.
+class ReplayBoard:
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.commands: list[tuple[float, str, tuple]] = []
+
+    def __getattr__(self, name: str):
+        def command(*args, **kwargs):
+            self.commands.append((self.clock.t, name, args))
+
+        return command
+
+    @contextmanager
+    def batch(self):
+        yield self
+
+
+# Implements the part of `amas.agent.Agent` the tasks use. Mail is served from
+# a heap of (time, event); `try_recv` and `sleep` jump the clock instead of
+# waiting, so a session replays as fast as the CPU allows.
+class ReplayAgent:
+    def __init__(self, clock: VirtualClock, events: list[tuple[float, int]] = (),
+                 trials: Optional[list[list[tuple[float, int]]]] = None,
+                 addr: str = "CONTROLLER", limit: float = float("inf")):
+        self.addr = addr
+        self.clock = clock
+        self.trials = trials
+        self.started = 0
+        self.limit = limit
+        self.sent: defaultdict[str, list] = defaultdict(list)
+        self._pending: list = []
+        self._seq = count()
+        self._working = True
+        for t, event in events:
+            self._push(t, event)
+
+    def _push(self, t: float, event: int):
+        heappush(self._pending, (t, next(self._seq), event))
+
+    def _check(self):
+        if self.clock.t > self.limit:
+            self._working = False
+        if not self._working:
+            raise NotWorkingError()
+
+    def working(self) -> bool:
+        return self._working
+
+    def finish(self):
+        self._working = False
+
+    def send_to(self, to: str, message):
+        from flkl.share import HOST_MICROS, TRIAL_EVENT
+
+        self.sent[to].append((self.clock.t, message))
+        if self.trials is None or to != RECORDER or message != (HOST_MICROS, TRIAL_EVENT):
+            return
+        if self.started < len(self.trials):
+            for offset, event in self.trials[self.started]:
+                self._push(self.clock.t + offset, event)
+        self.started += 1
+
+    async def sleep(self, duration: float):
+        self._check()
+        self.clock.advance(duration)
+
+    async def try_recv(self, timeout: float):
+        self._check()
+        if self._pending and self._pending[0][0] <= self.clock.t + timeout:
+            t, _, event = heappop(self._pending)
+            self.clock.t = max(self.clock.t, t)
+            return READER, event
+        self.clock.advance(timeout)
+        return None
+
+
+# Events of a recorded session, split per trial at the onset markers as
+# offsets from the onset. Clock frames and events before the first trial are
+# dropped.
+def session_trials(path: str, fmt: Optional[str] = None) -> list[list[tuple[float, int]]]:
+    from numpy import append, inf, searchsorted
+
+    from flkl.cohort import load_events, session_format
+    from flkl.share import CLOCK_EVENT, TRIAL_EVENT
+
+    events = load_events(path, fmt or session_format(path))
+    host, event = events["host"], events["event"]
+    onsets = host[event == TRIAL_EVENT]
+    keep = (event != TRIAL_EVENT) & (event != CLOCK_EVENT)
+    host, event = host[keep], event[keep]
+    bounds = searchsorted(host, append(onsets, inf))
+    return [
+        list(zip((host[a:b] - onset).tolist(), event[a:b].tolist()))
+        for onset, a, b in zip(onsets, bounds[:-1], bounds[1:])
+    ]
+
+
+# Experimental parameters of a recorded session with `overrides` applied.
+def session_expvars(path: str, overrides: Optional[dict] = None, fmt: Optional[str] = None) -> dict:
+    from flkl.cohort import session_config, session_format
+
+    config = session_config(path, fmt or session_format(path))
+    return {**config.get("Experimental", {}), **(overrides or {})}
+
+
+def replay(task, path: str, overrides: Optional[dict] = None, quiet: bool = True,
+           limit: float = float("inf"), **kwargs) -> ReplayAgent:
+    import asyncio
+    from contextlib import nullcontext, redirect_stdout
+    from inspect import signature
+    from io import StringIO
+
+    from flkl.cohort import describe, load_schedule, session_format
+    from flkl.share import use_clock
+
+    fmt = session_format(path)
+    expvars = session_expvars(path, overrides, fmt)
+    if "schedule" in signature(task).parameters and "schedule" not in kwargs:
+        kwargs["schedule"] = load_schedule(describe(path, fmt))
+
+    clock = VirtualClock()
+    agent = ReplayAgent(clock, trials=session_trials(path, fmt), limit=limit)
+    use_clock(clock)
+    try:
+        with redirect_stdout(StringIO()) if quiet else nullcontext():
+            asyncio.run(task(agent, ino=ReplayBoard(clock), expvars=expvars, **kwargs))
+    finally:
+        use_clock()
+    return agent
+
+
+# Replays a test2 session with `overrides` and summarizes its outcomes.
+def evaluate(path: str, overrides: dict) -> dict:
+    from flkl.analytics import ANALYZER, Analytics
+    from flkl.test2 import flickr_discrimination
+
+    agent = replay(flickr_discrimination, path, overrides, analyzer=ANALYZER)
+    analytics = Analytics(session_expvars(path, overrides).get("required-lick", 1))
+    [analytics.add(outcome) for _, outcome in agent.sent[ANALYZER]]
+    return {**overrides, **analytics.overall.summary()}
+
+
+def sweep(path: str, grid: dict[str, list], processes: Optional[int] = None):
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    from itertools import product
+
+    import pandas as pd
+
+    keys = list(grid)
+    settings = [dict(zip(keys, values)) for values in product(*grid.values())]
+    with ProcessPoolExecutor(processes) as pool:
+        return pd.DataFrame(list(pool.map(partial(evaluate, path), settings)))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import yaml
+
+    parser = argparse.ArgumentParser(description="Replay a recorded session under other parameters.")
+    parser.add_argument("session", help="Path of the recorded data file")
+    parser.add_argument("--set", "-s", action="append", default=[], metavar="KEY=V1,V2,...",
+                        help="Experimental parameter values to sweep, e.g. decision-duration=0.5,1.0")
+    parser.add_argument("--processes", "-p", type=int, default=None, help="Worker processes")
+    args = parser.parse_args()
+
+    grid = {}
+    for item in args.set:
+        key, values = item.split("=", 1)
+        grid[key] = [yaml.safe_load(v) for v in values.split(",")]
+    print(sweep(args.session, grid, args.processes).to_string(index=False))
@@ -0,0 +1,156 @@
+from threading import Thread
+from typing import Optional
+
+# One host process drives every box listed in a rig YAML:
+#
+#   Rig:
+#     processes: 0        # > 1 spreads boxes over a pool of worker processes
+#     latency-report: false
+#   Boxes:
+#     box01:
+#       config: ./config/box01.yaml   # a regular test2 config
+#
+# Each box gets its own thread, event loop and amas Environment, so agent
+# addresses stay per-box and a failing box does not stop the others.
+
+
+class Box(Thread):
+    def __init__(self, name: str, config_path: str, available_boards: list, data_dir: Optional[str] = None,
+                 latency_report: bool = False):
+        super().__init__(name=name, daemon=True)
+        self.config_path = config_path
+        self.available_boards = available_boards
+        self.data_dir = data_dir
+        self.latency_report = latency_report
+        self.loop = None
+        self.session = None
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        import asyncio
+        from traceback import print_exc
+
+        from utex.clap import Config
+
+        from flkl import latency
+        from flkl.test2 import run_session, setup_session
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        if self.latency_report:
+            # the box's own histograms, dumped next to its session
+            latency.enable(per_thread=True)
+        try:
+            config = Config(self.config_path)
+            self.session = setup_session(config, self.available_boards, self.data_dir)
+            print(f"[{self.name}] session started: {self.session.filename}")
+            run_session(self.session)
+        except Exception as e:
+            self.error = e
+            print(f"[{self.name}] session failed")
+            print_exc()
+
+    def abort(self):
+        from flkl.test2 import abort_session
+
+        if self.session is not None and self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(abort_session, self.session)
+
+
+def load_rig(path: str) -> tuple[dict, dict[str, str]]:
+    from os.path import dirname, join
+
+    import yaml
+
+    with open(path, "r") as f:
+        rig = yaml.safe_load(f)
+    boxes = rig.get("Boxes")
+    if not boxes:
+        raise ValueError(f"No boxes are defined in {path}.")
+    root = dirname(path)
+    return rig.get("Rig", {}), {name: join(root, box["config"]) for name, box in boxes.items()}
+
+
+def assigned_serials(config_paths: dict[str, str]) -> dict[str, str]:
+    from utex.clap import Config
+
+    owners: dict[str, str] = {}
+    for name, path in config_paths.items():
+        for port in ("input", "output"):
+            serial_number = Config(path).comport.get(port, {}).get("serial-number")
+            if serial_number in owners:
+                raise ValueError(
+                    f"Arduino {serial_number} is assigned to both {owners[serial_number]} and {name}."
+                )
+            owners[serial_number] = name
+    return owners
+
+
+def flash_rig(config_paths: dict[str, str], available_boards: list, force: bool = False) -> list[str]:
+    from utex.clap import Config
+
+    from flkl.test2 import upload_targets
+    from flkl.upload import upload_sketches
+
+    targets = [target for path in config_paths.values() for target in upload_targets(Config(path), available_boards)]
+    return upload_sketches(targets, force=force)
+
+
+def run_boxes(config_paths: dict[str, str], available_boards: list,
+              data_dir: Optional[str] = None, latency_report: bool = False) -> dict[str, str]:
+    boxes = [Box(name, path, available_boards, data_dir, latency_report) for name, path in config_paths.items()]
+    [box.start() for box in boxes]
+    try:
+        for box in boxes:
+            while box.is_alive():
+                box.join(0.5)
+    except KeyboardInterrupt:
+        [box.abort() for box in boxes]
+        [box.join() for box in boxes]
+    return {box.name: repr(box.error) for box in boxes if box.error is not None}
+
+
+def run_rig(path: str, processes: Optional[int] = None, data_dir: Optional[str] = None,
+            flash: bool = True) -> dict[str, str]:
+    from concurrent.futures import ProcessPoolExecutor
+
+    from pyno.com import check_connected_board_info
+
+    settings, config_paths = load_rig(path)
+    owners = assigned_serials(config_paths)
+    available_boards = [board for board in check_connected_board_info() if board.serial_number in owners]
+    if flash and flash_rig(config_paths, available_boards):
+        available_boards = [board for board in check_connected_board_info() if board.serial_number in owners]
+
+    processes = settings.get("processes", 0) if processes is None else processes
+    latency_report = settings.get("latency-report", False)
+    if processes <= 1:
+        return run_boxes(config_paths, available_boards, data_dir, latency_report)
+
+    names = list(config_paths)
+    groups = [{name: config_paths[name] for name in names[i::processes]} for i in range(processes)]
+    failures: dict[str, str] = {}
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [
+            pool.submit(run_boxes, group, available_boards, data_dir, latency_report)
+            for group in groups if group
+        ]
+        for future in futures:
+            failures.update(future.result())
+    return failures
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run every box of a rig from one host process.")
+    parser.add_argument("--yaml", "-y", required=True, help="Path to the rig YAML file")
+    parser.add_argument("--processes", "-p", type=int, default=None,
+                        help="Spread boxes over this many worker processes (overrides `Rig: processes`)")
+    parser.add_argument("--data-dir", "-d", default=None, help="Directory of the recorded data files")
+    parser.add_argument("--no-flash", action="store_true", help="Skip uploading sketches")
+    args = parser.parse_args()
+
+    failures = run_rig(args.yaml, args.processes, args.data_dir, not args.no_flash)
+    for name, error in failures.items():
+        print(f"{name}: {error}")
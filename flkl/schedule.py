@@ -0,0 +1,116 @@
+from typing import Optional
+
+# One row per trial. `reward` is drawn up front, so probabilistic rewards
+# (e.g. `reward-probability-for-audio`) are part of the reproducible plan.
+SCHEDULE_DTYPE = [
+    ("trial", "i4"),
+    ("modality", "i1"),
+    ("vhz", "f8"),
+    ("ahz", "f8"),
+    ("iti", "f8"),
+    ("reward", "?"),
+]
+
+
+def mix(a: list, b: list, ra: int, rb: int) -> list:
+    return a * ra + b * rb
+
+
+def gng_stimuli(expvars: dict) -> list[tuple[int, float, float, float]]:
+    rewarded = expvars.get("rewarded-frequency", [10, 12, 14])
+    extinction = expvars.get("extinction-frequency", [4, 6, 8])
+    sync = mix(rewarded, extinction, expvars.get("reward-ratio", 1), expvars.get("extinction-ratio", 1))
+    asyncs = [tuple(flickr) for flickr in expvars.get("async-flickrs", [[9, 8], [9, 10]])]
+    audio = expvars.get("audio-frequency", [5, 7, 11, 13])
+    audio_probability = expvars.get("reward-probability-for-audio", 0.2)
+
+    groups = [
+        ([(0, f, f, float(f in rewarded)) for f in sync], expvars.get("sync-ratio", 1)),
+        ([(1, v, a, float(v in rewarded)) for v, a in asyncs], expvars.get("async-ratio", 1)),
+        ([(2, f, 0, float(f in rewarded)) for f in sync], expvars.get("visual-ratio", 1)),
+        ([(3, 0, f, audio_probability) for f in audio], expvars.get("audio-ratio", 1)),
+    ]
+    return [stimulus for stimuli, ratio in groups for stimulus in stimuli * ratio]
+
+
+def training_stimuli(expvars: dict) -> list[tuple[int, float, float, float]]:
+    rewarded = expvars.get("rewarded-frequency", [12, 14, 16])
+    extinction = expvars.get("extinction-frequency", [6, 8, 10])
+    sync = mix(rewarded, extinction, expvars.get("reward-ratio", 1), expvars.get("extinction-ratio", 1))
+    audio = expvars.get("audio-frequency", [2, 9, 11, 13, 20])
+
+    groups = [
+        ([(0, f, f, float(f in rewarded)) for f in sync], expvars.get("sync-ratio", 1)),
+        ([(1, f, 0, float(f in rewarded)) for f in sync], expvars.get("visual-ratio", 1)),
+        ([(2, 0, f, 0.0) for f in audio], expvars.get("audio-ratio", 1)),
+    ]
+    return [stimulus for stimuli, ratio in groups for stimulus in stimuli * ratio]
+
+
+STIMULI = {"gng": gng_stimuli, "training": training_stimuli}
+
+
+def resolve_seed(expvars: dict) -> int:
+    from numpy.random import SeedSequence
+
+    seed = expvars.get("seed")
+    return int(SeedSequence().entropy) if seed is None else int(seed)
+
+
+def compile_schedule(expvars: dict, task: str = "gng", seed: Optional[int] = None):
+    from numpy import arange, argsort, array, empty
+    from numpy.random import default_rng
+
+    if seed is None:
+        seed = resolve_seed(expvars)
+    stimuli = array(STIMULI[task](expvars), dtype=float)
+    nstim = len(stimuli)
+    nblock = expvars.get("trials-per-stimulus", 20)
+    iti_mean = expvars.get("ITI", 15.0)
+    iti_range = expvars.get("ITI-range", 5.0)
+
+    rng = default_rng(seed)
+    # every block presents each stimulus once in its own random order
+    order = argsort(rng.random((nblock, nstim)), axis=1).ravel()
+    trials = stimuli[order]
+
+    schedule = empty(len(order), dtype=SCHEDULE_DTYPE)
+    schedule["trial"] = arange(1, len(order) + 1)
+    schedule["modality"] = trials[:, 0]
+    schedule["vhz"] = trials[:, 1]
+    schedule["ahz"] = trials[:, 2]
+    schedule["iti"] = rng.uniform(iti_mean - iti_range, iti_mean + iti_range, len(order))
+    schedule["reward"] = rng.random(len(order)) < trials[:, 3]
+    return schedule, seed
+
+
+def schedule_hash(expvars: dict, task: str, seed: int) -> str:
+    import json
+    from hashlib import sha256
+
+    key = json.dumps({"task": task, "seed": seed, "expvars": expvars}, sort_keys=True, default=str)
+    return sha256(key.encode()).hexdigest()[:16]
+
+
+def load_or_compile(expvars: dict, task: str = "gng", cache_dir: str = "./cache"):
+    from os import makedirs
+    from os.path import exists, join
+
+    from numpy import load, save
+
+    if expvars.get("seed") is None:
+        return compile_schedule(expvars, task)
+    seed = resolve_seed(expvars)
+    path = join(cache_dir, f"schedule-{schedule_hash(expvars, task, seed)}.npy")
+    if exists(path):
+        return load(path), seed
+    schedule, seed = compile_schedule(expvars, task, seed)
+    makedirs(cache_dir, exist_ok=True)
+    save(path, schedule)
+    return schedule, seed
+
+
+def save_schedule(filename: str, schedule, seed: int):
+    from numpy import savez
+
+    savez(f"{filename}.schedule.npz", schedule=schedule, seed=seed)
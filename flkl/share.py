@@ -1,63 +1,242 @@
+from contextlib import contextmanager
+from time import perf_counter, perf_counter_ns
+from typing import Callable, Optional
+
 from amas.agent import Agent, NotWorkingError
 from pyno.ino import ArduinoFlicker, ArduinoLineReader, as_bytes
 
+from flkl import latency
+from flkl.command import (ABORT_CHANNEL, ALL_CHANNELS, CLEAR_QUEUE, COMMANDS,
+                          ENQUEUE_FLICKER_TRIAL, ENQUEUE_TRIAL, FLICK_FOR,
+                          FLICK_FOR2, FLICK_ON, FLICK_ON2, HIGH_FOR,
+                          START_CHANNEL, START_FLICKER, START_QUEUE,
+                          START_SYNC, STOP_SYNC, UPDATE_CHANNEL,
+                          UPDATE_FLICKER, Command)
+from flkl.firmware import check_firmware, query_firmware
+
+# Binary event frame emitted by `ino.ino` when the event format is switched
+# to binary: pin/edge byte, little-endian 32-bit micros, sync byte.
+EVENT_FRAME_SIZE = 6
+EVENT_FRAME_SYNC = 0xA5
+EVENT_FRAME_OFFSET = 0x80
+EVENT_FRAME_PIN = 0x7F
+
+# Pin byte of the frame sent back for a clock ping ('\x31').
+CLOCK_EVENT = 0x7F
+# Pin byte of the frame sent by the controller when a queued trial starts.
+# Tasks driving trials from the host send `(HOST_MICROS, TRIAL_EVENT)` to the
+# recorder at stimulus onset instead; HOST_MICROS marks rows without board time.
+TRIAL_EVENT = 0x7E
+HOST_MICROS = -1
+# Pin byte of the frame sent by the controller when a sync pulse goes high.
+SYNC_EVENT = 0x7B
+
+# Sequenced event format ('\x30' with 2): every batch of edges starts with a
+# BATCH_EVENT frame carrying the sequence number of its first edge in place of
+# micros, and edges the board's ring buffer could not hold are reported as an
+# OVERFLOW_EVENT frame with their count. The recorder gets (count,
+# OVERFLOW_EVENT) rows for the latter and (count, LOST_EVENT) rows for edges
+# missing between the board and the host.
+BATCH_EVENT = 0x7A
+OVERFLOW_EVENT = 0x7D
+LOST_EVENT = 0x79
+EVENT_FORMATS = {"ascii": 0, "binary": 1, "sequenced": 2}
+
 
 class Flkl(ArduinoFlicker):
     from pyno.ino import ArduinoConnecter
 
-    def __init__(self, connecter: ArduinoConnecter):
+    # `handshake` asks the board for its build and command layouts, which
+    # blocks for up to HANDSHAKE_TIMEOUT on boards that predate it; sessions
+    # do it once at setup, tools talking to a freshly flashed board skip it.
+    def __init__(self, connecter: ArduinoConnecter, handshake: bool = False, io: str = "thread"):
         super().__init__(connecter)
-
-    def flick_for(self, pin: int, hz: float, flickr_duration: int, rpin: int, millis: int, pulse_duration: int = 20):
-        hz = int(hz * 10)
-        message = (b"\x13"
-            + as_bytes(pin, 1)
-            + as_bytes(hz, 1)
-            + as_bytes(flickr_duration, 2)
-            + as_bytes(pulse_duration, 2)
-            + as_bytes(rpin, 1)
-            + as_bytes(millis, 2)
-        )
+        self._buffer = bytearray(64)
+        self._offset = 0
+        self._batching = False
+        self._batch_start = 0
+        self.firmware = query_firmware(self.connection) if handshake else None
+        check_firmware(self.firmware)
+        self._unsupported = set()
+        if self.firmware is not None:
+            self._unsupported = {c.opcode for c in COMMANDS if not self.firmware.supports(c.opcode)}
+        self.transport = open_io(self.connection, io, "Flkl")
+        # `flkl.bus.EventBus` every command is published to
+        self.bus = None
+        self._drainer = None
+
+    def supports(self, command: Command) -> bool:
+        return command.opcode not in self._unsupported
+
+    def _write(self, message, start: int):
+        if self.transport is not None:
+            # queued without blocking; there is no transmit time to wait for
+            self.transport.write(message)
+            tracker = latency.current()
+            if tracker is not None:
+                tracker.record("write", start)
+            return
         self.connection.write(message)
+        tracker = latency.current()
+        if tracker is not None:
+            written = perf_counter_ns()
+            tracker.record("write", start, written)
+            self._time_transmit(tracker, written)
+
+    # Waits for the output buffer to drain on a worker thread, so timing the
+    # transmit hop never holds up the controller.
+    def _time_transmit(self, tracker, written: int):
+        if self._drainer is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._drainer = ThreadPoolExecutor(1, thread_name_prefix="Flkl-transmit")
+
+        def drained():
+            self.connection.flush()
+            tracker.record("transmit", written)
+
+        self._drainer.submit(drained)
+
+    def _send(self, command: Command, *values):
+        start = perf_counter_ns()
+        if command.opcode in self._unsupported:
+            raise RuntimeError(f"The firmware on this board does not support `{command.name}`.")
+        if len(self._buffer) < self._offset + command.size:
+            self._buffer.extend(bytes(len(self._buffer)))
+        end = command.pack_into(self._buffer, self._offset, *values)
+        if self.bus is not None:
+            self.bus.publish_command(command.opcode, self._buffer[self._offset + 1 : end], start)
+        if self._batching:
+            if self._offset == 0:
+                self._batch_start = start
+            self._offset = end
+            return
+        self._write(memoryview(self._buffer)[:end], start)
+
+    # Waits while the asyncio transport has more than its high-water mark
+    # queued; commands never wait otherwise.
+    async def drain(self):
+        if self.transport is not None:
+            await self.transport.drain()
+
+    # Sends what the transport still holds and stops timing transmits; the
+    # port itself stays open for its connecter to close.
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self._drainer is not None:
+            self._drainer.shutdown()
+            self._drainer = None
+
+    @contextmanager
+    def batch(self):
+        self._batching = True
+        try:
+            yield self
+        finally:
+            self._batching = False
+            if self._offset > 0:
+                self._write(memoryview(self._buffer)[: self._offset], self._batch_start)
+                self._offset = 0
+
+    # Rates or durations the legacy commands cannot carry exactly (e.g. 40 Hz,
+    # 12.34 Hz or stimuli over 65 s) are sent as extended flicker commands.
+    def flick_for(self, pin: int, hz: float, flickr_duration: int, rpin: int = 0, millis: int = 0, pulse_duration: int = 20):
+        values = (pin, hz, flickr_duration, pulse_duration, rpin, millis)
+        if FLICK_FOR.exact(values):
+            self._send(FLICK_FOR, *values)
+        else:
+            self.start_flicker(0, pin, hz, flickr_duration / 1000, rpin, millis / 1000,
+                               legacy_pulse(hz, pulse_duration))
 
     def flick_on(self, pin: int, hz: float, flickr_duration: int, pulse_duration: int = 20):
-        hz = int(hz * 10)
-        message = b"\x14" + as_bytes(pin, 1) + as_bytes(hz, 1) + as_bytes(flickr_duration, 2) + as_bytes(pulse_duration, 2)
-        self.connection.write(message)
-
-    def flick_for2(self, pin1: int, pin2: int, hz1: float, hz2: float, flickr_duration: int, rpin: int, millis: int, pulse_duration: int = 20):
-        hz1 = int(hz1 * 10)
-        hz2 = int(hz2 * 10)
-        message = (
-            b"\x15"
-            + as_bytes(pin1, 1)
-            + as_bytes(pin2, 1)
-            + as_bytes(hz1, 1)
-            + as_bytes(hz2, 1)
-            + as_bytes(flickr_duration, 2)
-            + as_bytes(pulse_duration, 2)
-            + as_bytes(rpin, 1)
-            + as_bytes(millis, 2)
-        )
-        self.connection.write(message)
+        values = (pin, hz, flickr_duration, pulse_duration)
+        if FLICK_ON.exact(values):
+            self._send(FLICK_ON, *values)
+        else:
+            self.start_flicker(0, pin, hz, flickr_duration / 1000, pulse_duration=legacy_pulse(hz, pulse_duration))
+
+    def flick_for2(self, pin1: int, pin2: int, hz1: float, hz2: float, flickr_duration: int, rpin: int = 0, millis: int = 0, pulse_duration: int = 20):
+        values = (pin1, pin2, hz1, hz2, flickr_duration, pulse_duration, rpin, millis)
+        if FLICK_FOR2.exact(values):
+            self._send(FLICK_FOR2, *values)
+            return
+        with self.batch():
+            self.start_flicker(0, pin1, hz1, flickr_duration / 1000, rpin, millis / 1000,
+                               legacy_pulse(hz1, pulse_duration))
+            self.start_flicker(1, pin2, hz2, flickr_duration / 1000, pulse_duration=legacy_pulse(hz2, pulse_duration))
 
     def flick_on2(self, pin1: int, pin2: int, hz1: float, hz2: float, flickr_duration: int, pulse_duration: int = 20):
-        hz1 = int(hz1 * 10)
-        hz2 = int(hz2 * 10)
-        message = (
-            b"\x16"
-            + as_bytes(pin1, 1)
-            + as_bytes(pin2, 1)
-            + as_bytes(hz1, 1)
-            + as_bytes(hz2, 1)
-            + as_bytes(flickr_duration, 2)
-            + as_bytes(pulse_duration, 2)
-        )
-        self.connection.write(message)
+        values = (pin1, pin2, hz1, hz2, flickr_duration, pulse_duration)
+        if FLICK_ON2.exact(values):
+            self._send(FLICK_ON2, *values)
+            return
+        with self.batch():
+            self.start_flicker(0, pin1, hz1, flickr_duration / 1000, pulse_duration=legacy_pulse(hz1, pulse_duration))
+            self.start_flicker(1, pin2, hz2, flickr_duration / 1000, pulse_duration=legacy_pulse(hz2, pulse_duration))
 
     def high_for(self, pin: int, millis: int):
-        message = b"\x17" + as_bytes(pin, 1) + as_bytes(millis, 2)
-        self.connection.write(message)
+        self._send(HIGH_FOR, pin, millis)
+
+    def enqueue_trial(self, pin1: int, pin2: int, hz1: float, hz2: float, flickr_duration: int,
+                      rpin: int, millis: int, iti: int, pulse_duration: int = 20):
+        values = (pin1, pin2, hz1, hz2, flickr_duration, pulse_duration, rpin, millis, iti)
+        if ENQUEUE_TRIAL.exact(values):
+            self._send(ENQUEUE_TRIAL, *values)
+        else:
+            self._send(ENQUEUE_FLICKER_TRIAL, pin1, pin2, hz1, hz2, flickr_duration / 1000,
+                       legacy_pulse(max(hz1, hz2), pulse_duration), rpin, millis / 1000, iti / 1000)
+
+    def start_queue(self):
+        self._send(START_QUEUE, 0)
+
+    def clear_queue(self):
+        self._send(CLEAR_QUEUE, 0)
+
+    def start_channel(self, channel: int, pin: int, hz: float, flickr_duration: int,
+                      rpin: int = 0, millis: int = 0, pulse_duration: int = 20):
+        self._send(START_CHANNEL, channel, pin, hz, flickr_duration, pulse_duration, rpin, millis)
+
+    def update_channel(self, channel: int, hz: float, pulse_duration: int = 20):
+        self._send(UPDATE_CHANNEL, channel, hz, pulse_duration)
+
+    def abort_channel(self, channel: int = ALL_CHANNELS):
+        self._send(ABORT_CHANNEL, channel)
+
+    # `hz` in 0.001 Hz steps and times in seconds (microsecond resolution);
+    # the pulse defaults to half the period.
+    def start_flicker(self, channel: int, pin: int, hz: float, duration: float,
+                      rpin: int = 0, reward_duration: float = 0.0, pulse_duration: Optional[float] = None):
+        if pulse_duration is None:
+            pulse_duration = half_period(hz)
+        self._send(START_FLICKER, channel, pin, hz, duration, pulse_duration, rpin, reward_duration)
+
+    def update_flicker(self, channel: int, hz: float, pulse_duration: Optional[float] = None):
+        if pulse_duration is None:
+            pulse_duration = half_period(hz)
+        self._send(UPDATE_FLICKER, channel, hz, pulse_duration)
+
+    # Sync pulses timed by the board, reported back as SYNC_EVENT frames.
+    # Times in seconds, intervals in whole milliseconds.
+    def start_sync(self, pin: int, pulse_duration: float, min_interval: float, max_interval: float, seed: int):
+        if not 0.0 < min_interval <= max_interval:
+            raise ValueError(f"Invalid sync interval range: {min_interval} - {max_interval}")
+        self._send(START_SYNC, pin, pulse_duration, min_interval, max_interval, seed)
+
+    def stop_sync(self):
+        self._send(STOP_SYNC, 0)
+
+
+def half_period(hz: float) -> float:
+    return 0.5 / hz if hz > 0 else 0.0
+
+
+# Legacy pulse widths (ms) as seconds, capped at half the period so a 20 ms
+# default pulse still flickers at gamma rates instead of staying on.
+def legacy_pulse(hz: float, pulse_duration: int) -> float:
+    pulse = pulse_duration / 1000
+    return min(pulse, half_period(hz)) if hz > 0 else pulse
 
 
 def as_millis(s: float) -> int:
@@ -68,10 +247,21 @@ def show_progress(trial: int, iti: float, hz: float, pin: int):
     print(f"Trial {trial}: flickr ({hz}) follows after {iti} sec on {pin} pin")
 
 
+# Lines are "<pin><micros>" from pyno's sketches, where a leading 1 stands for
+# pin 10, or "<pin> <micros>" from `ino.ino`; offsets carry a negative pin.
 def as_eventtime(readline: str) -> tuple[int, int]:
+    event, separator, time = readline.partition(" ")
+    if separator:
+        try:
+            return int(event), int(time)
+        except ValueError:
+            return -1, -1
+    sign = 1
+    if readline.startswith("-"):
+        sign, readline = -1, readline[1:]
     try:
         event_id = int(readline[0])
-    except IndexError:
+    except (IndexError, ValueError):
         return -1, -1
     if event_id == 1:
         event_id = 10
@@ -82,145 +272,387 @@ def as_eventtime(readline: str) -> tuple[int, int]:
         micros = int(readline[timeidx:])
     except ValueError:
         return -1, -1
-    return event_id, micros
+    return sign * event_id, micros
+
+
+def decode_frames(buffer: bytes) -> tuple[list[int], list[int], int]:
+    from numpy import dtype, flatnonzero, frombuffer, where
+
+    frame = dtype([("pin", "u1"), ("micros", "<u4"), ("sync", "u1")])
+    events: list[int] = []
+    micros: list[int] = []
+    head, size = 0, len(buffer)
+
+    while size - head >= EVENT_FRAME_SIZE:
+        n = (size - head) // EVENT_FRAME_SIZE
+        frames = frombuffer(buffer, dtype=frame, count=n, offset=head)
+        broken = flatnonzero(frames["sync"] != EVENT_FRAME_SYNC)
+        valid = frames if len(broken) == 0 else frames[: broken[0]]
+        pins = valid["pin"].astype(int)
+        events.extend(where(pins & EVENT_FRAME_OFFSET, -(pins & EVENT_FRAME_PIN), pins).tolist())
+        micros.extend(valid["micros"].tolist())
+        head += len(valid) * EVENT_FRAME_SIZE
+        if len(broken) == 0:
+            break
+        # resynchronize on the next sync byte that could close a frame
+        sync = buffer.find(EVENT_FRAME_SYNC, head + EVENT_FRAME_SIZE)
+        head = size - EVENT_FRAME_SIZE + 1 if sync < 0 else sync - EVENT_FRAME_SIZE + 1
+    return events, micros, head
+
+
+class EventSequence:
+    def __init__(self):
+        self.next: Optional[int] = None
+        self.dropped = 0
+        self.lost = 0
+
+    # Strips the batch and overflow frames out of decoded events and returns
+    # the edges with the rows reporting dropped and lost ones.
+    def check(self, events: list[int], micros: list[int]) -> tuple[list[int], list[int], list[tuple[int, int]]]:
+        kept_events: list[int] = []
+        kept_micros: list[int] = []
+        reports: list[tuple[int, int]] = []
+        for event, time in zip(events, micros):
+            if event == BATCH_EVENT:
+                if self.next is not None and time != self.next:
+                    missing = (time - self.next) & 0xFFFFFFFF
+                    self.lost += missing
+                    reports.append((missing, LOST_EVENT))
+                    print(f"Reader: {missing} events lost between the board and the host")
+                self.next = time
+                continue
+            if event == OVERFLOW_EVENT:
+                self.dropped += time
+                reports.append((time, OVERFLOW_EVENT))
+                print(f"Reader: {time} events dropped by the board's edge buffer")
+                continue
+            # only edges are numbered, not clock, trial or handshake frames
+            if self.next is not None and abs(event) < BATCH_EVENT:
+                self.next = (self.next + 1) & 0xFFFFFFFF
+            kept_events.append(event)
+            kept_micros.append(time)
+        return kept_events, kept_micros, reports
 
 
-async def flush_message_for(agent: Agent, duration: float):
-    from time import perf_counter
+def decode_lines(buffer: bytes) -> tuple[list[int], list[int], int]:
+    consumed = buffer.rfind(b"\n") + 1
+    events: list[int] = []
+    micros: list[int] = []
+    for line in bytes(buffer[:consumed]).splitlines():
+        event, time = as_eventtime(line.rstrip().decode("utf-8"))
+        events.append(event)
+        micros.append(time)
+    return events, micros, consumed
 
-    while duration >= 0.0 and agent.working():
-        s = perf_counter()
-        await agent.try_recv(duration)
-        e = perf_counter()
-        duration -= e - s
 
+def as_events(mess) -> list:
+    return mess if isinstance(mess, list) else [mess]
 
-async def count_lick(agent: Agent, duration: float, target) -> int:
-    from time import perf_counter
 
-    nlick = 0
+def unpack_mail(mail) -> list:
+    _, mess = mail
+    events = as_events(mess)
+    tracker = latency.current()
+    if tracker is not None:
+        tracker.delivered(len(events))
+    return events
+
+
+def read_available(connection) -> bytes:
+    return connection.read(max(1, connection.in_waiting))
+
+
+# Serial I/O from the event loop (`io: "async"`) or from executor threads and
+# blocking calls (`io: "thread"`).
+def open_io(connection, io: str, name: str):
+    from flkl.transport import open_transport
+
+    if io == "thread":
+        return None
+    if io != "async":
+        raise ValueError(f"Unknown serial I/O mode: {io}")
+    transport = open_transport(connection)
+    if transport is None:
+        print(f"{name}: asyncio serial I/O is not available on this port; using threads")
+    return transport
+
+
+def set_event_format(ino: ArduinoLineReader, protocol: str):
+    if protocol not in EVENT_FORMATS:
+        raise ValueError(f"Unknown event protocol: {protocol}")
+    ino.connection.write(b"\x30" + as_bytes(EVENT_FORMATS[protocol], 1))
+
 
-    while duration >= 0.0 and agent.working():
-        s = perf_counter()
-        mail = await agent.try_recv(duration)
-        duration -= perf_counter() - s
+# Time source of the deadlines and contingencies below; `flkl.replay` swaps
+# in a virtual clock with `use_clock`.
+_clock: Callable[[], float] = perf_counter
+
+
+def now() -> float:
+    return _clock()
+
+
+def use_clock(clock: Optional[Callable[[], float]] = None):
+    global _clock
+    _clock = perf_counter if clock is None else clock
+
+
+class Deadline:
+    def __init__(self, duration: float, start: Optional[float] = None):
+        self.at = (now() if start is None else start) + duration
+
+    def remaining(self) -> float:
+        return self.at - now()
+
+    def expired(self) -> bool:
+        return self.at <= now()
+
+    def postpone(self, duration: float):
+        self.at = now() + duration
+
+
+async def window(agent: Agent, *deadlines: Deadline):
+    while agent.working():
+        remaining = min(deadline.at for deadline in deadlines) - now()
+        if remaining <= 0.0:
+            return
+        mail = await agent.try_recv(remaining)
         if mail is None:
             continue
-        _, mess = mail
-        if mess == target:
+        for event in unpack_mail(mail):
+            yield event
+
+
+async def flush_message_for(agent: Agent, duration: float):
+    async for _ in window(agent, Deadline(duration)):
+        pass
+
+
+async def count_lick(agent: Agent, duration: float, target) -> int:
+    nlick = 0
+    async for event in window(agent, Deadline(duration)):
+        if event == target:
             nlick += 1
     return nlick
 
 
+# Also returns the time from `onset` (default: the start of the window) to the
+# first lick, or None without licks.
+async def count_lick_latency(agent: Agent, duration: float, target,
+                             onset: Optional[float] = None) -> tuple[int, Optional[float]]:
+    nlick, latency = 0, None
+    deadline = Deadline(duration)
+    if onset is None:
+        onset = deadline.at - duration
+    async for event in window(agent, deadline):
+        if event == target:
+            if latency is None:
+                latency = now() - onset
+            nlick += 1
+    return nlick, latency
+
+
 async def go_with_limit(
     agent: Agent,
     correct: int,
     decision_duration: float,
     max_duration: float,
 ):
-    from time import perf_counter
-
-    while max_duration >= 0.0 and agent.working():
-        s = perf_counter()
-        mail = await agent.try_recv(max_duration)
-        ellapsed_time = perf_counter() - s
-        decision_duration -= ellapsed_time
-        max_duration -= ellapsed_time
-
-        if mail is None:
-            break
+    decision = Deadline(decision_duration)
 
-        _, mess = mail
-        if mess == correct and decision_duration <= 0.0:
+    async for event in window(agent, Deadline(max_duration)):
+        if event == correct and decision.expired():
+            tracker = latency.current()
+            if tracker is not None:
+                tracker.decided()
             break
-        else:
-            continue
 
 
 async def nogo_with_postpone(
     agent: Agent, incorrect: int, decision_duration: float, max_duration: float
 ):
-    from time import perf_counter
-
-    _decission_duration = decision_duration
+    quiet = Deadline(decision_duration)
 
-    while max_duration >= 0.0 and agent.working():
-        s = perf_counter()
-        mail = await agent.try_recv(decision_duration)
-        ellapsed_time = perf_counter() - s
-        max_duration -= ellapsed_time
-        if mail is None:
-            break
-        _, mess = mail
-        if mess == incorrect:
-            continue
+    async for _ in window(agent, quiet, Deadline(max_duration)):
+        quiet.postpone(decision_duration)
 
 
 async def fixed_interval_with_postpone(agent: Agent, correct: int, decision_duration: float,
                                        min_duration: float, max_duration: float, postpone: float):
-    from time import perf_counter
-
-    max_duration -= (min_duration - decision_duration)
+    start = now()
 
     await flush_message_for(agent, min_duration - decision_duration)
 
-    while max_duration >= 0.0 and agent.working():
-        s = perf_counter()
-        mail = await agent.try_recv(max_duration)
-        ellapsed_time = perf_counter() - s
-
-        max_duration -= ellapsed_time
-        decision_duration -= ellapsed_time
-
-        if mail is None:
-            break
-
-        _, mess = mail
-
-        if mess != correct:
-            decision_duration = postpone
-        elif mess == correct and decision_duration <= 0.:
+    decision = Deadline(min_duration, start)
+    async for event in window(agent, Deadline(max_duration, start)):
+        if event != correct:
+            decision.postpone(postpone)
+        elif decision.expired():
+            tracker = latency.current()
+            if tracker is not None:
+                tracker.decided()
             break
 
 
 async def fixed_time_with_error(agent: Agent, correct: int,
                                 stimulus_duration: float, decision_duration: float) -> bool :
-    from time import perf_counter
+    start = now()
 
     await flush_message_for(agent, stimulus_duration - decision_duration)
 
     ncorrect = 0
-    while decision_duration >= 0.:
-        s = perf_counter()
-        mail = await agent.try_recv(decision_duration)
-        decision_duration -= perf_counter() - s
-
-        if mail is None:
-            continue
-
-        _, mess = mail
-        if mess == correct:
-            ncorrect += 1
-        else:
-            ncorrect -= 1
+    async for event in window(agent, Deadline(stimulus_duration, start)):
+        ncorrect += 1 if event == correct else -1
 
     return ncorrect > 0
 
-async def read(agent: Agent, ino: ArduinoLineReader, expvars: dict):
+
+async def read(
+    agent: Agent,
+    ino: ArduinoLineReader,
+    expvars: dict,
+    protocol: str = "ascii",
+    batch: bool = False,
+    wakeup_latency: Optional[float] = None,
+    clock=None,
+    io: str = "thread",
+    bus=None,
+):
     from utex.agent import AgentAddress
 
     response_pin = expvars.get("response-pin", [6, 7])
+    transport = open_io(ino.connection, io, "Reader")
+    timeout = wakeup_latency if wakeup_latency is not None else getattr(ino.connection, "timeout", 1.0)
+
+    frames = protocol in ("binary", "sequenced")
+    if clock is not None and not frames:
+        raise ValueError("Clock synchronization needs the binary protocol.")
 
     try:
+        if batch or frames:
+            decode = decode_frames if frames else decode_lines
+            sequence = EventSequence() if protocol == "sequenced" else None
+            return await read_chunks(agent, ino, response_pin, decode, batch, wakeup_latency, clock, sequence, transport, bus)
+
         while agent.working():
-            readline: bytes = await agent.call_async(ino.readline)
+            if transport is None:
+                readline: bytes = await agent.call_async(ino.readline)
+            else:
+                readline = await transport.readline(timeout)
             if readline is None:
                 continue
+            received = perf_counter_ns()
+            tracker = latency.current()
             decoded_readline = readline.rstrip().decode("utf-8")
             event, time = as_eventtime(decoded_readline)
             if event in response_pin:
                 agent.send_to(AgentAddress.CONTROLLER.value, event)
+                if tracker is not None:
+                    tracker.sent()
             agent.send_to(AgentAddress.RECORDER.value, (time, event))
+            if bus is not None:
+                bus.publish(event, time, host_ns=received)
+            if tracker is not None:
+                tracker.record("read", received)
+
+    except NotWorkingError:
+        pass
+    finally:
+        if transport is not None:
+            transport.close()
+
+
+async def read_chunks(
+    agent: Agent,
+    ino: ArduinoLineReader,
+    response_pin: list[int],
+    decode: Callable[[bytes], tuple[list[int], list[int], int]],
+    batch: bool,
+    wakeup_latency: Optional[float],
+    clock=None,
+    sequence: Optional[EventSequence] = None,
+    transport=None,
+    bus=None,
+):
+    from utex.agent import AgentAddress
+
+    if wakeup_latency is not None:
+        ino.connection.timeout = wakeup_latency
+    timeout = getattr(ino.connection, "timeout", 1.0)
+
+    buffer = bytearray()
+
+    try:
+        while agent.working():
+            if transport is None:
+                chunk: bytes = await agent.call_async(read_available, ino.connection)
+            else:
+                chunk = await transport.read(timeout)
+            if not chunk:
+                continue
+            received = perf_counter_ns()
+            tracker = latency.current()
+            buffer += chunk
+            events, micros, consumed = decode(buffer)
+            del buffer[:consumed]
+            reports = []
+            if sequence is not None:
+                events, micros, reports = sequence.check(events, micros)
+            if clock is None:
+                rows = list(zip(micros, events))
+            else:
+                events, micros, hosts = clock.correct(events, micros, received * 1e-9)
+                rows = list(zip(micros, events, hosts))
+                if tracker is not None and clock.synchronized():
+                    for host in hosts:
+                        tracker.record("board", int(host * 1e9), received)
+            if reports and batch:
+                agent.send_to(AgentAddress.RECORDER.value, reports)
+            elif reports:
+                [agent.send_to(AgentAddress.RECORDER.value, report) for report in reports]
+            if batch:
+                responses = [event for event in events if event in response_pin]
+                if responses:
+                    agent.send_to(AgentAddress.CONTROLLER.value, responses)
+                    if tracker is not None:
+                        tracker.sent(len(responses))
+                if rows:
+                    agent.send_to(AgentAddress.RECORDER.value, rows)
+            else:
+                for event, row in zip(events, rows):
+                    if event in response_pin:
+                        agent.send_to(AgentAddress.CONTROLLER.value, event)
+                        if tracker is not None:
+                            tracker.sent()
+                    agent.send_to(AgentAddress.RECORDER.value, row)
+            if bus is not None:
+                # after dispatch, so the contingencies never wait for it
+                bus.publish_events(events, micros, received)
+                if reports:
+                    bus.publish_events([event for _, event in reports], [count for count, _ in reports], received)
+            if tracker is not None and events:
+                tracker.record("read", received)
 
     except NotWorkingError:
         pass
+    finally:
+        if sequence is not None and (sequence.dropped or sequence.lost):
+            print(f"Reader: {sequence.dropped} events dropped on the board, {sequence.lost} lost in transit")
+
+
+async def record(agent: Agent, filename: str, timing: bool = True):
+    with open(filename, "w") as f:
+        try:
+            while agent.working():
+                mail = await agent.try_recv(1.0)
+                if mail is None:
+                    continue
+                _, mess = mail
+                received = perf_counter()
+                for row in as_events(mess):
+                    if not isinstance(row, tuple):
+                        continue
+                    fields = (received, *row) if timing else row
+                    f.write(", ".join(map(str, fields)) + "\n")
+        except NotWorkingError:
+            pass
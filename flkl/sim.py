@@ -0,0 +1,414 @@
+from collections import deque
+from threading import Condition, Thread
+from typing import NamedTuple, Optional
+
+from amas.agent import Agent
+
+from flkl.command import LAYOUTS
+
+SCALED_EXPVARS = ["ITI", "ITI-range", "flickr-duration", "decision-duration", "reward-duration"]
+
+
+# In-process stand-in for the serial connection of a board running `ino.ino`.
+# Written commands are decoded into `commands`, and input edges are generated
+# as Poisson streams at `rates` (events per second per pin). In the sequenced
+# format a fraction `loss` of the edges is discarded after numbering, as if
+# lost on the wire.
+class SimulatedBoard:
+    def __init__(
+        self,
+        rates: Optional[dict[int, float]] = None,
+        protocol: str = "ascii",
+        lick_duration: float = 0.02,
+        timeout: Optional[float] = 1.0,
+        seed: Optional[int] = None,
+        loss: float = 0.0,
+    ):
+        from random import Random
+        from time import perf_counter_ns
+
+        self.rates = rates or {}
+        self.protocol = protocol
+        self.lick_duration = lick_duration
+        self.timeout = timeout
+        self.loss = loss
+        self.sequence = 0
+        self.commands: list[tuple[float, int, tuple]] = []
+        self.emitted: dict[int, deque] = {pin: deque(maxlen=4096) for pin in self.rates}
+        self._random = Random(seed)
+        self._origin = perf_counter_ns()
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._cond = Condition()
+        self._running = False
+        self._thread: Optional[Thread] = None
+        self.queue: deque[tuple] = deque()
+        self._queue_thread: Optional[Thread] = None
+        self._sync: Optional[tuple] = None
+        self._sync_thread: Optional[Thread] = None
+
+    def micros(self) -> int:
+        from time import perf_counter_ns
+
+        return ((perf_counter_ns() - self._origin) // 1000) & 0xFFFFFFFF
+
+    def start(self) -> "SimulatedBoard":
+        self._running = True
+        self._thread = Thread(target=self._generate, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        self._sync = None
+        for thread in (self._thread, self._queue_thread, self._sync_thread):
+            if thread is not None:
+                thread.join()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._rx)
+
+    def read(self, size: int = 1) -> bytes:
+        with self._cond:
+            self._cond.wait_for(lambda: self._rx or not self._running, self.timeout)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+        return data
+
+    def readline(self) -> bytes:
+        with self._cond:
+            self._cond.wait_for(lambda: b"\n" in self._rx or not self._running, self.timeout)
+            end = self._rx.find(b"\n") + 1
+            data = bytes(self._rx[:end])
+            del self._rx[:end]
+        return data
+
+    def write(self, data: bytes) -> int:
+        from struct import calcsize, unpack_from
+        from time import perf_counter
+
+        now = perf_counter()
+        self._tx += data
+        while self._tx:
+            opcode = self._tx[0]
+            layout = LAYOUTS.get(opcode, "<B")
+            size = 1 + calcsize(layout)
+            if len(self._tx) < size:
+                break
+            fields = unpack_from(layout, self._tx, 1)
+            del self._tx[:size]
+            self.commands.append((now, opcode, fields))
+            self._respond(opcode, fields)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _respond(self, opcode: int, fields: tuple):
+        if opcode == 0x30:
+            from flkl.share import EVENT_FORMATS
+
+            self.protocol = {v: k for k, v in EVENT_FORMATS.items()}.get(fields[0], "ascii")
+        elif opcode == 0x31:
+            from struct import pack
+
+            from flkl.share import CLOCK_EVENT, EVENT_FRAME_SYNC
+
+            self._push(pack("<BIB", CLOCK_EVENT, self.micros(), EVENT_FRAME_SYNC))
+        elif opcode == 0x40:
+            *_, flickr, _, _, millis, iti = fields
+            self.queue.append((flickr / 1000, millis / 1000, iti / 1000))
+        elif opcode == 0x43:
+            *_, flickr, _, _, reward, iti = fields
+            self.queue.append((flickr / 1e6, reward / 1e6, iti / 1e6))
+        elif opcode == 0x41 and self._queue_thread is None:
+            self._running = True
+            self._queue_thread = Thread(target=self._run_queue, daemon=True)
+            self._queue_thread.start()
+        elif opcode == 0x42:
+            self.queue.clear()
+        elif opcode == 0x32:
+            from struct import pack
+
+            from flkl.firmware import HANDSHAKE_EVENT, format_layouts
+            from flkl.share import EVENT_FRAME_SYNC
+
+            table = format_layouts(LAYOUTS).encode()
+            from flkl.firmware import SEQUENCED_PROTOCOL
+
+            header = pack("<BIBBH", HANDSHAKE_EVENT, 0, EVENT_FRAME_SYNC, SEQUENCED_PROTOCOL, len(table))
+            self._push(header + table)
+        elif opcode == 0x60:
+            self._sync = fields
+            if self._sync_thread is None or not self._sync_thread.is_alive():
+                self._sync_thread = Thread(target=self._run_sync, daemon=True)
+                self._sync_thread.start()
+        elif opcode == 0x61:
+            self._sync = None
+        elif opcode in (0x20, 0x21):
+            self._push(b"\x00")
+
+    def _push(self, data: bytes):
+        with self._cond:
+            self._rx += data
+            self._cond.notify_all()
+
+    def _emit(self, pin: int, offset: bool):
+        from struct import pack
+        from time import perf_counter
+
+        from flkl.share import BATCH_EVENT, EVENT_FRAME_OFFSET, EVENT_FRAME_SYNC
+
+        t = self.micros()
+        head = pin | EVENT_FRAME_OFFSET if offset else pin
+        if self.protocol == "binary":
+            data = pack("<BIB", head, t, EVENT_FRAME_SYNC)
+        elif self.protocol == "sequenced":
+            sequence = self.sequence
+            self.sequence = (sequence + 1) & 0xFFFFFFFF
+            if self._random.random() < self.loss:
+                return
+            data = pack("<BIBBIB", BATCH_EVENT, sequence, EVENT_FRAME_SYNC, head, t, EVENT_FRAME_SYNC)
+        else:
+            # the text format of `ino.ino`
+            data = f"{-pin if offset else pin} {t}\r\n".encode()
+        if not offset:
+            # stamped before the reader can see the edge, which `probe` looks up
+            self.emitted[pin].append(perf_counter())
+        self._push(data)
+
+    def _run_queue(self):
+        from struct import pack
+        from time import perf_counter
+
+        from flkl.share import EVENT_FRAME_SYNC, TRIAL_EVENT
+
+        end = perf_counter()
+        while self._running:
+            if not self.queue:
+                with self._cond:
+                    self._cond.wait(0.01)
+                continue
+            flickr, reward, iti = self.queue[0]
+            wait = end + iti - perf_counter()
+            if wait > 0.0:
+                with self._cond:
+                    self._cond.wait(min(wait, 0.1))
+                continue
+            self.queue.popleft()
+            self._push(pack("<BIB", TRIAL_EVENT, self.micros(), EVENT_FRAME_SYNC))
+            end = perf_counter() + flickr + reward
+
+    # Sync pulses at the intervals `ino.ino` draws from the seed, each due one
+    # interval after the previous one was due.
+    def _run_sync(self):
+        from struct import pack
+        from time import perf_counter
+
+        from flkl.share import EVENT_FRAME_SYNC, SYNC_EVENT
+        from flkl.sync import iter_sync_intervals
+
+        fields = None
+        while self._sync is not None:
+            if self._sync is not fields:
+                fields = self._sync
+                _, _, min_interval, max_interval, seed = fields
+                intervals = iter_sync_intervals(seed, min_interval, max_interval)
+                due = perf_counter()
+            wait = due - perf_counter()
+            if wait > 0.0:
+                with self._cond:
+                    self._cond.wait(min(wait, 0.1))
+                continue
+            self._push(pack("<BIB", SYNC_EVENT, self.micros(), EVENT_FRAME_SYNC))
+            due += next(intervals) / 1000
+
+    def _generate(self):
+        from heapq import heapify, heappop, heappush
+        from time import perf_counter
+
+        start = perf_counter()
+        pending = [
+            (start + self._random.expovariate(rate), pin, False)
+            for pin, rate in self.rates.items()
+            if rate > 0.0
+        ]
+        heapify(pending)
+
+        while self._running and pending:
+            at, pin, offset = pending[0]
+            wait = at - perf_counter()
+            if wait > 0.0:
+                with self._cond:
+                    self._cond.wait(min(wait, 0.1))
+                continue
+            heappop(pending)
+            self._emit(pin, offset)
+            if offset:
+                heappush(pending, (at + self._random.expovariate(self.rates[pin]), pin, False))
+            else:
+                heappush(pending, (at + self.lick_duration, pin, True))
+
+
+def scale_expvars(expvars: dict, speed: float) -> dict:
+    scaled = dict(expvars)
+    for key in SCALED_EXPVARS:
+        if key in scaled:
+            scaled[key] = scaled[key] / speed
+    return scaled
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+    n = len(ordered)
+    return {
+        "n": n,
+        "p50": ordered[n // 2],
+        "p99": ordered[min(n - 1, int(n * 0.99))],
+        "max": ordered[-1],
+    }
+
+
+async def probe(agent: Agent, board: SimulatedBoard, latencies: list[float]):
+    from time import perf_counter
+
+    from amas.agent import NotWorkingError
+
+    from flkl.share import as_events
+
+    try:
+        while agent.working():
+            mail = await agent.try_recv(1.0)
+            if mail is None:
+                continue
+            now = perf_counter()
+            _, mess = mail
+            for event in as_events(mess):
+                emitted = board.emitted.get(event)
+                if emitted:
+                    latencies.append(now - emitted.popleft())
+    except NotWorkingError:
+        pass
+
+
+async def stop_after(agent: Agent, duration: float):
+    from amas.agent import NotWorkingError
+    from utex.agent import AgentAddress
+    from utex.scheduler import SessionMarker
+
+    try:
+        await agent.sleep(duration)
+        agent.send_to(AgentAddress.OBSERVER.value, SessionMarker.NEND)
+        agent.finish()
+    except NotWorkingError:
+        pass
+
+
+class Simulation(NamedTuple):
+    reader_board: SimulatedBoard
+    controller_board: SimulatedBoard
+    filename: str
+    latencies: list[float]
+
+
+# Runs a test2 session, or the latency probe for `probe_duration` seconds,
+# against simulated boards and returns once it ends.
+def simulate(expvars: dict, filename: str, rate: float = 5.0, protocol: str = "ascii", loss: float = 0.0,
+             batch: bool = False, probe_duration: Optional[float] = None, schedule=None) -> Simulation:
+    from amas.connection import Register
+    from amas.env import Environment
+    from pyno.ino import ArduinoLineReader
+    from utex.agent import AgentAddress, Observer, self_terminate
+    from utex.scheduler import SessionMarker
+
+    from flkl.share import Flkl, read, record
+    from flkl.test2 import flickr_discrimination
+
+    response_pin = expvars.get("response-pin", [6])
+    reader_board = SimulatedBoard({pin: rate for pin in response_pin}, protocol, loss=loss).start()
+    controller_board = SimulatedBoard()
+    latencies: list[float] = []
+
+    controller = Agent(AgentAddress.CONTROLLER.value)
+    if probe_duration is None:
+        controller.assign_task(flickr_discrimination, ino=Flkl(controller_board, handshake=True),
+                               expvars=expvars, schedule=schedule)
+    else:
+        controller.assign_task(probe, board=reader_board, latencies=latencies)
+        controller.assign_task(stop_after, duration=probe_duration)
+    controller.assign_task(self_terminate)
+
+    reader = (
+        Agent(AgentAddress.READER.value)
+        .assign_task(read, ino=ArduinoLineReader(reader_board), expvars=expvars,
+                     protocol=protocol, batch=batch)
+        .assign_task(self_terminate)
+    )
+    recorder = (
+        Agent(AgentAddress.RECORDER.value)
+        .assign_task(record, filename=filename, timing=True)
+        .assign_task(self_terminate)
+    )
+    observer = Observer()
+
+    agents = [controller, recorder, reader, observer]
+    register = Register(agents)
+    env = Environment(agents)
+
+    try:
+        env.run()
+    except KeyboardInterrupt:
+        observer.send_all(SessionMarker.ABEND)
+        observer.finish()
+    finally:
+        reader_board.close()
+    return Simulation(reader_board, controller_board, filename, latencies)
+
+
+if __name__ == "__main__":
+    import argparse
+    from os.path import join
+    from tempfile import mkdtemp
+    from time import perf_counter
+
+    from utex.clap import Config
+
+    from flkl import latency
+
+    parser = argparse.ArgumentParser(description="Run a session against simulated boards.")
+    parser.add_argument("--yaml", "-y", required=True, help="Path to YAML config file")
+    parser.add_argument("--speed", type=float, default=100.0, help="Time compression of the session")
+    parser.add_argument("--rate", type=float, default=5.0, help="Licks per second on each response pin")
+    parser.add_argument("--protocol", default="ascii", choices=["ascii", "binary", "sequenced"])
+    parser.add_argument("--loss", type=float, default=0.0, help="Fraction of sequenced edges lost on the wire")
+    parser.add_argument("--batch", action="store_true", help="Use the batched reader")
+    parser.add_argument("--probe", type=float, default=None,
+                        help="Replace the task with a latency probe running for this many seconds")
+    parser.add_argument("--output", "-o", default=None, help="Path of the recorded data file")
+    parser.add_argument("--latency-report", action="store_true", help="Record per-hop latency histograms")
+    args = parser.parse_args()
+
+    config = Config(args.yaml)
+    expvars = scale_expvars(config.experimental, args.speed)
+    filename = args.output or join(mkdtemp(), "sim.csv")
+
+    if args.latency_report:
+        latency.enable()
+
+    start = perf_counter()
+    simulation = simulate(expvars, filename, args.rate, args.protocol, args.loss, args.batch, args.probe)
+
+    print(f"Session finished in {perf_counter() - start:.2f} sec, recorded to {filename}")
+    print(f"Commands sent to controller: {len(simulation.controller_board.commands)}")
+    if args.probe is not None:
+        print(f"Event to controller latency (sec): {percentiles(simulation.latencies)}")
+    tracker = latency.current()
+    if tracker is not None:
+        tracker.dump(f"{filename}.latency.json")
+        for hop, summary in tracker.summary().items():
+            print(f"{hop}: {summary}")
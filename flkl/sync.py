@@ -0,0 +1,285 @@
+from typing import NamedTuple, Optional
+
+# Aligns video to a session through IR sync pulses. The controller fires the
+# pulses on its own clock at pseudo-random intervals (`Flkl.start_sync`) and
+# reports the micros of each one; `SyncLog` records them with the host time
+# they arrived. Offline, `detect_flashes` finds the pulses in a per-frame
+# brightness trace of the video and `align` matches them to the recorded
+# emissions by their interval pattern, which no shift of a different part of
+# the train reproduces, so missed or spurious flashes and dropped frames only
+# cost the anchors around them.
+
+# Sync parameters of training sessions without `ir-interval`/`ir-seed`.
+DEFAULT_INTERVAL = (5.0, 15.0)
+DEFAULT_PULSE = 0.05
+# Consecutive intervals compared per anchor.
+SIGNATURE_LENGTH = 3
+# Anchors around each one its offset is checked against.
+CONSISTENCY_WINDOW = 9
+
+
+# The intervals (ms) the board draws with `seed`, as `nextSyncInterval` in
+# `ino.ino`.
+def iter_sync_intervals(seed: int, min_interval: int, max_interval: int):
+    state = seed & 0xFFFFFFFF or 1
+    span = max(1, max_interval - min_interval + 1)
+    while True:
+        state ^= (state << 13) & 0xFFFFFFFF
+        state ^= state >> 17
+        state ^= (state << 5) & 0xFFFFFFFF
+        yield min_interval + state % span
+
+
+def sync_intervals(seed: int, n: int, min_interval: int, max_interval: int) -> list[int]:
+    from itertools import islice
+
+    return list(islice(iter_sync_intervals(seed, min_interval, max_interval), n))
+
+
+# Appends each SYNC_EVENT frame as "host, micros" to `path`, with the sync
+# parameters in a comment line on top.
+class SyncLog:
+    def __init__(self, path: str):
+        from flkl.share import SYNC_EVENT
+
+        self.path = path
+        self.event = SYNC_EVENT
+        self.count = 0
+        self._file = open(path, "w")
+
+    def start(self, pin: int, pulse_duration: float, min_interval: float, max_interval: float, seed: int):
+        self._file.write(f"# host, micros; pin={pin} pulse={pulse_duration} "
+                         f"interval={min_interval}-{max_interval} seed={seed}\n")
+        self._file.flush()
+
+    def __call__(self, event: int, micros: int):
+        from time import perf_counter
+
+        if event != self.event:
+            return
+        self._file.write(f"{perf_counter()}, {micros}\n")
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+# Reads the controller's frames and logs its sync pulses, for sessions where
+# no other task reads the controller.
+async def listen_sync(agent, ino, log: SyncLog):
+    from flkl.share import decode_frames, read_available
+
+    if ino.connection.timeout is None:
+        ino.connection.timeout = 1.0
+    buffer = bytearray()
+    while agent.working():
+        chunk: bytes = await agent.call_async(read_available, ino.connection)
+        if not chunk:
+            continue
+        buffer += chunk
+        events, micros, consumed = decode_frames(buffer)
+        del buffer[:consumed]
+        [log(event, time) for event, time in zip(events, micros)]
+
+
+# Host and unwrapped board seconds of the logged pulses.
+def load_sync_log(path: str):
+    import numpy as np
+
+    from flkl.clock import unwrap_micros
+
+    rows = np.loadtxt(path, delimiter=",", ndmin=2)
+    if len(rows) == 0:
+        return np.empty(0), np.empty(0)
+    return rows[:, 0], unwrap_micros(rows[:, 1].astype(np.int64)) * 1e-6
+
+
+# Frames at which the trace rises through `threshold`; by default halfway
+# between the median frame and the brightest flashes.
+def detect_flashes(brightness, threshold: Optional[float] = None):
+    import numpy as np
+
+    brightness = np.asarray(brightness, dtype=float)
+    if threshold is None:
+        threshold = (np.median(brightness) + np.percentile(brightness, 99.9)) / 2
+    above = brightness >= threshold
+    return np.flatnonzero(above[1:] & ~above[:-1]) + 1
+
+
+class Alignment(NamedTuple):
+    # matched flash times (video clock) and the emissions they were matched to
+    video: "np.ndarray"
+    board: "np.ndarray"
+    slope: float
+    offset: float
+    flashes: int
+    emissions: int
+
+    # Board seconds of each video time, interpolated between the matched
+    # flashes, so dropped frames between two of them shift only that stretch.
+    def to_board(self, times):
+        import numpy as np
+
+        times = np.asarray(times, dtype=float)
+        mapped = np.interp(times, self.video, self.board)
+        before, after = times < self.video[0], times > self.video[-1]
+        mapped[before] = self.board[0] + (times[before] - self.video[0]) * self.slope
+        mapped[after] = self.board[-1] + (times[after] - self.video[-1]) * self.slope
+        return mapped
+
+    def summary(self) -> dict:
+        import numpy as np
+
+        residual = np.abs(self.board - (self.video * self.slope + self.offset))
+        return {
+            "matched": len(self.video),
+            "flashes": self.flashes,
+            "emissions": self.emissions,
+            "slope": float(self.slope),
+            "offset": float(self.offset),
+            "linear_residual_p99_ms": float(np.percentile(residual, 99) * 1e3) if len(residual) else None,
+        }
+
+
+def signatures(times, length: int):
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    return sliding_window_view(times[1:] - times[:-1], length)
+
+
+# Candidate (flash, emission) pairs whose next `length` intervals all agree
+# within `tolerance`; emissions are searched by their first interval.
+def candidate_pairs(video, board, tolerance: float, length: int = SIGNATURE_LENGTH):
+    import numpy as np
+
+    if len(video) <= length or len(board) <= length:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    flash_sig, emission_sig = signatures(video, length), signatures(board, length)
+    order = np.argsort(emission_sig[:, 0])
+    first = emission_sig[order, 0]
+    lo = np.searchsorted(first, flash_sig[:, 0] - tolerance, "left")
+    hi = np.searchsorted(first, flash_sig[:, 0] + tolerance, "right")
+    counts = hi - lo
+    flash = np.repeat(np.arange(len(flash_sig)), counts)
+    starts = np.repeat(lo - (np.cumsum(counts) - counts), counts)
+    emission = order[np.arange(counts.sum()) + starts]
+    agree = np.all(np.abs(flash_sig[flash] - emission_sig[emission]) <= tolerance, axis=1)
+    return flash[agree], emission[agree]
+
+
+# Keeps the pairs whose offset is within `tolerance` of the median offset of
+# their neighbours; wrong matches land anywhere, true ones drift slowly.
+def consistent(video, board, tolerance: float, window: int = CONSISTENCY_WINDOW):
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    offset = board - video
+    if len(offset) == 0:
+        return np.zeros(0, dtype=bool)
+    half = window // 2
+    padded = np.pad(offset, half, mode="edge")
+    local = np.median(sliding_window_view(padded, min(window, len(padded))), axis=1)[: len(offset)]
+    return np.abs(offset - local) <= tolerance
+
+
+def align(video, board, tolerance: float = 0.1) -> Alignment:
+    import numpy as np
+
+    video = np.sort(np.asarray(video, dtype=float))
+    board = np.sort(np.asarray(board, dtype=float))
+    flash, emission = candidate_pairs(video, board, tolerance)
+    order = np.argsort(video[flash], kind="stable")
+    flash, emission = flash[order], emission[order]
+    keep = consistent(video[flash], board[emission], tolerance)
+    flash, emission = flash[keep], emission[keep]
+    if len(flash) < 2:
+        raise RuntimeError("Too few flashes match the sync pulses; check the trace threshold and the log.")
+
+    # second pass: every flash against the emission its anchors predict
+    slope, offset = np.polyfit(video[flash], board[emission], 1)
+    anchors = Alignment(video[flash], board[emission], slope, offset, len(video), len(board))
+    predicted = anchors.to_board(video)
+    nearest = np.clip(np.searchsorted(board, predicted), 1, len(board) - 1)
+    nearest -= predicted - board[nearest - 1] < board[nearest] - predicted
+    error = np.abs(board[nearest] - predicted)
+    matched = np.flatnonzero(error <= tolerance)
+    # one flash per emission, the closest
+    matched = matched[np.argsort(error[matched], kind="stable")]
+    _, first = np.unique(nearest[matched], return_index=True)
+    matched = np.sort(matched[first])
+
+    slope, offset = np.polyfit(video[matched], board[nearest[matched]], 1)
+    return Alignment(video[matched], board[nearest[matched]], slope, offset, len(video), len(board))
+
+
+# Host perf_counter seconds as a linear function of board seconds, from the
+# arrival times of the logged pulses; the earliest arrivals bound the latency.
+def board_to_host(host, board) -> tuple[float, float]:
+    import numpy as np
+
+    slope, _ = np.polyfit(board, host, 1)
+    return slope, float(np.min(host - board * slope))
+
+
+# Board and host seconds of every frame, from the video clock of each frame
+# (camera timestamps, or frame numbers over the nominal rate).
+def frame_map(log_path: str, brightness, frame_times, tolerance: Optional[float] = None,
+              threshold: Optional[float] = None) -> tuple["pd.DataFrame", dict]:
+    import numpy as np
+    import pandas as pd
+
+    frame_times = np.asarray(frame_times, dtype=float)
+    if tolerance is None:
+        # a flash is seen up to a frame late at either end of an interval
+        tolerance = 2.5 * float(np.median(np.diff(frame_times)))
+    host, board = load_sync_log(log_path)
+    flashes = frame_times[detect_flashes(brightness, threshold)]
+    alignment = align(flashes, board, tolerance)
+    mapped = alignment.to_board(frame_times)
+    slope, offset = board_to_host(host, board)
+    table = pd.DataFrame({
+        "frame": np.arange(len(frame_times)),
+        "video": frame_times,
+        "board": mapped,
+        "host": mapped * slope + offset,
+    })
+    return table, alignment.summary()
+
+
+def load_trace(path: str):
+    import numpy as np
+
+    if path.endswith(".npy"):
+        return np.load(path)
+    return np.loadtxt(path, delimiter=",", ndmin=1)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from time import perf_counter
+
+    parser = argparse.ArgumentParser(description="Map video frames to session time through IR sync pulses.")
+    parser.add_argument("log", help="Sync log of the session (*.sync.csv)")
+    parser.add_argument("brightness", help="Brightness of the IR spot per frame (.npy, or one value per line)")
+    parser.add_argument("--fps", type=float, default=None, help="Nominal frame rate, when there are no frame times")
+    parser.add_argument("--frame-times", default=None, help="Camera timestamps of the frames in seconds")
+    parser.add_argument("--threshold", type=float, default=None, help="Brightness of a flash")
+    parser.add_argument("--tolerance", type=float, default=None, help="Seconds two intervals may differ by")
+    parser.add_argument("--output", "-o", default=None, help="CSV of frame, video, board and host times")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    brightness = load_trace(args.brightness)
+    if args.frame_times is not None:
+        times = load_trace(args.frame_times)
+    elif args.fps is not None:
+        times = [i / args.fps for i in range(len(brightness))]
+    else:
+        parser.error("either --fps or --frame-times is needed")
+    table, summary = frame_map(args.log, brightness, times, args.tolerance, args.threshold)
+    summary["seconds"] = perf_counter() - start
+    print(json.dumps(summary, indent=2))
+    if args.output is not None:
+        table.to_csv(args.output, index=False)
@@ -100,21 +100,27 @@ async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict):
                 await flush_message_for(agent, iti_mean)
                 if modality == 0 or modality == 1:
                     ino.flick_for2(visual_pin, audio_pin, vhz, ahz, flickr_duration_millis)
+                    await ino.drain()
                     await flush_message_for(agent, flickr_duration - decision_duration)
                     nlick = await count_lick(agent, decision_duration, response_pin[0])
                     if vhz in flickr_sync_rwd and nlick >= required_lick:
                         ino.high_for(reward_pin, reward_duration_millis)
+                        await ino.drain()
                 elif modality == 2:
                     ino.flick_for(visual_pin, vhz, flickr_duration_millis)
+                    await ino.drain()
                     await flush_message_for(agent, flickr_duration - decision_duration)
                     nlick = await count_lick(agent, decision_duration, response_pin[0])
                     if vhz in flickr_sync_rwd and nlick >= required_lick:
                         ino.high_for(reward_pin, reward_duration_millis)
+                        await ino.drain()
                 else:
                     ino.flick_for(audio_pin, ahz, flickr_duration_millis)
+                    await ino.drain()
                     await agent.sleep(flickr_duration)
                     if uniform() < audio_reward_probability:
                         ino.high_for(reward_pin, reward_duration_millis)
+                        await ino.drain()
                 await agent.sleep(reward_duration)
             agent.send_to(AgentAddress.OBSERVER.value, SessionMarker.NEND)
             agent.finish()
@@ -122,95 +128,7 @@ async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict):
         pass
 
 if __name__ == "__main__":
-    from os import mkdir
-    from os.path import exists, join
-    from typing import Optional
-
-    from amas.agent import Agent
-    from amas.connection import Register
-    from amas.env import Environment
-    from pyno.com import check_connected_board_info
-    from pyno.ino import (ArduinoConnecter, ArduinoLineReader, ArduinoSetting,
-                          Mode, PinMode)
-    from utex.agent import AgentAddress, Observer, Recorder, self_terminate
-    from utex.clap import PinoClap
-    from utex.fs import get_current_file_abspath, namefile
-    from utex.scheduler import SessionMarker
-
-    from flkl.share import read
-
-    config = PinoClap().config()
-    com_input_config: Optional[dict] = config.comport.get("input")
-    com_output_config: Optional[dict] = config.comport.get("output")
-    if com_input_config is None or com_output_config is None:
-        raise ValueError("`com_input_config` and `com_output_config` are not defined.")
-    com_input_config.update({"mode": Mode.readeruno})
-    com_output_config.update({"mode": Mode.user})
-
-    if com_input_config is None and com_output_config is None:
-        raise Exception()
-
-    available_boards = check_connected_board_info()
-    for board in available_boards:
-        setting = ArduinoSetting.derive_from_portinfo(board)
-        if board.serial_number == com_input_config.get("serial-number"):
-            setting.apply_setting(com_input_config)
-            serial_number = com_input_config.get("serial-number")
-            print(f"Uploading sketch to reader arduino {serial_number}")
-        elif board.serial_number == com_output_config.get("serial-number"):
-            setting.apply_setting(com_output_config)
-            serial_number = com_output_config.get("serial-number")
-            print(f"Uploading sketch to controller arduino {serial_number}")
-        ArduinoConnecter(setting).write_sketch()
-
-    available_boards = check_connected_board_info()
-    reader_ino, flkl = None, None
-    for board in available_boards:
-        setting = ArduinoSetting.derive_from_portinfo(board)
-        if board.serial_number == com_input_config.get("serial-number"):
-            setting.apply_setting(com_input_config)
-            reader_ino = ArduinoLineReader(ArduinoConnecter(setting).connect())
-            [reader_ino.pin_mode(i, PinMode.INPUT) for i in range(0, 14)]
-        elif board.serial_number == com_output_config.get("serial-number"):
-            setting.apply_setting(com_output_config)
-            flkl = Flkl(ArduinoConnecter(setting).connect())
-            [flkl.pin_mode(i, PinMode.OUTPUT) for i in range(0, 14)]
-    if reader_ino is None:
-        raise ValueError(
-            f"Input arduino (serial number: {com_input_config.get('serial-number')}) is not found."
-        )
-
-    if flkl is None:
-        raise ValueError(
-            f"Output arduino (serial number: {com_output_config.get('serial-number')}) is not found."
-        )
-
-    data_dir = join(get_current_file_abspath(__file__), "data")
-    if not exists(data_dir):
-        mkdir(data_dir)
-    config.metadata.update({"condition": "gng-test"})
-    filename = join(data_dir, namefile(config.metadata))
-
-    controller = (
-        Agent("CONTROLLER")
-        .assign_task(flickr_discrimination, ino=flkl, expvars=config.experimental)
-        .assign_task(self_terminate)
-    )
-
-    reader = (
-        Agent(AgentAddress.READER.value)
-        .assign_task(read, ino=reader_ino, expvars=config.experimental)
-        .assign_task(self_terminate)
-    )
-    observer = Observer()
-    recorder = Recorder(filename=filename, timing=True)
+    from flkl.test2 import main
 
-    agents = [controller, recorder, reader, observer]
-    register = Register(agents)
-    env = Environment(agents)
-
-    try:
-        env.run()
-    except KeyboardInterrupt:
-        observer.send_all(SessionMarker.ABEND)
-        observer.finish()
+    # boards, recorder, reader options and teardown as in test2
+    main(flickr_discrimination)
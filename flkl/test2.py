@@ -1,3 +1,5 @@
+from typing import Callable, NamedTuple, Optional
+
 from amas.agent import Agent
 
 from flkl.share import Flkl
@@ -8,17 +10,16 @@ def show_progress(trial: int, iti: float, modality: int, vhz: float, ahz: float)
     print(f"Trial: {trial}    ITI: {iti}    Modality: {mod}    Vhz: {vhz}    Ahz: {ahz}")
 
 
-async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict):
-    from itertools import product
-
+async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict, schedule=None,
+                                analyzer: Optional[str] = None):
     from amas.agent import NotWorkingError
-    from numpy import arange
-    from numpy.random import uniform
     from utex.agent import AgentAddress
-    from utex.scheduler import (SessionMarker, TrialIterator,
-                                blockwise_shuffle2, mix, mixn, repeat)
+    from utex.scheduler import SessionMarker
 
-    from flkl.share import as_millis, count_lick, flush_message_for
+    from flkl.analytics import Outcome
+    from flkl.schedule import load_or_compile
+    from flkl.share import (HOST_MICROS, TRIAL_EVENT, as_millis,
+                            count_lick_latency, flush_message_for, now)
 
     reward_pin = expvars.get("reward-pin", 4)
     response_pin = expvars.get("response-pin", [6])
@@ -33,178 +34,311 @@ async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict):
     reward_duration_millis = as_millis(reward_duration)
     flickr_duration_millis = as_millis(flickr_duration)
 
-    audio_reward_probability = expvars.get("reward-probability-for-audio", 0.2)
-
-    dummy_flickr = [0]
-    flickr_async_test = expvars.get("test-frequency", 9)
-    flickr_sync_rwd = expvars.get("rewarded-frequency", [10, 12, 14])
-    flickr_sync_ext = expvars.get("extinction-frequency", [4, 6, 8])
-
-    flickr_sync = mix(
-        flickr_sync_rwd,
-        flickr_sync_ext,
-        expvars.get("reward-ratio", 1),
-        expvars.get("extinction-ratio", 1)
-    )
-    flickr_visual = flickr_sync
-    flickr_audio = expvars.get("audio-frequency", [5, 7, 11, 13])
-
-    flickr_async = [tuple(flickr) for flickr in expvars.get("async-flickrs", [[9, 8], [9, 10]])]
-    flickr_sync = list(zip(flickr_sync, flickr_sync))
-    flickr_visual = list(product(flickr_visual, dummy_flickr))
-    flickr_audio = list(product(dummy_flickr, flickr_audio))
-
-    flickrs = mixn(
-        [flickr_sync, flickr_async, flickr_visual, flickr_audio],
-        [
-            expvars.get("sync-ratio", 1),
-            expvars.get("async-ratio", 1),
-            expvars.get("visual-ratio", 1),
-            expvars.get("audio-ratio", 1),
-        ]
-    )
-
-    modalities = mixn([[0], [1], [2], [3]],
-                      [
-                          len(flickr_sync) * expvars.get("sync-ratio", 1),
-                          len(flickr_async) * expvars.get("async-ratio", 1),
-                          len(flickr_visual) * expvars.get("visual-ratio", 1),
-                          len(flickr_audio) * expvars.get("audio-ratio", 1)
-                      ]
-    )
-
-    iti_mean = expvars.get("ITI", 15.0)
-    iti_range = expvars.get("ITI-range", 5.0)
-    trials_per_stim = expvars.get("trials-per-stimulus", 20)
-
-    flickr_per_trial, modality_per_trial = blockwise_shuffle2(
-        repeat(flickrs, trials_per_stim),
-        repeat(modalities, trials_per_stim),
-        len(flickrs)
-    )
-
-    trials = TrialIterator(modality_per_trial, flickr_per_trial)
+    if schedule is None:
+        schedule, _ = load_or_compile(expvars, "gng")
 
     try:
         while agent.working():
-            for i, modality, flickr in trials:
-                vhz, ahz = flickr
-                iti = uniform(iti_mean - iti_range, iti_mean + iti_range)
+            for i, modality, vhz, ahz, iti, reward in schedule.tolist():
                 show_progress(i, iti, modality, vhz, ahz)
-                await flush_message_for(agent, iti_mean)
+                await flush_message_for(agent, iti)
+                nlick, latency = None, None
+                onset = now()
+                agent.send_to(AgentAddress.RECORDER.value, (HOST_MICROS, TRIAL_EVENT))
                 if modality == 0 or modality == 1:
                     ino.flick_for2(visual_pin, audio_pin, vhz, ahz, flickr_duration_millis)
+                    await ino.drain()
                     await flush_message_for(agent, flickr_duration - decision_duration)
-                    nlick = await count_lick(agent, decision_duration, response_pin[0])
-                    if vhz in flickr_sync_rwd and nlick >= required_lick:
+                    nlick, latency = await count_lick_latency(agent, decision_duration, response_pin[0], onset)
+                    if reward and nlick >= required_lick:
                         ino.high_for(reward_pin, reward_duration_millis)
+                        await ino.drain()
                 elif modality == 2:
                     ino.flick_for(visual_pin, vhz, flickr_duration_millis)
+                    await ino.drain()
                     await flush_message_for(agent, flickr_duration - decision_duration)
-                    nlick = await count_lick(agent, decision_duration, response_pin[0])
-                    if vhz in flickr_sync_rwd and nlick >= required_lick:
+                    nlick, latency = await count_lick_latency(agent, decision_duration, response_pin[0], onset)
+                    if reward and nlick >= required_lick:
                         ino.high_for(reward_pin, reward_duration_millis)
+                        await ino.drain()
                 else:
                     ino.flick_for(audio_pin, ahz, flickr_duration_millis)
+                    await ino.drain()
                     await agent.sleep(flickr_duration)
-                    if uniform() < audio_reward_probability:
+                    if reward:
                         ino.high_for(reward_pin, reward_duration_millis)
+                        await ino.drain()
+                if analyzer is not None:
+                    # after the reward command, so the analyzer never delays it
+                    agent.send_to(analyzer, Outcome(i, modality, vhz, ahz, bool(reward), nlick, latency))
                 await agent.sleep(reward_duration)
             agent.send_to(AgentAddress.OBSERVER.value, SessionMarker.NEND)
             agent.finish()
     except NotWorkingError:
         pass
 
-if __name__ == "__main__":
-    from os import mkdir
-    from os.path import exists, join
-    from typing import Optional
 
-    from amas.agent import Agent
-    from amas.connection import Register
-    from amas.env import Environment
-    from pyno.com import check_connected_board_info
-    from pyno.ino import (ArduinoConnecter, ArduinoLineReader, ArduinoSetting,
-                          Mode, PinMode)
-    from utex.agent import AgentAddress, Observer, Recorder, self_terminate
-    from utex.clap import PinoClap
-    from utex.fs import get_current_file_abspath, namefile
-    from utex.scheduler import SessionMarker
+class Session(NamedTuple):
+    env: "amas.env.Environment"
+    observer: "utex.agent.Observer"
+    filename: str
+    clock: Optional["flkl.clock.ClockSync"]
+    analytics: Optional["flkl.analytics.Analytics"]
+    remotes: tuple = ()
+    bus: Optional["flkl.bus.EventBus"] = None
+    controller: Optional[Flkl] = None
 
-    from flkl.share import read
 
-    config = PinoClap().config()
+def comport_configs(config) -> tuple[dict, dict]:
+    from pyno.ino import Mode
+
     com_input_config: Optional[dict] = config.comport.get("input")
     com_output_config: Optional[dict] = config.comport.get("output")
     if com_input_config is None or com_output_config is None:
         raise ValueError("`com_input_config` and `com_output_config` are not defined.")
     com_input_config.update({"mode": Mode.readeruno})
     com_output_config.update({"mode": Mode.user})
+    return com_input_config, com_output_config
 
-    if com_input_config is None and com_output_config is None:
-        raise Exception()
 
-    available_boards = check_connected_board_info()
-    for board in available_boards:
-        setting = ArduinoSetting.derive_from_portinfo(board)
-        if board.serial_number == com_input_config.get("serial-number"):
-            setting.apply_setting(com_input_config)
-            serial_number = com_input_config.get("serial-number")
-            print(f"Uploading sketch to reader arduino {serial_number}")
-        elif board.serial_number == com_output_config.get("serial-number"):
-            setting.apply_setting(com_output_config)
-            serial_number = com_output_config.get("serial-number")
-            print(f"Uploading sketch to controller arduino {serial_number}")
-        ArduinoConnecter(setting).write_sketch()
+def upload_targets(config, available_boards: list) -> list[tuple]:
+    com_input_config, com_output_config = comport_configs(config)
+    ports = {
+        com_input_config.get("serial-number"): com_input_config,
+        com_output_config.get("serial-number"): com_output_config,
+    }
+    return [(board, ports[board.serial_number]) for board in available_boards if board.serial_number in ports]
 
-    available_boards = check_connected_board_info()
-    reader_ino, flkl = None, None
+
+def flash_boards(config, available_boards: list, force: bool = False) -> list[str]:
+    from flkl.upload import upload_sketches
+
+    return upload_sketches(upload_targets(config, available_boards), force=force)
+
+
+# Boards attached to another host are reached through `python -m flkl.bridged`
+# there, with `bridge: "host:port"` in place of `serial-number`.
+def open_remote(config, port: dict):
+    address = port.get("bridge")
+    if address is None:
+        return None
+
+    from flkl.bridge import RemoteConnection
+
+    return RemoteConnection(address, port.get("timeout", 1.0), config.comport.get("bridge-ping", 1.0))
+
+
+def connect_boards(config, available_boards: list):
+    from pyno.ino import (ArduinoConnecter, ArduinoLineReader, ArduinoSetting,
+                          PinMode)
+
+    from flkl.firmware import build_hash, check_firmware, negotiate_protocol
+    from flkl.share import set_event_format
+    from flkl.upload import upload_sketches
+
+    com_input_config, com_output_config = comport_configs(config)
+    protocol = com_input_config.get("protocol", "ascii")
+    reader_connection = open_remote(config, com_input_config)
+    output_connection = open_remote(config, com_output_config)
+    output_board = None
     for board in available_boards:
         setting = ArduinoSetting.derive_from_portinfo(board)
-        if board.serial_number == com_input_config.get("serial-number"):
+        if reader_connection is None and board.serial_number == com_input_config.get("serial-number"):
             setting.apply_setting(com_input_config)
-            reader_ino = ArduinoLineReader(ArduinoConnecter(setting).connect())
-            [reader_ino.pin_mode(i, PinMode.INPUT) for i in range(0, 14)]
-        elif board.serial_number == com_output_config.get("serial-number"):
+            reader_connection = ArduinoConnecter(setting).connect()
+        elif output_connection is None and board.serial_number == com_output_config.get("serial-number"):
             setting.apply_setting(com_output_config)
-            flkl = Flkl(ArduinoConnecter(setting).connect())
-            [flkl.pin_mode(i, PinMode.OUTPUT) for i in range(0, 14)]
-    if reader_ino is None:
+            output_connection = ArduinoConnecter(setting).connect()
+            output_board = board
+    if reader_connection is None:
         raise ValueError(
             f"Input arduino (serial number: {com_input_config.get('serial-number')}) is not found."
         )
 
-    if flkl is None:
+    if output_connection is None:
         raise ValueError(
             f"Output arduino (serial number: {com_output_config.get('serial-number')}) is not found."
         )
 
-    data_dir = join(get_current_file_abspath(__file__), "data")
+    reader_ino = ArduinoLineReader(reader_connection)
+    if protocol == "auto":
+        protocol = negotiate_protocol(reader_ino.connection)
+    [reader_ino.pin_mode(i, PinMode.INPUT) for i in range(0, 14)]
+    if protocol != "ascii":
+        set_event_format(reader_ino, protocol)
+
+    sketch = com_output_config.get("sketch")
+    build = None if sketch is None else build_hash(sketch)
+    io = com_output_config.get("io", "thread")
+    try:
+        flkl = Flkl(output_connection, handshake=True, io=io)
+        check_firmware(flkl.firmware, build)
+    except RuntimeError as e:
+        # boards behind a bridge are flashed on their own host
+        if output_board is None:
+            raise
+        print(f"{e} Reflashing.")
+        output_connection.close()
+        upload_sketches([(output_board, com_output_config)], force=True)
+        setting = ArduinoSetting.derive_from_portinfo(output_board)
+        setting.apply_setting(com_output_config)
+        flkl = Flkl(ArduinoConnecter(setting).connect(), handshake=True, io=io)
+        check_firmware(flkl.firmware, build)
+    [flkl.pin_mode(i, PinMode.OUTPUT) for i in range(0, 14)]
+    return reader_ino, flkl, protocol
+
+
+# `task` is run as the controller with the board and the experimental
+# parameters, and with the compiled schedule and the analyzer's address when
+# it takes them; `flkl.test` passes its own task this way.
+def setup_session(config, available_boards: list, data_dir: Optional[str] = None,
+                  task: Optional[Callable] = None) -> Session:
+    from inspect import signature
+    from os import mkdir
+    from os.path import exists, join
+
+    from amas.connection import Register
+    from amas.env import Environment
+    from utex.agent import AgentAddress, Observer, Recorder, self_terminate
+    from utex.fs import get_current_file_abspath, namefile
+
+    from flkl.analytics import ANALYZER, Analytics, analyze
+    from flkl.bus import DEFAULT_CAPACITY, EventBus
+    from flkl.clock import ClockSync, synchronize
+    from flkl.recorder import SINKS, as_yaml, record_columns
+    from flkl.schedule import load_or_compile, save_schedule
+    from flkl.share import read, record
+
+    com_input_config, _ = comport_configs(config)
+    batch = com_input_config.get("batch", False)
+    wakeup_latency = com_input_config.get("wakeup-latency")
+    sync_interval = com_input_config.get("clock-sync")
+    clock = None if sync_interval is None else ClockSync()
+    reader_ino, flkl, protocol = connect_boards(config, available_boards)
+    bus_name = config.comport.get("event-bus")
+    bus = None if bus_name is None else EventBus(bus_name, config.comport.get("event-bus-capacity", DEFAULT_CAPACITY))
+    flkl.bus = bus
+
+    if data_dir is None:
+        data_dir = join(get_current_file_abspath(__file__), "data")
     if not exists(data_dir):
         mkdir(data_dir)
     config.metadata.update({"condition": "gng-test"})
     filename = join(data_dir, namefile(config.metadata))
 
+    if task is None:
+        task = flickr_discrimination
+    parameters = signature(task).parameters
+    task_args = {}
+    if "schedule" in parameters:
+        schedule, seed = load_or_compile(config.experimental, "gng")
+        save_schedule(filename, schedule, seed)
+        task_args["schedule"] = schedule
+    with open(f"{filename}.yaml", "w") as f:
+        f.write(as_yaml(config))
+
+    analytics_interval = config.comport.get("analytics")
+    analytics, analyzer = None, None
+    if analytics_interval is not None and "analyzer" in parameters:
+        task_args["analyzer"] = ANALYZER
+        analytics = Analytics(config.experimental.get("required-lick", 1))
+        analyzer = (
+            Agent(ANALYZER)
+            .assign_task(analyze, analytics=analytics, interval=analytics_interval)
+            .assign_task(self_terminate)
+        )
+
     controller = (
         Agent("CONTROLLER")
-        .assign_task(flickr_discrimination, ino=flkl, expvars=config.experimental)
+        .assign_task(task, ino=flkl, expvars=config.experimental, **task_args)
         .assign_task(self_terminate)
     )
 
     reader = (
         Agent(AgentAddress.READER.value)
-        .assign_task(read, ino=reader_ino, expvars=config.experimental)
+        .assign_task(read, ino=reader_ino, expvars=config.experimental,
+                     protocol=protocol, batch=batch, wakeup_latency=wakeup_latency, clock=clock,
+                     io=com_input_config.get("io", "thread"), bus=bus)
         .assign_task(self_terminate)
     )
+    if clock is not None:
+        reader.assign_task(synchronize, connection=reader_ino.connection, clock=clock, interval=sync_interval)
     observer = Observer()
-    recorder = Recorder(filename=filename, timing=True)
+    recorder_format = config.comport.get("recorder", "text")
+    if recorder_format in SINKS:
+        recorder = (
+            Agent(AgentAddress.RECORDER.value)
+            .assign_task(record_columns, filename=filename, sink=recorder_format,
+                         metadata=as_yaml(config),
+                         flush_interval=config.comport.get("flush-interval", 5.0))
+            .assign_task(self_terminate)
+        )
+    elif batch:
+        recorder = (
+            Agent(AgentAddress.RECORDER.value)
+            .assign_task(record, filename=filename, timing=True)
+            .assign_task(self_terminate)
+        )
+    else:
+        recorder = Recorder(filename=filename, timing=True)
 
     agents = [controller, recorder, reader, observer]
+    if analyzer is not None:
+        agents.append(analyzer)
     register = Register(agents)
-    env = Environment(agents)
+    remotes = tuple(c for c in (reader_ino.connection, flkl.connection) if hasattr(c, "rtts"))
+    return Session(Environment(agents), observer, filename, clock, analytics, remotes, bus, flkl)
+
+
+def abort_session(session: Session):
+    from utex.scheduler import SessionMarker
+
+    session.observer.send_all(SessionMarker.ABEND)
+    session.observer.finish()
+
+
+def run_session(session: Session):
+    from flkl import latency
 
     try:
-        env.run()
+        session.env.run()
     except KeyboardInterrupt:
-        observer.send_all(SessionMarker.ABEND)
-        observer.finish()
+        abort_session(session)
+    finally:
+        tracker = latency.current()
+        if tracker is not None:
+            tracker.dump(f"{session.filename}.latency.json")
+        if session.clock is not None:
+            session.clock.dump(f"{session.filename}.clock.json")
+        if session.analytics is not None:
+            session.analytics.dump(f"{session.filename}.analytics.json")
+        if session.remotes:
+            import json
+
+            with open(f"{session.filename}.bridge.json", "w") as f:
+                json.dump([remote.summary() for remote in session.remotes], f, indent=2)
+        if session.bus is not None:
+            session.bus.close()
+        if session.controller is not None:
+            session.controller.close()
+
+
+def main(task: Optional[Callable] = None):
+    from pyno.com import check_connected_board_info
+    from utex.clap import PinoClap
+
+    from flkl import latency
+
+    config = PinoClap().config()
+    available_boards = check_connected_board_info()
+    if flash_boards(config, available_boards):
+        # boards may re-enumerate after a reset
+        available_boards = check_connected_board_info()
+    session = setup_session(config, available_boards, task=task)
+    if config.comport.get("latency-report", False):
+        latency.enable()
+    run_session(session)
+
+
+if __name__ == "__main__":
+    main()
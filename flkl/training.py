@@ -1,6 +1,9 @@
+from typing import Callable, Optional
+
 from amas.agent import Agent
 
 from flkl.share import Flkl
+from flkl.sync import SyncLog
 
 
 def show_progress(trial: int, iti: float, modality: int, freq: float):
@@ -8,14 +11,13 @@ def show_progress(trial: int, iti: float, modality: int, freq: float):
     print(f"Trial: {trial}    ITI: {iti}    Modality: {mod}    Frequency: {freq}")
 
 
-async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict):
+async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict, schedule=None,
+                                on_frame: Optional[Callable[[int, int], None]] = None):
     from amas.agent import NotWorkingError
-    from numpy import arange
-    from numpy.random import uniform
     from utex.agent import AgentAddress
-    from utex.scheduler import (SessionMarker, TrialIterator,
-                                blockwise_shuffle2, mix, mixn, repeat)
+    from utex.scheduler import SessionMarker
 
+    from flkl.schedule import load_or_compile
     from flkl.share import as_millis, count_lick, flush_message_for
 
     reward_pin = expvars.get("reward-pin", 4)
@@ -28,67 +30,48 @@ async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict):
     reward_duration_millis = as_millis(reward_duration)
     flickr_duration_millis = as_millis(flickr_duration)
 
-    flickr_sync_rwd = expvars.get("rewarded-frequency", [12, 14, 16])
-    flickr_sync_ext = expvars.get("extinction-frequency", [6, 8, 10])
-    flickr_sync = mix(
-        flickr_sync_rwd,
-        flickr_sync_ext,
-        expvars.get("reward-ratio", 1),
-        expvars.get("extinction-ratio", 1)
-    )
-    flickr_visual = flickr_sync
-    flickr_audio = expvars.get("audio-frequency", [2, 9, 11, 13, 20])
-    flickrs = mixn(
-        [flickr_sync, flickr_visual, flickr_audio],
-        [
-            expvars.get("sync-ratio", 1),
-            expvars.get("visual-ratio", 1),
-            expvars.get("audio-ratio", 1),
-        ]
-    )
+    if schedule is None:
+        schedule, _ = load_or_compile(expvars, "training")
 
-    modalities = mixn([[0], [1], [2]],
-                      [
-                          len(flickr_sync) * expvars.get("sync-ratio", 1),
-                          len(flickr_visual) * expvars.get("visual-ratio", 1),
-                          len(flickr_audio) * expvars.get("audio-ratio", 1)
-                      ]
-    )
+    trials = [
+        (i, modality, ahz if modality == 2 else vhz, iti, reward)
+        for i, modality, vhz, ahz, iti, reward in schedule.tolist()
+    ]
 
-    iti_mean = expvars.get("ITI", 15.0)
-    iti_range = expvars.get("ITI-range", 5.0)
-    trials_per_stim = expvars.get("trials-per-stimulus", 20)
-
-    flickr_per_trial, modality_per_trial = blockwise_shuffle2(
-        repeat(flickrs, trials_per_stim),
-        repeat(modalities, trials_per_stim),
-        len(flickrs)
-    )
+    try:
+        if expvars.get("board-schedule", False):
+            from flkl.plan import PlannedTrial, run_plan
+
+            plan = []
+            for i, modality, flickr, iti, reward in trials:
+                rpin = reward_pin if reward else 0
+                pin1, pin2 = [(visual_pin, audio_pin), (visual_pin, visual_pin), (audio_pin, audio_pin)][modality]
+                hz2 = flickr if modality == 0 else 0
+                plan.append(PlannedTrial(pin1, pin2, flickr, hz2, flickr_duration_millis,
+                                         rpin, reward_duration_millis, as_millis(iti)))
+
+            def on_start(n: int, micros: int):
+                i, modality, flickr, iti, _ = trials[n]
+                show_progress(i, iti, modality, flickr)
+                print(f"    started on board at {micros} us")
 
-    trials = TrialIterator(modality_per_trial, flickr_per_trial)
+            await run_plan(agent, ino, plan, on_start=on_start, on_frame=on_frame)
+            await agent.sleep(flickr_duration + reward_duration)
+            agent.send_to(AgentAddress.OBSERVER.value, SessionMarker.NEND)
+            agent.finish()
 
-    try:
         while agent.working():
-            for i, modality, flickr in trials:
-                iti = uniform(iti_mean - iti_range, iti_mean + iti_range)
+            for i, modality, flickr, iti, reward in trials:
                 show_progress(i, iti, modality, flickr)
-                await flush_message_for(agent, iti_mean)
+                await flush_message_for(agent, iti)
+                rpin = reward_pin if reward else 0
                 if modality == 0:
-                    if flickr in flickr_sync_rwd:
-                        # ino.high_for(reward_pin, reward_duration_millis)
-                        ino.flick_for2(visual_pin, audio_pin, flickr, flickr, flickr_duration_millis, reward_pin, reward_duration_millis)
-                    else:
-                        ino.flick_for2(visual_pin, audio_pin, flickr, flickr, flickr_duration_millis, 0, reward_duration_millis)
-                    # await agent.sleep(flickr_duration + reward_duration)
+                    ino.flick_for2(visual_pin, audio_pin, flickr, flickr, flickr_duration_millis, rpin, reward_duration_millis)
                 elif modality == 1:
-                    if flickr in flickr_sync_rwd:
-                        # ino.high_for(reward_pin, reward_duration_millis)
-                        ino.flick_for(visual_pin, flickr, flickr_duration_millis, reward_pin, reward_duration_millis)
-                    else:
-                        ino.flick_for(visual_pin, flickr, flickr_duration_millis, 0, reward_duration_millis)
-                    # await agent.sleep(flickr_duration + reward_duration)
+                    ino.flick_for(visual_pin, flickr, flickr_duration_millis, rpin, reward_duration_millis)
                 else:
                     ino.flick_for(audio_pin, flickr, flickr_duration_millis, 0, reward_duration_millis)
+                await ino.drain()
                 await agent.sleep(flickr_duration + reward_duration)
             await agent.sleep(1.)
             agent.send_to(AgentAddress.OBSERVER.value, SessionMarker.NEND)
@@ -105,12 +88,44 @@ async def flickr_discrimination(agent: Agent, ino: Flkl, expvars: dict):
         pass
 
 
-async def ir_timestamp(agent: Agent, ino: Flkl, expvars: dict):
+# Sync pulses for video alignment. Firmware with `start_sync` times them on
+# the board at pseudo-random intervals and reports each one, which `log`
+# records; `listen` is off when another task already reads the controller.
+# Older firmware gets the host-timed flashes every `stamp_interval`.
+async def ir_timestamp(agent: Agent, ino: Flkl, expvars: dict, log: Optional[SyncLog] = None,
+                       listen: bool = True):
+    from random import getrandbits
+
     from amas.agent import NotWorkingError
 
+    from flkl.command import START_SYNC
     from flkl.share import as_millis
+    from flkl.sync import DEFAULT_INTERVAL, DEFAULT_PULSE, listen_sync
 
     ir_pin = expvars.get("ir-pin", 5)
+
+    if ino.firmware is not None and ino.firmware.supports(START_SYNC.opcode):
+        pulse_duration = expvars.get("ir-pulse-duration", DEFAULT_PULSE)
+        min_interval, max_interval = expvars.get("ir-interval", DEFAULT_INTERVAL)
+        seed = expvars.get("ir-seed")
+        if seed is None:
+            seed = getrandbits(32)
+        print(f"IR sync: {min_interval}-{max_interval} s intervals, seed {seed}")
+        if log is not None:
+            log.start(ir_pin, pulse_duration, min_interval, max_interval, seed)
+        ino.start_sync(ir_pin, pulse_duration, min_interval, max_interval, seed)
+        try:
+            await ino.drain()
+            if log is not None and listen:
+                await listen_sync(agent, ino, log)
+            while agent.working():
+                await agent.sleep(1.0)
+        except NotWorkingError:
+            pass
+        finally:
+            ino.stop_sync()
+        return
+
     initial_flash_duration = as_millis(0.1)
     stamp_duration = as_millis(0.05)
     stamp_interval = 10.0
@@ -118,9 +133,11 @@ async def ir_timestamp(agent: Agent, ino: Flkl, expvars: dict):
 
     try:
         ino.high_for(ir_pin, initial_flash_duration)
+        await ino.drain()
         await agent.sleep(stamp_interval)
         while agent.working():
             ino.high_for(ir_pin, stamp_duration)
+            await ino.drain()
             await agent.sleep(stamp_interval)
     except NotWorkingError:
         ino.high_for(ir_pin, last_flash_duration)
@@ -145,7 +162,9 @@ if __name__ == "__main__":
     from utex.fs import get_current_file_abspath, namefile
     from utex.scheduler import SessionMarker
 
+    from flkl.schedule import load_or_compile, save_schedule
     from flkl.share import read
+    from flkl.upload import upload_sketches
 
     # Step 1: 引数の読み込み
     parser = argparse.ArgumentParser(description="Run the flickr discrimination task.")
@@ -187,19 +206,27 @@ if __name__ == "__main__":
         raise RuntimeError("Multiple Arduino boards were detected. Please connect only one board and try again.")
 
     board = available_boards[0]
+    if upload_sketches([(board, com_output_config)]):
+        # the board may re-enumerate after a reset
+        board = check_connected_board_info()[0]
 
     setting = ArduinoSetting.derive_from_portinfo(board)
     setting.apply_setting(com_output_config)
-    serial_number = com_output_config.get("serial-number")
-    print(f"Uploading sketch to controller arduino {serial_number}")
-    ArduinoConnecter(setting).write_sketch()
-    flkl = Flkl(ArduinoConnecter(setting).connect())
+    flkl = Flkl(ArduinoConnecter(setting).connect(), handshake=True)
     [flkl.pin_mode(i, PinMode.OUTPUT) for i in range(0, 14)]
 
+    schedule, seed = load_or_compile(config.experimental, "training")
+    save_schedule(join(log_dir, f"{subject}-{timestamp}"), schedule, seed)
+
+    sync_log = SyncLog(join(log_dir, f"{subject}-{timestamp}.sync.csv"))
+    board_schedule = config.experimental.get("board-schedule", False)
+
     controller = (
         Agent("CONTROLLER")
-        .assign_task(flickr_discrimination, ino=flkl, expvars=config.experimental)
-        .assign_task(ir_timestamp, ino=flkl, expvars=config.experimental)
+        .assign_task(flickr_discrimination, ino=flkl, expvars=config.experimental, schedule=schedule,
+                     on_frame=sync_log if board_schedule else None)
+        .assign_task(ir_timestamp, ino=flkl, expvars=config.experimental, log=sync_log,
+                     listen=not board_schedule)
         .assign_task(self_terminate)
     )
 
@@ -214,3 +241,7 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         observer.send_all(SessionMarker.ABEND)
         observer.finish()
+    finally:
+        sync_log.close()
+        flkl.close()
+        print(f"IR sync: {sync_log.count} pulses logged to {sync_log.path}")
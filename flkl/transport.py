@@ -0,0 +1,177 @@
+import os
+from typing import Optional
+
+# Event-loop driven I/O on the file descriptor of a serial port. Reads wait
+# with `add_reader`, and writes the kernel does not take at once are finished
+# from `add_writer`, so neither the reader nor `Flkl` parks an executor thread
+# or blocks the loop. POSIX only; `open_transport` returns None elsewhere and
+# the callers keep their executor path.
+
+# Bytes queued for writing above which `drain` waits.
+HIGH_WATER = 4096
+READ_SIZE = 4096
+
+
+def open_transport(connection) -> Optional["SerialTransport"]:
+    import sys
+
+    if sys.platform == "win32" or not hasattr(connection, "fileno"):
+        return None
+    try:
+        connection.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    return SerialTransport(connection)
+
+
+class SerialTransport:
+    def __init__(self, connection, high_water: int = HIGH_WATER):
+        self.connection = connection
+        self.fd = connection.fileno()
+        os.set_blocking(self.fd, False)
+        self.high_water = high_water
+        self._rx = bytearray()
+        self._tx = bytearray()
+        self._loop = None
+        self._writing = False
+        self._waiters: list = []
+
+    async def _readable(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        loop.add_reader(self.fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(self.fd)
+
+    # pyserial sets VMIN=0, so an empty read means "nothing yet" unless the
+    # port was just reported readable, which is how a disconnect shows up.
+    async def _fill(self, timeout: Optional[float]) -> bool:
+        import asyncio
+
+        readable = False
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                data = b""
+            if data:
+                self._rx += data
+                return True
+            if readable:
+                raise ConnectionError(f"Serial port {self.connection.port} was disconnected.")
+            try:
+                await asyncio.wait_for(self._readable(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            readable = True
+
+    # Whatever is available, waiting up to `timeout` for the first byte; b""
+    # on timeout, like `serial.Serial.read`.
+    async def read(self, timeout: Optional[float] = None) -> bytes:
+        if not self._rx and not await self._fill(timeout):
+            return b""
+        data = bytes(self._rx)
+        self._rx.clear()
+        return data
+
+    # One line including b"\n", or None when none completes within `timeout`.
+    async def readline(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        from time import perf_counter
+
+        deadline = None if timeout is None else perf_counter() + timeout
+        while (end := self._rx.find(b"\n") + 1) == 0:
+            remaining = None if deadline is None else max(0.0, deadline - perf_counter())
+            if not await self._fill(remaining):
+                return None
+        line = bytes(self._rx[:end])
+        del self._rx[:end]
+        return line
+
+    # Never blocks inside the loop: what the kernel does not take is queued
+    # and written when the port becomes writable. Outside a running loop the
+    # queue is flushed before returning, so setup code keeps its byte order.
+    def write(self, data) -> int:
+        import asyncio
+
+        size = len(data)
+        if not self._tx:
+            try:
+                written = os.write(self.fd, data)
+            except BlockingIOError:
+                written = 0
+            if written == size:
+                return size
+            data = memoryview(data)[written:]
+        self._tx += data
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._flush_blocking()
+            return size
+        if not self._writing:
+            self._loop = loop
+            self._writing = True
+            loop.add_writer(self.fd, self._on_writable)
+        return size
+
+    # A failed write (e.g. the board was unplugged) drops the queue and fails
+    # the waiting `drain` calls; the next `write` raises on its own.
+    def _on_writable(self):
+        try:
+            written = os.write(self.fd, self._tx)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._loop.remove_writer(self.fd)
+            self._writing = False
+            self._tx.clear()
+            self._wake(ConnectionError(f"Writing to serial port {self.connection.port} failed: {e}"))
+            return
+        del self._tx[:written]
+        if not self._tx:
+            self._loop.remove_writer(self.fd)
+            self._writing = False
+        if len(self._tx) <= self.high_water:
+            self._wake()
+
+    def _wake(self, error: Optional[BaseException] = None):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if error is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(error)
+
+    def _flush_blocking(self):
+        from select import select
+
+        while self._tx:
+            select([], [self.fd], [])
+            try:
+                del self._tx[: os.write(self.fd, self._tx)]
+            except BlockingIOError:
+                continue
+
+    def pending(self) -> int:
+        return len(self._tx)
+
+    # Waits until the queued bytes fall to the high-water mark.
+    async def drain(self):
+        import asyncio
+
+        while len(self._tx) > self.high_water:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def close(self):
+        if self._writing:
+            self._loop.remove_writer(self.fd)
+            self._writing = False
+        self._flush_blocking()
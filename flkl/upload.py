@@ -0,0 +1,170 @@
+from typing import Optional
+
+from flkl.firmware import BUILD_HEADER
+
+# Serial number -> hash of the sketch and settings this host last flashed onto
+# that board. Boards running a sketch that reports its build are checked over
+# the firmware handshake regardless; the cache only spares that check when the
+# sketch or its settings changed since, and decides alone for pyno's sketches,
+# which cannot report what they are.
+UPLOAD_CACHE = "./cache/uploads.json"
+
+# Keys read only by the host, which do not change what ends up on the board.
+HOST_ONLY_SETTINGS = ["timeout", "protocol", "batch", "wakeup-latency", "clock-sync", "io"]
+
+
+def sketch_files(sketch: str) -> list[str]:
+    from os import listdir
+    from os.path import isdir, join
+
+    if not isdir(sketch):
+        return [sketch]
+    return sorted(
+        join(sketch, f) for f in listdir(sketch)
+        if f.endswith((".ino", ".h", ".cpp", ".c")) and f != BUILD_HEADER
+    )
+
+
+def sketch_hash(com_config: dict) -> str:
+    import json
+    from hashlib import sha256
+    from importlib.metadata import PackageNotFoundError, version
+
+    h = sha256()
+    settings = {k: v for k, v in com_config.items() if k not in HOST_ONLY_SETTINGS}
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    sketch = com_config.get("sketch")
+    if sketch is None:
+        # the sketch bundled with pyno for this mode
+        try:
+            h.update(version("pyno").encode())
+        except PackageNotFoundError:
+            pass
+    else:
+        for path in sketch_files(sketch):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def load_uploads(path: str = UPLOAD_CACHE) -> dict[str, str]:
+    import json
+    from os.path import exists
+
+    if not exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_uploads(uploads: dict[str, str], path: str = UPLOAD_CACHE):
+    import json
+    from os import makedirs
+    from os.path import dirname
+
+    makedirs(dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(uploads, f, indent=2, sort_keys=True)
+
+
+# The build the board reports in the firmware handshake, or None when it does
+# not answer one (nothing flashed yet, pyno's sketches, another baud rate) or
+# its command layouts differ from the host's.
+def flashed_build(setting) -> Optional[int]:
+    from pyno.ino import ArduinoConnecter
+
+    from flkl.firmware import query_firmware
+
+    connection = ArduinoConnecter(setting).connect()
+    try:
+        firmware = query_firmware(connection)
+    finally:
+        connection.close()
+    if firmware is None or firmware.mismatches():
+        return None
+    return firmware.build
+
+
+def up_to_date(setting, sketch: Optional[str], digest: str, cached: Optional[str]) -> bool:
+    from os.path import isdir
+
+    from flkl.firmware import build_hash
+
+    # only sketch directories get a build header to report
+    if sketch is None or not isdir(sketch):
+        return cached == digest
+    if cached is not None and cached != digest:
+        return False
+    return flashed_build(setting) == build_hash(sketch)
+
+
+# Flashes `(board, com_config)` targets concurrently, skipping boards that
+# already run their sketch with the same settings, and returns the serial
+# numbers of the boards that were flashed. Uploads that succeeded are cached
+# even when another one fails.
+def upload_sketches(targets: list[tuple], cache: Optional[str] = UPLOAD_CACHE, force: bool = False) -> list[str]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    from pyno.ino import ArduinoConnecter, ArduinoSetting
+
+    from flkl.firmware import write_build_header
+
+    uploads = {} if cache is None else load_uploads(cache)
+    candidates = []
+    for board, com_config in targets:
+        setting = ArduinoSetting.derive_from_portinfo(board)
+        setting.apply_setting(com_config)
+        candidates.append((board.serial_number, sketch_hash(com_config), setting, com_config.get("sketch")))
+    if not candidates:
+        return []
+
+    def check(candidate: tuple) -> bool:
+        serial_number, digest, setting, sketch = candidate
+        if up_to_date(setting, sketch, digest, uploads.get(serial_number)):
+            print(f"Sketch on arduino {serial_number} is up to date")
+            return True
+        return False
+
+    pending = candidates
+    if not force:
+        # boards answer the handshake only after their reset, so ask them all at once
+        with ThreadPoolExecutor(len(candidates)) as pool:
+            current = list(pool.map(check, candidates))
+        pending = []
+        for candidate, skip in zip(candidates, current):
+            if skip:
+                serial_number, digest, *_ = candidate
+                uploads[serial_number] = digest
+            else:
+                pending.append(candidate)
+
+    def write_sketch(serial_number: str, setting) -> str:
+        print(f"Uploading sketch to arduino {serial_number}")
+        ArduinoConnecter(setting).write_sketch()
+        return serial_number
+
+    if not pending:
+        if cache is not None:
+            save_uploads(uploads, cache)
+        return []
+    # stamp each sketch with its build hash so the board can report it
+    [write_build_header(sketch) for sketch in {sketch for *_, sketch in pending if sketch is not None}]
+    flashed, errors = [], []
+    with ThreadPoolExecutor(len(pending)) as pool:
+        futures = [(pool.submit(write_sketch, serial_number, setting), serial_number, digest)
+                   for serial_number, digest, setting, _ in pending]
+        for future, serial_number, digest in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append(e)
+                uploads.pop(serial_number, None)
+                continue
+            flashed.append(serial_number)
+            uploads[serial_number] = digest
+
+    if cache is not None:
+        save_uploads(uploads, cache)
+    if errors:
+        raise errors[0]
+    return flashed
@@ -1,3 +1,10 @@
+#if __has_include("build.h")
+#include "build.h"
+#endif
+#ifndef FIRMWARE_BUILD
+#define FIRMWARE_BUILD 0UL
+#endif
+
 struct StateSwitchPin {
   int pins[13];
   int currState[13];
@@ -84,13 +91,17 @@ StateSwitchPin initSSPin() {
   return sspin;
 }
 
+void watchPin(int pin, int on);
+
 void setPinModeSS(StateSwitchPin *sspin, int pin, int mode) {
   pinMode(pin, mode);
   sspin->pins[sspin->pinNum] = pin;
   sspin->pinNum++;
+  watchPin(pin, 1);
 }
 
 void resetPinModeSS(StateSwitchPin *sspin, int pin) {
+  watchPin(pin, 0);
   if (sspin->pinNum > 0) {
     for (int i=0; i<sspin->pinNum; i++) {
       if (sspin->pins[i] == pin) {
@@ -107,42 +118,461 @@ void resetPinModeSS(StateSwitchPin *sspin, int pin) {
   }
 }
 
+/* Event output: ASCII lines or fixed-width binary frames
+   (pin | 0x80 on offset, 32-bit little-endian micros, sync byte), optionally
+   in sequenced batches */
+#define EVENT_FRAME_SIZE 6
+#define EVENT_FRAME_SYNC 0xA5
+#define EVENT_FRAME_OFFSET 0x80
+#define EVENT_FRAME_CLOCK 0x7F
+#define EVENT_FRAME_PIN 0x7F
+
+int event_format = 0;
+
+void writeFrame(byte head, unsigned long t) {
+  byte frame[EVENT_FRAME_SIZE];
+  frame[0] = head;
+  frame[1] = t & 0xFF;
+  frame[2] = (t >> 8) & 0xFF;
+  frame[3] = (t >> 16) & 0xFF;
+  frame[4] = (t >> 24) & 0xFF;
+  frame[5] = EVENT_FRAME_SYNC;
+  Serial.write(frame, EVENT_FRAME_SIZE);
+}
+
+/* Edge capture: every edge of an input pin is timestamped into a ring buffer,
+   from pin-change interrupts where the board has them and by polling
+   otherwise, and the main loop drains the ring only as far as the serial TX
+   buffer has room, so bursts of licks never stall the loop. In the sequenced
+   format ('\x30' with 2) each batch starts with a frame carrying the sequence
+   number of its first edge, and edges that did not fit the ring are reported
+   by count in an overflow frame. */
+#define EDGE_BUFFER_SIZE 64
+#define EVENT_FRAME_BATCH 0x7A
+#define EVENT_FRAME_OVERFLOW 0x7D
+#define EVENT_FORMAT_SEQUENCED 2
+
+volatile byte edge_heads[EDGE_BUFFER_SIZE];
+volatile unsigned long edge_times[EDGE_BUFFER_SIZE];
+volatile byte edge_write = 0;
+volatile byte edge_read = 0;
+volatile unsigned int edge_dropped = 0;
+unsigned long edge_sequence = 0;
+
+void pushEdge(byte head, unsigned long t) {
+  byte next = (edge_write + 1) % EDGE_BUFFER_SIZE;
+  if (next == edge_read) {
+    edge_dropped++;
+    return;
+  }
+  edge_heads[edge_write] = head;
+  edge_times[edge_write] = t;
+  edge_write = next;
+}
+
+#if defined(PCICR) && defined(PCINT0_vect) && defined(PCINT2_vect)
+#define EDGE_INTERRUPTS 1
+
+/* bank 0: PORTD (pins 0-7, PCINT16-23), bank 1: PORTB (pins 8-13, PCINT0-5) */
+volatile byte watched[2] = {0, 0};
+volatile byte last_port[2] = {0, 0};
+
+void captureEdges(byte port, byte bank) {
+  unsigned long t = micros();
+  byte changed = (port ^ last_port[bank]) & watched[bank];
+  last_port[bank] = port;
+  for (byte bit = 0; changed; bit++, changed >>= 1) {
+    if (changed & 1) {
+      byte pin = bank * 8 + bit;
+      // a falling edge is the onset, as in the polled `checkPinState`
+      pushEdge(((port >> bit) & 1) ? (pin | EVENT_FRAME_OFFSET) : pin, t);
+    }
+  }
+}
+
+ISR(PCINT2_vect) { captureEdges(PIND, 0); }
+ISR(PCINT0_vect) { captureEdges(PINB, 1); }
+
+void watchPin(int pin, int on) {
+  byte bank = pin < 8 ? 0 : 1;
+  byte bit = _BV(pin - bank * 8);
+  noInterrupts();
+  watched[bank] = on ? (watched[bank] | bit) : (watched[bank] & ~bit);
+  if (bank) {
+    last_port[1] = PINB;
+    PCMSK0 = watched[1];
+    PCICR = watched[1] ? (PCICR | _BV(PCIE0)) : (PCICR & ~_BV(PCIE0));
+  } else {
+    last_port[0] = PIND;
+    PCMSK2 = watched[0];
+    PCICR = watched[0] ? (PCICR | _BV(PCIE2)) : (PCICR & ~_BV(PCIE2));
+  }
+  interrupts();
+}
+#else
+void watchPin(int pin, int on) {}
+#endif
+
+void drainEdges() {
+  if (edge_dropped) {
+    if (Serial.availableForWrite() < EVENT_FRAME_SIZE) {
+      return;
+    }
+    noInterrupts();
+    unsigned int dropped = edge_dropped;
+    edge_dropped = 0;
+    interrupts();
+    writeFrame(EVENT_FRAME_OVERFLOW, dropped);
+  }
+  int header = event_format == EVENT_FORMAT_SEQUENCED;
+  while (edge_read != edge_write) {
+    byte head = edge_heads[edge_read];
+    int room = Serial.availableForWrite();
+    if (event_format) {
+      if (room < EVENT_FRAME_SIZE * (1 + header)) {
+        break;
+      }
+      if (header) {
+        writeFrame(EVENT_FRAME_BATCH, edge_sequence);
+        header = 0;
+      }
+      writeFrame(head, edge_times[edge_read]);
+    } else {
+      // "<pin> <micros>", offsets as negative pins; "-13 4294967295\r\n" at most
+      if (room < 16) {
+        break;
+      }
+      int pin = head & EVENT_FRAME_PIN;
+      Serial.print((head & EVENT_FRAME_OFFSET) ? -pin : pin);
+      Serial.print(' ');
+      Serial.println(edge_times[edge_read]);
+    }
+    edge_read = (edge_read + 1) % EDGE_BUFFER_SIZE;
+    edge_sequence++;
+  }
+}
+
 void checkPinState(StateSwitchPin *sspin) {
+#ifndef EDGE_INTERRUPTS
   for(int i=0; i<sspin->pinNum; i++) {
     int pin = sspin->pins[i];
     sspin->currState[i] = digitalRead(pin);
     if (sspin->prevState[i] && !sspin->currState[i]) {
-      Serial.println(pin);
+      pushEdge(pin, micros());
     }
     if (!sspin->prevState[i] && sspin->currState[i]) {
-      Serial.println(-pin);
+      pushEdge(pin | EVENT_FRAME_OFFSET, micros());
     }
     sspin->prevState[i] = sspin->currState[i];
   }
+#endif
+  drainEdges();
 }
 
 StateSwitchPin sspin = initSSPin();
 
-/* Functions and vairables for flicker */
-unsigned long calculate_interval(double hz, double duration) {
-  return 1000 * (duration / (2 * hz + 1));
+/* Argument readers. A byte takes ~87 us at 115200 baud, so a 28-byte command
+   arrives over ~2.4 ms; the channels, sync pulses and inputs keep running
+   while its arguments trickle in. */
+void updateChannels();
+void runSync();
+
+int read_byte() {
+  int v;
+  while((v = Serial.read()) == -1) {
+    checkPinState(&sspin);
+    updateChannels();
+    runSync();
+  };
+  return v;
 }
 
-unsigned long from_millis_to_micros(double x) {
-  return x * 1000;
+double read_2bytes() {
+  int low = read_byte();
+  int high = read_byte();
+  return high * 256 + low;
 }
 
-double read_2bytes() {
-  int readbytes[2];
-  for (int i = 0; i < 2; i++) {
-    while((readbytes[i] = Serial.read()) == -1) {};
+unsigned long read_4bytes() {
+  unsigned long v = 0;
+  for (int i = 0; i < 4; i++) {
+    v |= (unsigned long)read_byte() << (8 * i);
   }
-  return readbytes[1] * 256 + readbytes[0];
+  return v;
 }
 
-int flicker_states[14] = { 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0 };
-double hz1;
-double hz2;
+/* Flicker channels: independent pulse trains driven from the main loop, so
+   the board keeps reading commands and reporting inputs while they run.
+   Each channel flickers `pin` for `duration` and then holds `rpin` high for
+   `reward`; a rate of 0 keeps `pin` steady high. Rates are in millihertz and
+   the period is split as 10^9 / mhz with the remainder carried from cycle to
+   cycle, so long trains keep the exact mean period without floating point. */
+#define CHANNELS 6
+#define ALL_CHANNELS 0xFF
+#define CHANNEL_IDLE 0
+#define CHANNEL_FLICKER 1
+#define CHANNEL_REWARD 2
+#define MICROS_PER_MHZ 1000000000UL
+
+struct Channel {
+  byte state;
+  byte pin;
+  byte level;
+  byte rpin;
+  unsigned long mhz;
+  unsigned long pulse;
+  unsigned long interval;
+  unsigned long remainder;
+  unsigned long carry;
+  unsigned long wait;
+  unsigned long duration;
+  unsigned long reward;
+  unsigned long start;
+  unsigned long toggled;
+};
+
+Channel channels[CHANNELS];
+
+void setChannelRate(Channel *c, unsigned long mhz, unsigned long pulse) {
+  unsigned long period = mhz ? MICROS_PER_MHZ / mhz : 0;
+  c->mhz = mhz;
+  c->pulse = pulse;
+  c->interval = period > pulse ? period - pulse : 0;
+  c->remainder = mhz ? MICROS_PER_MHZ % mhz : 0;
+  c->carry = 0;
+}
+
+void abortChannel(int i) {
+  if (i >= CHANNELS) {
+    return;
+  }
+  Channel *c = &channels[i];
+  if (c->state == CHANNEL_FLICKER) {
+    digiLOW[c->pin]();
+  } else if (c->state == CHANNEL_REWARD) {
+    digiLOW[c->rpin]();
+  }
+  c->state = CHANNEL_IDLE;
+}
+
+void startChannel(int i, byte pin, unsigned long mhz, unsigned long duration, unsigned long pulse,
+                  byte rpin, unsigned long reward) {
+  if (i >= CHANNELS) {
+    return;
+  }
+  abortChannel(i);
+  Channel *c = &channels[i];
+  setChannelRate(c, mhz, pulse);
+  c->pin = pin;
+  c->rpin = rpin;
+  c->duration = duration;
+  c->reward = reward;
+  c->level = 1;
+  c->wait = pulse;
+  digiHIGH[pin]();
+  c->start = micros();
+  c->toggled = c->start;
+  c->state = CHANNEL_FLICKER;
+}
+
+/* Legacy commands: rate as hz * 10 in one byte, times in milliseconds. */
+void startChannelMillis(int i, byte pin, byte hz, unsigned int flickr, unsigned int pulse,
+                        byte rpin, unsigned int reward) {
+  startChannel(i, pin, hz * 100UL, flickr * 1000UL, pulse * 1000UL, rpin, reward * 1000UL);
+}
+
+int idleChannel(int from) {
+  for (int i = from; i < CHANNELS; i++) {
+    if (channels[i].state == CHANNEL_IDLE) {
+      return i;
+    }
+  }
+  return CHANNELS - 1;
+}
+
+void updateChannels() {
+  unsigned long now = micros();
+  for (int i = 0; i < CHANNELS; i++) {
+    Channel *c = &channels[i];
+    if (c->state == CHANNEL_FLICKER) {
+      if (now - c->start >= c->duration) {
+        digiLOW[c->pin]();
+        if (c->rpin > 0 && c->reward > 0) {
+          digiHIGH[c->rpin]();
+          c->start = now;
+          c->state = CHANNEL_REWARD;
+        } else {
+          c->state = CHANNEL_IDLE;
+        }
+      } else if (c->interval && now - c->toggled >= c->wait) {
+        // advance by the nominal wait so pulses do not drift with loop jitter
+        c->toggled += c->wait;
+        c->level = !c->level;
+        if (c->level) {
+          digiHIGH[c->pin]();
+          c->wait = c->pulse;
+        } else {
+          digiLOW[c->pin]();
+          c->wait = c->interval;
+          c->carry += c->remainder;
+          if (c->carry >= c->mhz) {
+            c->carry -= c->mhz;
+            c->wait++;
+          }
+        }
+      }
+    } else if (c->state == CHANNEL_REWARD && now - c->start >= c->reward) {
+      digiLOW[c->rpin]();
+      c->state = CHANNEL_IDLE;
+    }
+  }
+}
+
+/* Trial queue: trials uploaded ahead by the host and started from the board's
+   own clock, `iti` after the previous trial ended. Trials run on channels 0
+   and 1; rates are in millihertz and times in microseconds. */
+#define TRIAL_QUEUE_SIZE 16
+#define EVENT_FRAME_TRIAL 0x7E
+
+struct Trial {
+  byte pin1;
+  byte pin2;
+  byte rpin;
+  unsigned long mhz1;
+  unsigned long mhz2;
+  unsigned long flickr;
+  unsigned long pulse;
+  unsigned long reward;
+  unsigned long iti;
+};
+
+Trial trial_queue[TRIAL_QUEUE_SIZE];
+int trial_head = 0;
+int trial_count = 0;
+int queue_running = 0;
+unsigned long trial_start = 0;
+unsigned long trial_length = 0;
+
+void enqueueTrial(Trial *t) {
+  if (trial_count < TRIAL_QUEUE_SIZE) {
+    trial_queue[(trial_head + trial_count) % TRIAL_QUEUE_SIZE] = *t;
+    trial_count++;
+  }
+}
+
+void runQueue() {
+  if (!queue_running || trial_count == 0) {
+    return;
+  }
+  Trial *t = &trial_queue[trial_head];
+  if (micros() - trial_start < trial_length + t->iti) {
+    return;
+  }
+  trial_head = (trial_head + 1) % TRIAL_QUEUE_SIZE;
+  trial_count--;
+  trial_start = micros();
+  trial_length = t->flickr + t->reward;
+  writeFrame(EVENT_FRAME_TRIAL, trial_start);
+  if (t->mhz1) {
+    startChannel(0, t->pin1, t->mhz1, t->flickr, t->pulse, t->rpin, t->reward);
+  }
+  if (t->mhz2) {
+    startChannel(1, t->pin2, t->mhz2, t->flickr, t->pulse, t->mhz1 ? 0 : t->rpin, t->reward);
+  }
+}
+
+/* Sync pulses: `pin` goes high for `pulse` at intervals drawn from a xorshift32
+   sequence seeded by the host, uniform in whole milliseconds over [lo, hi].
+   Every pulse is due one interval after the previous one was due, so the train
+   keeps to the board's crystal however late the loop gets to it, and each is
+   reported in a frame with the micros it actually went high.
+   `flkl.sync.sync_intervals` generates the same intervals on the host. */
+#define EVENT_FRAME_SYNC_PULSE 0x7B
+
+byte sync_pin = 0;
+byte sync_running = 0;
+byte sync_high = 0;
+unsigned long sync_state = 1;
+unsigned long sync_pulse = 0;
+unsigned long sync_lo = 0;
+unsigned long sync_span = 1;
+unsigned long sync_due = 0;
+unsigned long sync_emitted = 0;
+
+unsigned long nextSyncInterval() {
+  sync_state ^= sync_state << 13;
+  sync_state ^= sync_state >> 17;
+  sync_state ^= sync_state << 5;
+  return (sync_lo + sync_state % sync_span) * 1000UL;
+}
+
+void startSync(byte pin, unsigned int pulse, unsigned int lo, unsigned int hi, unsigned long seed) {
+  if (sync_high) {
+    digiLOW[sync_pin]();
+    sync_high = 0;
+  }
+  sync_pin = pin;
+  sync_pulse = pulse * 1000UL;
+  sync_lo = lo;
+  sync_span = hi >= lo ? hi - lo + 1UL : 1UL;
+  // xorshift never leaves 0
+  sync_state = seed ? seed : 1;
+  sync_due = micros();
+  sync_running = 1;
+}
+
+void stopSync() {
+  if (sync_high) {
+    digiLOW[sync_pin]();
+    sync_high = 0;
+  }
+  sync_running = 0;
+}
+
+void runSync() {
+  if (!sync_running) {
+    return;
+  }
+  unsigned long now = micros();
+  if (sync_high) {
+    if (now - sync_emitted >= sync_pulse) {
+      digiLOW[sync_pin]();
+      sync_high = 0;
+    }
+  } else if ((long)(now - sync_due) >= 0) {
+    digiHIGH[sync_pin]();
+    sync_emitted = micros();
+    sync_high = 1;
+    writeFrame(EVENT_FRAME_SYNC_PULSE, sync_emitted);
+    sync_due += nextSyncInterval();
+  }
+}
+
+
+/* Handshake: the build hash in a frame, then the protocol version, the length
+   of the layout table and the table of supported opcodes with the struct
+   layout of their arguments, mirroring `flkl.command.LAYOUTS`. */
+#define FIRMWARE_PROTOCOL 2
+#define EVENT_FRAME_HANDSHAKE 0x7C
+
+const char FIRMWARE_LAYOUTS[] PROGMEM =
+  "00:B;01:B;02:B;03:B;04:B;10:B;11:B;12:BB;"
+  "13:BBHHBH;14:BBHH;15:BBBBHHBH;16:BBBBHH;17:BH;"
+  "19:B;20:B;21:B;30:B;31:B;32:B;"
+  "40:BBBBHHBHI;41:B;42:B;43:BBIIIIBII;"
+  "50:BBBHHBH;51:BBH;52:B;53:BBIIIBI;54:BII;"
+  "60:BHHHI;61:B";
+
+void writeHandshake() {
+  unsigned int n = strlen_P(FIRMWARE_LAYOUTS);
+  writeFrame(EVENT_FRAME_HANDSHAKE, FIRMWARE_BUILD);
+  Serial.write(FIRMWARE_PROTOCOL);
+  Serial.write(n & 0xFF);
+  Serial.write((n >> 8) & 0xFF);
+  for (unsigned int i = 0; i < n; i++) {
+    Serial.write(pgm_read_byte(FIRMWARE_LAYOUTS + i));
+  }
+}
 
 
 void setup() {
@@ -158,10 +588,15 @@ void loop() {
   while (1) {
     while ((command = Serial.read()) == -1) {
       checkPinState(&sspin);
+      updateChannels();
+      runQueue();
+      runSync();
     };
 
     while ((pin1 = Serial.read() ) == -1) {
       checkPinState(&sspin);
+      updateChannels();
+      runSync();
     };
 
     switch (command) {
@@ -214,356 +649,208 @@ void loop() {
         break;
       }
 
-      /*
+      // Flkl.flick_for: channel 0
       case '\x13': {
-        int angle;
-        while ( (angle = Serial.read()) == -1) {
-          checkPinState(&sspin);
-        };
-        servos[pin1].write(angle);
+        byte hz = read_byte();
+        unsigned int flickr = read_2bytes();
+        unsigned int pulse = read_2bytes();
+        rpin = read_byte();
+        unsigned int reward = read_2bytes();
+        startChannelMillis(0, pin1, hz, flickr, pulse, rpin, reward);
         break;
       }
-      */
 
-      // Flkl.flick_for
-      case '\x13': {
-        while((hz1 = Serial.read()) == -1) {};
-        double flickr_duration = read_2bytes();
-        double pulse_duration = read_2bytes();
-        while((rpin = Serial.read()) == -1) {};
-        double reward_duration = read_2bytes();
-        double pulse_interval = 10000 / hz1 - pulse_duration;
-
-
-        unsigned long pulse_interval_micros = from_millis_to_micros(pulse_interval);
-        unsigned long pulse_duration_micros = from_millis_to_micros(pulse_duration);
-        unsigned long flickr_duration_micros = from_millis_to_micros(flickr_duration);
-        unsigned long waitingtime  = pulse_duration_micros;
-        unsigned long reward_duration_micros = from_millis_to_micros(reward_duration);
-        digiHIGH[pin1]();
-        flicker_states[pin1] = 1;
-        unsigned long starttime = micros();
-        unsigned long swtichtimer = starttime;
-
-        while(micros() - starttime < flickr_duration_micros) {
-          if ((micros() - swtichtimer) >= waitingtime) {
-            if (flicker_states[pin1]) {
-              digiLOW[pin1]();
-              flicker_states[pin1] = 0;
-              waitingtime = pulse_interval_micros;
-            } else {
-              digiHIGH[pin1]();
-              flicker_states[pin1] = 1;
-              waitingtime = pulse_duration_micros;
-            }
-            swtichtimer = micros();
-          }
-        }
+      // Flkl.flick_on: channel 0, stopped early by '\x19' or '\x52'
+      case '\x14': {
+        byte hz = read_byte();
+        unsigned int flickr = read_2bytes();
+        unsigned int pulse = read_2bytes();
+        startChannelMillis(0, pin1, hz, flickr, pulse, 0, 0);
+        break;
+      }
 
-        digiLOW[pin1]();
-        flicker_states[pin1] = 0;
+      // Flkl.flick_for2: channels 0 and 1, the reward follows channel 0
+      case '\x15': {
+        pin2 = read_byte();
+        byte hz1 = read_byte();
+        byte hz2 = read_byte();
+        unsigned int flickr = read_2bytes();
+        unsigned int pulse = read_2bytes();
+        rpin = read_byte();
+        unsigned int reward = read_2bytes();
+        startChannelMillis(0, pin1, hz1, flickr, pulse, rpin, reward);
+        startChannelMillis(1, pin2, hz2, flickr, pulse, 0, 0);
+        break;
+      }
 
-        if (rpin > 0) {
-          unsigned long intervaltimer1 = micros();
-          digiHIGH[rpin]();
-          while(micros() - intervaltimer1 < reward_duration_micros) {};
-          digiLOW[rpin]();
-        }
+      // Flkl.flick_on2: channels 0 and 1
+      case '\x16': {
+        pin2 = read_byte();
+        byte hz1 = read_byte();
+        byte hz2 = read_byte();
+        unsigned int flickr = read_2bytes();
+        unsigned int pulse = read_2bytes();
+        startChannelMillis(0, pin1, hz1, flickr, pulse, 0, 0);
+        startChannelMillis(1, pin2, hz2, flickr, pulse, 0, 0);
+        break;
+      }
 
+      // Flkl.high_for: a steady channel, leaving 0 and 1 to the stimuli
+      case '\x17': {
+        unsigned int duration = read_2bytes();
+        startChannelMillis(idleChannel(2), pin1, 0, duration, 0, 0, 0);
         break;
       }
 
-      // Flkl.flick_on
-      case '\x14': {
-        while((hz1 = Serial.read()) == -1) {};
-        double flickr_duration = read_2bytes();
-        double pulse_duration = read_2bytes();
-        double pulse_interval = 10000 / hz1 - pulse_duration;
-
-        unsigned long pulse_interval_micros = from_millis_to_micros(pulse_interval);
-        unsigned long pulse_duration_micros = from_millis_to_micros(pulse_duration);
-        unsigned long flickr_duration_micros = from_millis_to_micros(flickr_duration);
-        unsigned long waitingtime  = pulse_duration_micros;
-        digiHIGH[pin1]();
-        flicker_states[pin1] = 1;
-        unsigned long starttime = micros();
-        unsigned long swtichtimer = starttime;
-
-        while(micros() - starttime < flickr_duration_micros && (command = Serial.read()) == -1) {
-          if ((micros() - swtichtimer) >= waitingtime) {
-            if (flicker_states[pin1]) {
-              digiLOW[pin1]();
-              flicker_states[pin1] = 0;
-              waitingtime = pulse_interval_micros;
-            } else {
-              digiHIGH[pin1]();
-              flicker_states[pin1] = 1;
-              waitingtime = pulse_duration_micros;
-            }
-            swtichtimer = micros();
-          }
-          if (command == '\x19') { break; }
+      case '\x19': {
+        for (int i = 0; i < CHANNELS; i++) {
+          abortChannel(i);
         }
+        break;
+      }
 
-        /*
-        double duration = read_2bytes();
-        double flicktime = hz1 * duration / 10000;
-
-        flicker_states[pin1] = 0;
-        unsigned long interval1 = calculate_interval(flicktime , duration);
-        unsigned long duration_micros = from_millis_to_micros(duration);
-        unsigned long starttimer = micros();
-        unsigned long intervaltimer1 = micros();
-
-        while(micros() - starttimer < duration_micros && (command = Serial.read()) == -1) {
-          if ((micros() - intervaltimer1) >= interval1) {
-            if (!flicker_states[pin1]) {
-              digiHIGH[pin1]();
-              flicker_states[pin1] = 1;
-            } else {
-              digiLOW[pin1]();
-              flicker_states[pin1] = 0;
-            }
-            intervaltimer1 = micros();
-          }
-          if (command == '\x19') { break; }
-        };
-        */
+      // read: '\x20' - '\x29'
+      case '\x20': {
+        int state = digiRead[pin1]();
+        Serial.write(state);
+        break;
+      }
 
-        digiLOW[pin1]();
-        flicker_states[pin1] = 0;
+      case '\x21': {
+        int v = analogRead(pin1);
+        Serial.write(v);
         break;
       }
 
-      // flick_for2
-      case '\x15': {
-        while((pin2 = Serial.read()) == -1) {};
-        while((hz1 = Serial.read()) == -1) {};
-        while((hz2 = Serial.read()) == -1) {};
-        double flickr_duration = read_2bytes();
-        double pulse_duration = read_2bytes();
-        while((rpin = Serial.read()) == -1) {};
-        double reward_duration = read_2bytes();
-        double pulse_interval1 = 10000 / hz1 - pulse_duration;
-        double pulse_interval2 = 10000 / hz2 - pulse_duration;
-
-
-        unsigned long pulse_interval_micros1 = from_millis_to_micros(pulse_interval1);
-        unsigned long pulse_interval_micros2 = from_millis_to_micros(pulse_interval2);
-        unsigned long pulse_duration_micros = from_millis_to_micros(pulse_duration);
-        unsigned long flickr_duration_micros = from_millis_to_micros(flickr_duration);
-        unsigned long waitingtime1 = pulse_duration_micros;
-        unsigned long waitingtime2 = pulse_duration_micros;
-        unsigned long reward_duration_micros = from_millis_to_micros(reward_duration);
-        digiHIGH[pin1]();
-        digiHIGH[pin2]();
-        flicker_states[pin1] = 1;
-        flicker_states[pin2] = 1;
-        unsigned long starttime = micros();
-        unsigned long swtichtimer1 = starttime;
-        unsigned long swtichtimer2 = starttime;
-
-        while(micros() - starttime < flickr_duration_micros) {
-          unsigned long current_time = micros();
-          if ((current_time - swtichtimer1) >= waitingtime1) {
-            if (flicker_states[pin1]) {
-              digiLOW[pin1]();
-              flicker_states[pin1] = 0;
-              waitingtime1 = pulse_interval_micros1;
-            } else {
-              digiHIGH[pin1]();
-              flicker_states[pin1] = 1;
-              waitingtime1 = pulse_duration_micros;
-            }
-            swtichtimer1 = micros();
-          }
+      // event format: '\x30'
+      case '\x30': {
+        event_format = pin1;
+        break;
+      }
 
-          if ((current_time - swtichtimer2) >= waitingtime2) {
-            if (flicker_states[pin2]) {
-              digiLOW[pin2]();
-              flicker_states[pin2] = 0;
-              waitingtime2 = pulse_interval_micros2;
-            } else {
-              digiHIGH[pin2]();
-              flicker_states[pin2] = 1;
-              waitingtime2 = pulse_duration_micros;
-            }
-            swtichtimer2 = micros();
-          }
-        }
+      // clock ping: '\x31'
+      case '\x31': {
+        writeFrame(EVENT_FRAME_CLOCK, micros());
+        break;
+      }
 
-        /*
-        double duration = read_2bytes();
-        double flicktime1 = hz1 * duration / 10000;
-        double flicktime2 = hz2 * duration / 10000;
-
-        flicker_states[pin1] = 0;
-        unsigned long interval1 = calculate_interval(flicktime1, duration);
-        unsigned long interval2 = calculate_interval(flicktime2, duration);
-        unsigned long duration_micros = from_millis_to_micros(duration);
-        unsigned long starttimer = micros();
-        unsigned long intervaltimer1 = micros();
-        unsigned long intervaltimer2 = micros();
-
-        while(micros() - starttimer < duration_micros) {
-          if ((micros() - intervaltimer1) >= interval1) {
-            if (!flicker_states[pin1]) {
-              digiHIGH[pin1]();
-              flicker_states[pin1] = 1;
-            } else {
-              digiLOW[pin1]();
-              flicker_states[pin1] = 0;
-            }
-            intervaltimer1 = micros();
-          }
-          if ((micros() - intervaltimer2) >= interval2) {
-            if (!flicker_states[pin2]) {
-              digiHIGH[pin2]();
-              flicker_states[pin2] = 1;
-            } else {
-              digiLOW[pin2]();
-              flicker_states[pin2] = 0;
-            }
-            intervaltimer2 = micros();
-          }
-        };
-        */
+      // handshake: '\x32'
+      case '\x32': {
+        writeHandshake();
+        break;
+      }
 
-        digiLOW[pin1]();
-        digiLOW[pin2]();
-        flicker_states[pin1] = 0;
-        flicker_states[pin2] = 0;
-
-        if (rpin > 0) {
-          unsigned long intervaltimer1 = micros();
-          digiHIGH[rpin]();
-          while(micros() - intervaltimer1 < reward_duration_micros) {};
-          digiLOW[rpin]();
-        }
+      // trial queue: '\x40' - '\x43'
+      case '\x40': {
+        Trial t;
+        t.pin1 = pin1;
+        t.pin2 = read_byte();
+        t.mhz1 = read_byte() * 100UL;
+        t.mhz2 = read_byte() * 100UL;
+        t.flickr = (unsigned long)read_2bytes() * 1000;
+        t.pulse = (unsigned long)read_2bytes() * 1000;
+        t.rpin = read_byte();
+        t.reward = (unsigned long)read_2bytes() * 1000;
+        t.iti = read_4bytes() * 1000;
+        enqueueTrial(&t);
+        break;
+      }
 
+      case '\x41': {
+        queue_running = 1;
+        trial_start = micros();
+        trial_length = 0;
         break;
       }
 
-      // flick_on2
-      case '\x16': {
-        while((pin2 = Serial.read()) == -1) {};
-        while((hz1 = Serial.read()) == -1) {};
-        while((hz2 = Serial.read()) == -1) {};
-        double flickr_duration = read_2bytes();
-        double pulse_duration = read_2bytes();
-        double pulse_interval1 = 10000 / hz1 - pulse_duration;
-        double pulse_interval2 = 10000 / hz2 - pulse_duration;
-
-        unsigned long pulse_interval_micros1 = from_millis_to_micros(pulse_interval1);
-        unsigned long pulse_interval_micros2 = from_millis_to_micros(pulse_interval2);
-        unsigned long pulse_duration_micros = from_millis_to_micros(pulse_duration);
-        unsigned long flickr_duration_micros = from_millis_to_micros(flickr_duration);
-        unsigned long waitingtime1 = pulse_duration_micros;
-        unsigned long waitingtime2 = pulse_duration_micros;
-        digiHIGH[pin1]();
-        digiHIGH[pin2]();
-        flicker_states[pin1] = 1;
-        flicker_states[pin2] = 1;
-        unsigned long starttime = micros();
-        unsigned long swtichtimer1 = starttime;
-        unsigned long swtichtimer2 = starttime;
-
-        while(micros() - starttime < flickr_duration_micros && (command = Serial.read()) == -1) {
-          unsigned long current_time = micros();
-          if ((current_time - swtichtimer1) >= waitingtime1) {
-            if (flicker_states[pin1]) {
-              digiLOW[pin1]();
-              flicker_states[pin1] = 0;
-              waitingtime1 = pulse_interval_micros1;
-            } else {
-              digiHIGH[pin1]();
-              flicker_states[pin1] = 1;
-              waitingtime1 = pulse_duration_micros;
-            }
-            swtichtimer1 = micros();
-          }
+      case '\x42': {
+        queue_running = 0;
+        trial_head = 0;
+        trial_count = 0;
+        break;
+      }
 
-          if ((current_time - swtichtimer2) >= waitingtime2) {
-            if (flicker_states[pin2]) {
-              digiLOW[pin2]();
-              flicker_states[pin2] = 0;
-              waitingtime2 = pulse_interval_micros2;
-            } else {
-              digiHIGH[pin2]();
-              flicker_states[pin2] = 1;
-              waitingtime2 = pulse_duration_micros;
-            }
-            swtichtimer2 = micros();
-          }
-          if (command == '\x19') { break; }
+      // trial with the rate in millihertz and times in microseconds
+      case '\x43': {
+        Trial t;
+        t.pin1 = pin1;
+        t.pin2 = read_byte();
+        t.mhz1 = read_4bytes();
+        t.mhz2 = read_4bytes();
+        t.flickr = read_4bytes();
+        t.pulse = read_4bytes();
+        t.rpin = read_byte();
+        t.reward = read_4bytes();
+        t.iti = read_4bytes();
+        enqueueTrial(&t);
+        break;
+      }
+
+      // flicker channels: '\x50' - '\x54'
+      case '\x50': {
+        byte pin = read_byte();
+        byte hz = read_byte();
+        unsigned int flickr = read_2bytes();
+        unsigned int pulse = read_2bytes();
+        rpin = read_byte();
+        unsigned int reward = read_2bytes();
+        startChannelMillis(pin1, pin, hz, flickr, pulse, rpin, reward);
+        break;
+      }
+
+      case '\x51': {
+        byte hz = read_byte();
+        unsigned int pulse = read_2bytes();
+        if (pin1 < CHANNELS) {
+          setChannelRate(&channels[pin1], hz * 100UL, pulse * 1000UL);
         }
+        break;
+      }
 
-        /*
-        double duration = read_2bytes();
-        double flicktime1 = hz1 * duration / 10000;
-        double flicktime2 = hz2 * duration / 10000;
-
-        flicker_states[pin1] = 0;
-        unsigned long interval1 = calculate_interval(flicktime1, duration);
-        unsigned long interval2 = calculate_interval(flicktime2, duration);
-        unsigned long duration_micros = from_millis_to_micros(duration);
-        unsigned long starttimer = micros();
-        unsigned long intervaltimer1 = micros();
-        unsigned long intervaltimer2 = micros();
-
-        while(micros() - starttimer < duration_micros && (command = Serial.read()) == -1) {
-          if ((micros() - intervaltimer1) >= interval1) {
-            if (!flicker_states[pin1]) {
-              digiHIGH[pin1]();
-              flicker_states[pin1] = 1;
-            } else {
-              digiLOW[pin1]();
-              flicker_states[pin1] = 0;
-            }
-            intervaltimer1 = micros();
-          }
-          if ((micros() - intervaltimer2) >= interval2) {
-            if (!flicker_states[pin2]) {
-              digiHIGH[pin2]();
-              flicker_states[pin2] = 1;
-            } else {
-              digiLOW[pin2]();
-              flicker_states[pin2] = 0;
-            }
-            intervaltimer2 = micros();
+      case '\x52': {
+        if (pin1 == ALL_CHANNELS) {
+          for (int i = 0; i < CHANNELS; i++) {
+            abortChannel(i);
           }
-          if (command == '\x19') { break; }
-        };
-        */
-
-        digiLOW[pin1]();
-        digiLOW[pin2]();
-        flicker_states[pin1] = 0;
-        flicker_states[pin2] = 0;
+        } else {
+          abortChannel(pin1);
+        }
         break;
       }
 
-      case '\x17': {
-        double duration = read_2bytes();
-        unsigned long duration_micros = from_millis_to_micros(duration);
-        unsigned long intervaltimer1 = micros();
+      // channels with the rate in millihertz and times in microseconds
+      case '\x53': {
+        byte pin = read_byte();
+        unsigned long mhz = read_4bytes();
+        unsigned long duration = read_4bytes();
+        unsigned long pulse = read_4bytes();
+        rpin = read_byte();
+        unsigned long reward = read_4bytes();
+        startChannel(pin1, pin, mhz, duration, pulse, rpin, reward);
+        break;
+      }
 
-        digiHIGH[pin1]();
-        while(micros() - intervaltimer1 < duration_micros) {};
-        digiLOW[pin1]();
+      case '\x54': {
+        unsigned long mhz = read_4bytes();
+        unsigned long pulse = read_4bytes();
+        if (pin1 < CHANNELS) {
+          setChannelRate(&channels[pin1], mhz, pulse);
+        }
         break;
       }
 
-      // read: '\x20' - '\x29'
-      case '\x20': {
-        int state = digiRead[pin1]();
-        Serial.write(state);
+      // sync pulses: '\x60' - '\x61'
+      case '\x60': {
+        unsigned int pulse = read_2bytes();
+        unsigned int lo = read_2bytes();
+        unsigned int hi = read_2bytes();
+        unsigned long seed = read_4bytes();
+        startSync(pin1, pulse, lo, hi, seed);
         break;
       }
 
-      case '\x21': {
-        int v = analogRead(pin1);
-        Serial.write(v);
+      case '\x61': {
+        stopSync();
         break;
       }
 
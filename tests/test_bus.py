@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import flkl
+from flkl.bus import COMMAND, EVENT, HOST_MICROS, EventBus, EventBusReader, payload
+from flkl.command import HIGH_FOR
+
+
+@pytest.fixture
+def name(request):
+    return f"flkl-test-{os.getpid()}-{request.node.name}"[:30]
+
+
+def test_round_trip(name):
+    bus = EventBus(name, 8)
+    reader = EventBusReader(name)
+    try:
+        bus.publish(6, 1000, host_ns=5)
+        bus.publish_events([6, -6], [2000, 3000], host_ns=6)
+        bus.publish_command(HIGH_FOR.opcode, HIGH_FOR.pack(4, 0)[1:], host_ns=7)
+        records = reader.poll()
+        assert records["event"].tolist() == [6, 6, -6, HIGH_FOR.opcode]
+        assert records["micros"].tolist() == [1000, 2000, 3000, HOST_MICROS]
+        assert records["host_ns"].tolist() == [5, 6, 6, 7]
+        assert records["kind"].tolist() == [EVENT, EVENT, EVENT, COMMAND]
+        # a zero duration ends the payload in NULs, which are kept
+        assert payload(records[3]) == b"\x04\x00\x00"
+        assert len(reader.poll()) == 0
+    finally:
+        reader.close()
+        bus.close()
+
+
+def test_lapped_reader_counts_lost_records(name):
+    bus = EventBus(name, 4)
+    reader = EventBusReader(name)
+    try:
+        bus.publish_events(list(range(10)), list(range(10)))
+        records = reader.poll()
+        assert records["event"].tolist() == [6, 7, 8, 9]
+        assert reader.lost == 6
+    finally:
+        reader.close()
+        bus.close()
+
+
+def test_from_start(name):
+    bus = EventBus(name, 4)
+    try:
+        bus.publish_events([1, 2, 3, 4, 5], [0] * 5)
+        reader = EventBusReader(name, from_start=True)
+        assert reader.poll()["event"].tolist() == [2, 3, 4, 5]
+        reader.close()
+    finally:
+        bus.close()
+
+
+def test_live_bus_is_not_replaced(name):
+    bus = EventBus(name, 4)
+    try:
+        with pytest.raises(RuntimeError, match=str(os.getpid())):
+            EventBus(name, 4)
+        bus.publish(6, 1)
+        reader = EventBusReader(name, from_start=True)
+        assert reader.poll()["event"].tolist() == [6]
+        reader.close()
+    finally:
+        bus.close()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="shared memory does not outlive its processes")
+def test_stale_bus_is_replaced(name):
+    # a writer that exits without closing its bus
+    code = (
+        "import os, sys\n"
+        "from multiprocessing import resource_tracker\n"
+        "from flkl.bus import EventBus\n"
+        "bus = EventBus(sys.argv[1], 4)\n"
+        "resource_tracker.unregister(bus.shm._name, 'shared_memory')\n"
+        "os._exit(0)\n"
+    )
+    root = os.path.dirname(os.path.dirname(flkl.__file__))
+    subprocess.run([sys.executable, "-c", code, name], check=True, cwd=root)
+    bus = EventBus(name, 4)
+    try:
+        bus.publish(7, 1)
+        reader = EventBusReader(name, from_start=True)
+        assert reader.poll()["event"].tolist() == [7]
+        reader.close()
+    finally:
+        bus.close()
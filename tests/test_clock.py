@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip("amas")
+pytest.importorskip("pyno")
+
+from flkl.clock import MICROS_RANGE, ClockSync, Unwrapper, unwrap_micros
+from flkl.share import CLOCK_EVENT
+
+
+def test_unwrap():
+    micros = [MICROS_RANGE - 10, MICROS_RANGE - 1, 5, 100]
+    unwrap = Unwrapper()
+    assert [unwrap(us) for us in micros] == [MICROS_RANGE - 10, MICROS_RANGE - 1, MICROS_RANGE + 5, MICROS_RANGE + 100]
+    assert unwrap_micros(micros).tolist() == [MICROS_RANGE - 10, MICROS_RANGE - 1, MICROS_RANGE + 5, MICROS_RANGE + 100]
+
+
+def test_not_synchronized_before_a_reply():
+    clock = ClockSync()
+    assert not clock.synchronized()
+    events, micros, hosts = clock.correct([6], [100], 1.0)
+    assert events == [6]
+    assert hosts[0] != hosts[0]
+
+
+def test_fit_recovers_offset_and_drift():
+    clock = ClockSync()
+    drift = 1e-6 * (1 + 50e-6)
+    for i in range(20):
+        board = 1_000_000 + i * 500_000
+        host = 10.0 + (board - 1_000_000) * drift
+        # one slow reply among fast ones is left out of the fit
+        rtt = 0.02 if i == 7 else 0.001
+        clock.ping_sent(host - rtt / 2)
+        clock.pong(board, host + rtt / 2)
+    assert clock.synchronized()
+    assert clock.drift == pytest.approx(drift, rel=1e-9)
+    assert clock.to_host(1_000_000 + 3_000_000) == pytest.approx(10.0 + 3_000_000 * drift, abs=1e-6)
+
+
+def test_correct_takes_clock_frames_out():
+    clock = ClockSync()
+    clock.ping_sent(4.999)
+    events, micros, hosts = clock.correct([CLOCK_EVENT, 6], [2_000_000, 2_500_000], 5.001)
+    assert events == [6] and micros == [2_500_000]
+    assert hosts == [pytest.approx(5.5)]
+
+
+def test_reply_without_ping_is_ignored():
+    clock = ClockSync()
+    clock.pong(100, 1.0)
+    assert not clock.synchronized()
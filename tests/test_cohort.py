@@ -0,0 +1,41 @@
+from flkl.cohort import is_text_session, load_text_events, session_format
+
+
+def test_mixed_rows(tmp_path):
+    path = tmp_path / "session.csv"
+    # rows gain the board column once the clock is synchronized
+    path.write_text("0.5, 100, 6\n0.6, 200, -6\n0.7, 300, 6, 0.69\n")
+    events = load_text_events(str(path), ("host", "micros", "event", "board"))
+    assert events["host"].tolist() == [0.5, 0.6, 0.7]
+    assert events["micros"].tolist() == [100, 200, 300]
+    assert events["event"].tolist() == [6, -6, 6]
+    assert events["board"][2] == 0.69
+
+
+def test_recorder_rows(tmp_path):
+    path = tmp_path / "session.txt"
+    path.write_text("1.25, (1000, 6)\n1.5, (2000, 7)\n")
+    events = load_text_events(str(path))
+    assert events["host"].tolist() == [1.25, 1.5]
+    assert events["event"].tolist() == [6, 7]
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "session.csv"
+    path.write_text("")
+    events = load_text_events(str(path))
+    assert len(events["host"]) == 0 and len(events["event"]) == 0
+
+
+def test_only_sessions_are_cataloged(tmp_path):
+    session = tmp_path / "session.csv"
+    session.write_text("0.5, 100, 6\n")
+    stray = tmp_path / "weights.csv"
+    stray.write_text("subject,weight\nm1,25.1\n")
+    sidecar = tmp_path / "session.sync.csv"
+    sidecar.write_text("0.5, 100\n")
+    assert is_text_session(str(session))
+    assert not is_text_session(str(stray))
+    assert session_format(str(session)) == "text"
+    assert session_format(str(stray)) is None
+    assert session_format(str(sidecar)) is None
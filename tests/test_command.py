@@ -0,0 +1,44 @@
+import pytest
+
+from flkl.command import COMMANDS, FLICK_FOR, HIGH_FOR, LAYOUTS, START_FLICKER
+
+
+def test_encode_scales_fields():
+    assert FLICK_FOR.encode((3, 12.5, 2000, 20, 4, 10)) == [3, 125, 2000, 20, 4, 10]
+    assert START_FLICKER.encode((0, 3, 40.0, 1.5, 0.005, 0, 0.0)) == [0, 3, 40000, 1500000, 5000, 0, 0]
+
+
+def test_encode_rejects_values_out_of_range():
+    with pytest.raises(ValueError, match="hz=25.6"):
+        FLICK_FOR.encode((3, 25.6, 2000, 20, 0, 0))
+    with pytest.raises(ValueError, match="millis"):
+        HIGH_FOR.encode((4, 70000))
+
+
+def test_exact():
+    assert FLICK_FOR.exact((3, 12.3, 2000, 20, 0, 0))
+    assert not FLICK_FOR.exact((3, 12.34, 2000, 20, 0, 0))
+    assert not FLICK_FOR.exact((3, 40.0, 2000, 20, 0, 0))
+    assert START_FLICKER.exact((0, 3, 12.345, 90.0, 0.02, 0, 0.0))
+
+
+def test_pack_round_trip():
+    data = FLICK_FOR.pack(3, 12.5, 2000, 20, 4, 10)
+    assert data[0] == FLICK_FOR.opcode
+    assert len(data) == FLICK_FOR.size
+    assert FLICK_FOR.unpack(data) == {
+        "pin": 3, "hz": 12.5, "flickr_duration": 2000, "pulse_duration": 20, "rpin": 4, "millis": 10,
+    }
+
+
+def test_pack_into_returns_the_end():
+    buffer = bytearray(32)
+    end = HIGH_FOR.pack_into(buffer, 5, 4, 100)
+    assert end == 5 + HIGH_FOR.size
+    assert bytes(buffer[5:end]) == HIGH_FOR.pack(4, 100)
+
+
+def test_layouts_cover_every_command():
+    for command in COMMANDS:
+        assert LAYOUTS[command.opcode] == command.layout
+    assert len({command.opcode for command in COMMANDS}) == len(COMMANDS)
@@ -0,0 +1,55 @@
+from struct import pack
+
+import pytest
+
+pytest.importorskip("amas")
+pytest.importorskip("pyno")
+
+from flkl.share import (BATCH_EVENT, LOST_EVENT, OVERFLOW_EVENT, EventSequence,
+                        decode_frames)
+
+
+def frame(pin: int, micros: int) -> bytes:
+    code = -pin | 0x80 if pin < 0 else pin
+    return pack("<BIB", code, micros, 0xA5)
+
+
+def test_decode_frames():
+    data = frame(6, 100) + frame(-6, 200) + frame(7, 0xFFFFFFFF)
+    events, micros, consumed = decode_frames(data)
+    assert events == [6, -6, 7]
+    assert micros == [100, 200, 0xFFFFFFFF]
+    assert consumed == len(data)
+
+
+def test_partial_frame_is_left_for_the_next_chunk():
+    data = frame(6, 100) + frame(7, 200)[:4]
+    events, micros, consumed = decode_frames(data)
+    assert events == [6] and micros == [100]
+    assert consumed == 6
+
+
+def test_resynchronizes_after_garbage():
+    data = b"\x01\x02\x03" + frame(6, 100) + frame(-7, 300)
+    events, micros, consumed = decode_frames(data)
+    assert events == [6, -7]
+    assert micros == [100, 300]
+    assert consumed == len(data)
+
+
+def test_sequence_reports_lost_and_dropped():
+    sequence = EventSequence()
+    events = [BATCH_EVENT, 6, -6, BATCH_EVENT, 6, OVERFLOW_EVENT, BATCH_EVENT, 7]
+    micros = [0, 10, 20, 2, 30, 4, 9, 40]
+    kept_events, kept_micros, reports = sequence.check(events, micros)
+    assert kept_events == [6, -6, 6, 7]
+    assert kept_micros == [10, 20, 30, 40]
+    # the third batch should have started at 3
+    assert reports == [(4, OVERFLOW_EVENT), (6, LOST_EVENT)]
+    assert sequence.lost == 6 and sequence.dropped == 4
+
+
+def test_sequence_wraps():
+    sequence = EventSequence()
+    _, _, reports = sequence.check([BATCH_EVENT, 6, BATCH_EVENT], [0xFFFFFFFF, 1, 0])
+    assert reports == []
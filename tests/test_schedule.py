@@ -0,0 +1,55 @@
+from collections import Counter
+
+from flkl.schedule import compile_schedule, gng_stimuli, training_stimuli
+
+EXPVARS = {
+    "rewarded-frequency": [10, 12],
+    "extinction-frequency": [4, 6],
+    "async-flickrs": [[9, 8]],
+    "audio-frequency": [7, 9],
+    "reward-probability-for-audio": 0.0,
+    "trials-per-stimulus": 5,
+    "ITI": 15.0,
+    "ITI-range": 5.0,
+}
+
+
+def test_same_seed_same_schedule():
+    a, seed = compile_schedule(EXPVARS, "gng", seed=1)
+    b, _ = compile_schedule(EXPVARS, "gng", seed=1)
+    c, _ = compile_schedule(EXPVARS, "gng", seed=2)
+    assert seed == 1
+    assert (a == b).all()
+    assert not (a == c).all()
+
+
+def test_seed_from_expvars():
+    a, seed = compile_schedule({**EXPVARS, "seed": 7})
+    b, _ = compile_schedule(EXPVARS, seed=7)
+    assert seed == 7
+    assert (a == b).all()
+
+
+def test_every_block_presents_each_stimulus_once():
+    stimuli = gng_stimuli(EXPVARS)
+    schedule, _ = compile_schedule(EXPVARS, "gng", seed=3)
+    assert len(schedule) == len(stimuli) * 5
+    assert list(schedule["trial"]) == list(range(1, len(schedule) + 1))
+    for block in schedule.reshape(5, len(stimuli)):
+        presented = Counter(zip(block["modality"].tolist(), block["vhz"].tolist(), block["ahz"].tolist()))
+        assert presented == Counter((m, float(v), float(a)) for m, v, a, _ in stimuli)
+
+
+def test_itis_and_rewards():
+    schedule, _ = compile_schedule(EXPVARS, "gng", seed=4)
+    assert ((schedule["iti"] >= 10.0) & (schedule["iti"] <= 20.0)).all()
+    visual = schedule["modality"] != 3
+    assert (schedule["reward"][visual] == (schedule["vhz"][visual] >= 10)).all()
+    # audio trials are never rewarded at probability 0
+    assert not schedule["reward"][~visual].any()
+
+
+def test_training_schedule():
+    schedule, _ = compile_schedule(EXPVARS, "training", seed=5)
+    assert len(schedule) == len(training_stimuli(EXPVARS)) * 5
+    assert set(schedule["modality"].tolist()) == {0, 1, 2}
@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("amas")
+pytest.importorskip("pyno")
+pytest.importorskip("utex")
+
+from flkl.schedule import compile_schedule
+from flkl.share import TRIAL_EVENT
+from flkl.sim import scale_expvars, simulate
+
+EXPVARS = {
+    "audio-pin": 2,
+    "visual-pin": 3,
+    "reward-pin": 4,
+    "response-pin": [6],
+    "reward-duration": 0.01,
+    "flickr-duration": 2.0,
+    "decision-duration": 1.0,
+    "required-lick": 1,
+    "reward-probability-for-audio": 0.0,
+    "rewarded-frequency": [10, 12],
+    "extinction-frequency": [4, 6],
+    "audio-frequency": [7, 9],
+    "test-frequency": 9,
+    "distractor-frequency": 1.0,
+    "ITI": 15.0,
+    "ITI-range": 5.0,
+}
+TRIALS = 6
+
+
+def load_rows(filename: str) -> list[list[float]]:
+    with open(filename) as f:
+        return [[float(field) for field in line.split(",")] for line in f]
+
+
+@pytest.mark.parametrize("protocol", ["ascii", "binary", "sequenced"])
+def test_session_on_simulated_boards(tmp_path, protocol):
+    expvars = scale_expvars(EXPVARS, 100.0)
+    schedule, _ = compile_schedule(expvars, seed=0)
+    filename = str(tmp_path / "sim.csv")
+
+    simulation = simulate(expvars, filename, rate=50.0, protocol=protocol, schedule=schedule[:TRIALS])
+
+    rows = load_rows(filename)
+    events = [int(row[2]) for row in rows]
+    assert events.count(TRIAL_EVENT) == TRIALS
+    assert 6 in events
+    assert simulation.controller_board.commands
+
+
+def test_probe_latencies_are_positive(tmp_path):
+    simulation = simulate({"response-pin": [6]}, str(tmp_path / "probe.csv"), rate=200.0,
+                          protocol="binary", probe_duration=1.0)
+
+    assert simulation.latencies
+    assert min(simulation.latencies) > 0.0
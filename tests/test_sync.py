@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from flkl.sync import align, detect_flashes, sync_intervals
+
+SEED = 12345
+
+
+def emissions(n: int = 60) -> np.ndarray:
+    intervals = sync_intervals(SEED, n - 1, 5000, 15000)
+    return np.concatenate([[2.0], 2.0 + np.cumsum(intervals) / 1e3])
+
+
+def test_intervals_are_reproducible():
+    intervals = sync_intervals(SEED, 50, 5000, 15000)
+    assert intervals == sync_intervals(SEED, 50, 5000, 15000)
+    assert intervals != sync_intervals(SEED + 1, 50, 5000, 15000)
+    assert all(5000 <= interval <= 15000 for interval in intervals)
+
+
+def test_align_with_missed_and_spurious_flashes():
+    board = emissions()
+    rng = np.random.default_rng(0)
+    # the camera clock runs 100 ppm fast and starts 30 s after the board
+    video = (board - 30.0) * 1.0001 + rng.uniform(-0.02, 0.02, len(board))
+    video = np.delete(video, [5, 6, 40])
+    video = np.sort(np.concatenate([video, [video[10] + 1.3, video[30] + 2.1]]))
+
+    alignment = align(video, board, tolerance=0.1)
+    assert len(alignment.video) == len(board) - 3
+    assert alignment.slope == pytest.approx(1 / 1.0001, abs=1e-4)
+    truth = video / 1.0001 + 30.0
+    matched = np.isin(video, alignment.video)
+    assert np.abs(alignment.to_board(video[matched]) - truth[matched]).max() < 0.05
+
+
+def test_align_rejects_unrelated_trains():
+    board = emissions()
+    video = np.cumsum(np.full(40, 10.0))
+    with pytest.raises(RuntimeError):
+        align(video, board, tolerance=0.05)
+
+
+def test_detect_flashes():
+    brightness = np.full(100, 10.0)
+    brightness[[20, 21, 50, 80, 81, 82]] = 200.0
+    assert detect_flashes(brightness).tolist() == [20, 50, 80]
+
+
+def test_frame_map(tmp_path):
+    pytest.importorskip("amas")
+    pytest.importorskip("pyno")
+    pytest.importorskip("pandas")
+
+    from flkl.sync import frame_map
+
+    board = emissions(30)
+    log = tmp_path / "session.sync.csv"
+    with open(log, "w") as f:
+        f.write(f"# host, micros; pin=5 pulse=0.05 interval=5.0-15.0 seed={SEED}\n")
+        for t in board:
+            f.write(f"{100.0 + t * 1.00002 + 0.003}, {int(t * 1e6)}\n")
+    rate = 30.0
+    frame_times = np.arange(int((board[-1] + 5.0) * rate)) / rate
+    brightness = np.full(len(frame_times), 10.0)
+    # the video starts with the board; each pulse lights one or two frames
+    brightness[np.ceil(board * rate).astype(int)] = 200.0
+
+    table, summary = frame_map(str(log), brightness, frame_times)
+    assert summary["matched"] == len(board)
+    assert np.abs(table["board"] - frame_times).max() < 2 / rate
+    assert np.abs(table["host"] - (100.0 + table["board"] * 1.00002)).max() < 0.01